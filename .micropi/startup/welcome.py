@@ -1,42 +1,137 @@
+import json
+import os
+import sys
+import threading
+import time
+
+# Boot timing is measured from here, before the (slow) library import
+START = time.monotonic()
+
 from micropi import OLED, Buzzer, LED
-from time import sleep
+
+TIMING_FILE = os.path.expanduser("~/.cache/micropi/boot.json")
+
+
+class Boot:
+
+    # Runs the startup tasks as a small dependency graph.
+    # Each task starts on its own thread as soon as the tasks it depends on
+    # have finished, so independent work overlaps.  Start and end times
+    # (seconds since the script started) are kept for every task.  A task
+    # that fails is reported and the tasks depending on it are skipped.
+
+    def __init__(self):
+        self.tasks = []
+        self.done = {}
+        self.results = {}
+        self.timing = {"import": {"start": 0.0, "end": time.monotonic() - START}}
+
+    def task(self, name, after=()):
+        def register(function):
+            self.tasks.append((name, function, after))
+            self.done[name] = threading.Event()
+            return function
+        return register
+
+    def execute(self, name, function, after):
+        for dependency in after:
+            self.done[dependency].wait()
+        try:
+            if all(dependency in self.results for dependency in after):
+                start = time.monotonic() - START
+                self.results[name] = function(*[self.results[d] for d in after])
+                self.timing[name] = {"start": start, "end": time.monotonic() - START}
+            else:
+                self.timing[name] = {"skipped": True}
+        except Exception as error:
+            print("startup task %s failed: %s" % (name, error), file=sys.stderr)
+            self.timing[name] = {"error": str(error)}
+        finally:
+            self.done[name].set()
+
+    def run(self):
+        threads = [threading.Thread(target=self.execute, args=task) for task in self.tasks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def publish(self, first_feedback):
+
+        # Prints the timing table and keeps it for the last boot
+
+        self.timing["first_feedback"] = first_feedback
+        self.timing["total"] = time.monotonic() - START
+        for name, entry in self.timing.items():
+            if isinstance(entry, dict) and "end" in entry:
+                print("%-14s %6.3f - %6.3f s" % (name, entry["start"], entry["end"]))
+        if first_feedback is not None:
+            print("first feedback %6.3f s" % first_feedback)
+        print("ready after %6.3f s" % self.timing["total"])
+        try:
+            os.makedirs(os.path.dirname(TIMING_FILE), exist_ok=True)
+            with open(TIMING_FILE, "w") as f:
+                json.dump(self.timing, f, indent=1)
+        except OSError:
+            pass
+
 
 def main():
 
-    oled = OLED()
-    buzzer =  Buzzer()
-    led =  LED()
+    boot = Boot()
+    feedback = {}
+
+    @boot.task("leds")
+    def leds():
+        led = LED()
+        led.set_color(0, 255, 0, 0)
+        feedback.setdefault("at", time.monotonic() - START)
+        return led
+
+    @boot.task("buzzer")
+    def buzzer():
+        return Buzzer()
 
-    oled.stats()
+    @boot.task("display")
+    def display():
+        oled = OLED()
+        oled.print(1, "MicroPi starting...")
+        feedback.setdefault("at", time.monotonic() - START)
+        return oled
 
-    delay = 0.3
+    @boot.task("ip")
+    def ip():
+        # don't hold the boot up for long if there is no network
+        return OLED.get_ip_address(10).split(" ")[0].strip() or "no network"
 
-    led.set_color(0,255,0,0)
-    buzzer.play("D",delay)
-    sleep(delay)
-    led.set_color(0,0,0,0)
+    @boot.task("stats", after=("display",))
+    def stats(oled):
+        return oled.system_info(ip_timeout=0)
 
-    led.set_color(1,0,255,0)
-    buzzer.play("E",delay)
-    sleep(delay)
-    led.set_color(1,0,0,0)
+    @boot.task("show_stats", after=("display", "stats", "ip"))
+    def show_stats(oled, info, address):
+        oled.stats((address,) + info[1:])
 
-    led.set_color(2,0,0,255)
-    buzzer.play("C",delay)
-    sleep(delay)
-    led.set_color(2,0,0,0)
+    @boot.task("jingle", after=("leds", "buzzer"))
+    def jingle(led, buzzer):
+        delay = 0.3
+        for index, colour, note, length in ((0, (255, 0, 0), "D", delay),
+                                            (1, (0, 255, 0), "E", delay),
+                                            (2, (0, 0, 255), "C", delay),
+                                            (3, (255, 255, 255), "c", delay),
+                                            (0, (0, 128, 128), "g", 1)):
+            led.set_color(index, *colour)
+            buzzer.play(note, length)
+            time.sleep(delay)
+            led.set_color(index, 0, 0, 0)
 
-    led.set_color(3,255,255,255)
-    buzzer.play("c",delay)
-    sleep(delay)
-    led.set_color(3,0,0,0)
+    @boot.task("logo", after=("show_stats", "jingle"))
+    def logo(*ready):
+        boot.results["display"].img()
 
-    led.set_color(0,0,128,128)
-    buzzer.play("g",1)
-    sleep(delay)
-    led.set_color(0,0,0,0)
+    boot.run()
+    boot.publish(feedback.get("at"))
 
-    oled.img()
 
 if __name__ == "__main__":
     # execute only if run as a script
@@ -0,0 +1,256 @@
+# Benchmark cases for the MicroPi library
+# Each case takes the run context and returns a dictionary of metrics:
+# {"metric_name": {"value": number, "unit": "ms", "better": "lower"}}
+# Cases that drive inputs from the simulator (IR frames, button edges)
+# only run against the simulated backend.  Cases that need something in
+# front of the board (an obstacle for the ultrasonic sensor) only run on
+# real hardware when the run was started with --stimulus.
+
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+LIB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib")
+
+
+def metric(value, unit, better="lower"):
+    return {"value": value, "unit": unit, "better": better}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class CountingI2C:
+
+    # Wraps a busio.I2C object and counts bytes written through it.
+    # Works for both the simulated and the real bus.
+
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.bytes = 0
+        self.transactions = 0
+
+    def writeto(self, address, buffer, start=0, end=None):
+        self.bytes += len(buffer[start:end])
+        self.transactions += 1
+        return self.i2c.writeto(address, buffer, start=start, end=end)
+
+    def __getattr__(self, name):
+        return getattr(self.i2c, name)
+
+
+class GPIOProbe:
+
+    # Wraps the GPIO module used by micropi and timestamps output writes
+
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self.writes = []
+
+    def output(self, channel, value):
+        self.writes.append((time.perf_counter(), channel, value))
+        return self.gpio.output(channel, value)
+
+    def __getattr__(self, name):
+        return getattr(self.gpio, name)
+
+
+def bench_import(ctx):
+
+    # Time taken by "import micropi" in a fresh interpreter
+
+    code = ("import sys, time; sys.path.insert(0, %r)\n" % LIB)
+    if ctx.sim:
+        code += "import micropi_sim; micropi_sim.install()\n"
+    code += ("t = time.perf_counter(); import micropi\n"
+             "print(time.perf_counter() - t)\n")
+    samples = []
+    for _ in range(ctx.repeat(5)):
+        out = subprocess.check_output([sys.executable, "-c", code]).decode().split()
+        samples.append(float(out[-1]) * 1000)
+    return {"import_ms": metric(statistics.median(samples), "ms")}
+
+
+def bench_oled(ctx):
+
+    # Time and bytes for one OLED text frame (OLED.print) including the
+    # fixed settle delay the library applies after each frame
+
+    micropi = ctx.micropi
+    real = micropi.i2cbus.i2c
+    counter = CountingI2C(real)
+    micropi.i2cbus.i2c = counter
+    try:
+        oled = micropi.OLED()
+        oled.print(1, "warm up")
+        frames = ctx.repeat(10)
+        counter.bytes = 0
+        start = time.perf_counter()
+        for i in range(frames):
+            oled.print(1 + i % 4, "frame %d" % i)
+        elapsed = time.perf_counter() - start
+    finally:
+        micropi.i2cbus.i2c = real
+    return {"oled_frame_ms": metric(elapsed * 1000 / frames, "ms"),
+            "oled_frame_bytes": metric(counter.bytes / frames, "bytes")}
+
+
+def bench_led(ctx):
+
+    # LED frame rate driving LED.set_color across all four pixels
+
+    led = ctx.micropi.LED()
+    frames = ctx.repeat(400)
+    start = time.perf_counter()
+    for i in range(frames):
+        led.set_color(i % 4, i % 256, (i * 3) % 256, (i * 7) % 256)
+    elapsed = time.perf_counter() - start
+    for i in range(4):
+        led.set_color(i, 0, 0, 0)
+    return {"led_fps": metric(frames / elapsed, "fps", "higher")}
+
+
+def bench_stepper(ctx):
+
+    # Step interval jitter of Stepper.forward at a 2 ms step delay.
+    # The p99 of a short run is close to its single worst interval, so the
+    # metrics are the medians over several runs.
+
+    micropi = ctx.micropi
+    delay = 0.002
+    real = micropi.GPIO
+    stepper = micropi.Stepper("STEPPER1")
+    c1 = stepper.config["c1"]
+    p50 = []
+    p99 = []
+    for _ in range(ctx.repeat(5)):
+        probe = GPIOProbe(real)
+        micropi.GPIO = probe
+        try:
+            stepper.forward(delay, ctx.repeat(100))
+        finally:
+            micropi.GPIO = real
+            stepper.stop()
+        starts = [t for t, channel, _ in probe.writes
+                  if channel == c1 or (isinstance(channel, (list, tuple)) and c1 in channel)]
+        errors = [abs((b - a) - delay) * 1e6 for a, b in zip(starts, starts[1:])]
+        p50.append(percentile(errors, 50))
+        p99.append(percentile(errors, 99))
+    return {"stepper_jitter_p50_us": metric(statistics.median(p50), "us"),
+            "stepper_jitter_p99_us": metric(statistics.median(p99), "us")}
+
+
+def bench_ultrasonic(ctx):
+
+    # Ranging rate of Sensor.sonicCheck against an obstacle at 30 cm
+
+    micropi = ctx.micropi
+    sensor = micropi.Sensor("ULTRASONIC", 10)
+    if ctx.sim:
+        ctx.sim.gpio.attach_ultrasonic(sensor.config["trigger"], sensor.config["echo"], 30)
+    readings = ctx.repeat(6)
+    start = time.perf_counter()
+    for _ in range(readings):
+        sensor.sonicCheck()
+    elapsed = time.perf_counter() - start
+    return {"ultrasonic_hz": metric(readings / elapsed, "Hz", "higher")}
+
+
+def bench_ir(ctx):
+
+    # CPU time spent by IRDetect.read while decoding NEC frames, as a
+    # percentage of the wall time of the frame, and the share of frames
+    # decoded.  Whether a frame decodes on the wall clock depends on how
+    # the host schedules the polling thread, so decoding is checked
+    # separately with the decoder and the frames on a virtual clock.
+
+    micropi = ctx.micropi
+    ir = micropi.IRDetect()
+    frames = ctx.repeat(10)
+    cpu = 0.0
+    wall = 0.0
+    for _ in range(frames):
+        end = ctx.sim.gpio.send_nec(ir.irPIN, 0x00, 0x18)
+        w = time.perf_counter()
+        c = time.process_time()
+        ir.read()
+        cpu += time.process_time() - c
+        wall += time.perf_counter() - w
+        while time.monotonic() < end + 0.01:
+            time.sleep(0.001)
+        ctx.sim.gpio.set_source(ir.irPIN, None)
+    return {"ir_decode_cpu_pct": metric(100.0 * cpu / wall, "%"),
+            "ir_decoded_ratio": metric(decode_virtual(ctx, ir, frames), "ratio", "higher")}
+
+
+def decode_virtual(ctx, ir, frames):
+
+    # Returns the share of NEC frames IRDetect.read decodes when the frames
+    # and the decoder's polling both run on a micropi_sim.VirtualClock
+
+    import micropi_sim
+    virtual = micropi_sim.VirtualClock()
+    ctx.micropi.clock.use(virtual)
+    micropi_sim.use_clock(virtual)
+    decoded = 0
+    try:
+        for _ in range(frames):
+            end = ctx.sim.gpio.send_nec(ir.irPIN, 0x00, 0x18)
+            if ir.read() is not None:
+                decoded += 1
+            virtual.sleep(end + 0.01 - virtual.monotonic())
+            ctx.sim.gpio.set_source(ir.irPIN, None)
+    finally:
+        micropi_sim.use_clock(None)
+        ctx.micropi.clock.use(None)
+    return float(decoded) / frames
+
+
+def bench_buttons(ctx):
+
+    # Latency from a button edge to the Buttons callback
+
+    micropi = ctx.micropi
+    buttons = micropi.Buttons()
+    seen = threading.Event()
+    stamps = []
+
+    def pressed(channel):
+        stamps.append(time.perf_counter())
+        seen.set()
+
+    buttons.setcallback(pressed, pressed)
+    latencies = []
+    for _ in range(ctx.repeat(50)):
+        seen.clear()
+        t = time.perf_counter()
+        ctx.sim.gpio.set_input(buttons.pb1, 1)
+        seen.wait(1.0)
+        if stamps:
+            latencies.append((stamps.pop() - t) * 1e6)
+        ctx.sim.gpio.set_input(buttons.pb1, 0)
+        time.sleep(0.002)
+    ctx.micropi.GPIO.remove_event_detect(buttons.pb1)
+    ctx.micropi.GPIO.remove_event_detect(buttons.pb2)
+    return {"button_latency_p50_us": metric(percentile(latencies, 50), "us"),
+            "button_latency_max_us": metric(max(latencies) if latencies else 0.0, "us")}
+
+
+# name, function, requirement ("sim", "stimulus" or None)
+CASES = [
+    ("import", bench_import, None),
+    ("oled", bench_oled, None),
+    ("led", bench_led, None),
+    ("stepper", bench_stepper, None),
+    ("ultrasonic", bench_ultrasonic, "stimulus"),
+    ("ir", bench_ir, "sim"),
+    ("buttons", bench_buttons, "sim"),
+]
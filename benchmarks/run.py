@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+# Benchmark runner for the MicroPi library
+# Runs the cases in cases.py against the simulated backend (default when
+# no board is present) or the real hardware, writes the results as JSON
+# and compares them against a stored baseline.
+#
+#   python3 benchmarks/run.py                       run and compare
+#   python3 benchmarks/run.py --save-baseline       record a new baseline
+#   python3 benchmarks/run.py --hw --stimulus       real board, obstacle placed
+#
+# Exit status is 1 when any metric regresses beyond its threshold.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "lib"))
+sys.path.insert(0, HERE)
+
+from cases import CASES
+
+
+class Context:
+
+    # Shared state handed to every benchmark case
+    # sim = the micropi_sim Simulator, or None on real hardware
+    # micropi = the imported micropi module
+    # quick = run fewer iterations (for smoke testing the suite)
+
+    def __init__(self, sim, micropi, quick):
+        self.sim = sim
+        self.micropi = micropi
+        self.quick = quick
+
+    def repeat(self, count):
+        return max(2, count // 5) if self.quick else count
+
+
+def board_present():
+    try:
+        import RPi.GPIO
+    except ImportError:
+        return False
+    return os.path.exists("/dev/gpiomem")
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, thresholds):
+
+    # Compares results against the baseline metric by metric.
+    # thresholds maps metric names (or "default") to the allowed relative
+    # regression, e.g. 0.10 for 10%, or to {"relative": 0.10, "absolute":
+    # 500} for a noisy metric that must also move by more than the
+    # absolute amount (in the metric's unit) to count.
+    # Returns a list of (metric, baseline value, new value, change) for
+    # every regression.
+
+    regressions = []
+    default = thresholds.get("default", 0.10)
+    for name, entry in results["metrics"].items():
+        base = baseline["metrics"].get(name)
+        if base is None or base["value"] == 0:
+            continue
+        worse = entry["value"] - base["value"]
+        if entry["better"] == "higher":
+            worse = -worse
+        change = worse / abs(base["value"])
+        limit = thresholds.get(name, default)
+        if isinstance(limit, dict):
+            if worse <= limit.get("absolute", 0.0):
+                continue
+            limit = limit.get("relative", default)
+        if change > limit:
+            regressions.append((name, base["value"], entry["value"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MicroPi library benchmarks")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--sim", action="store_true", help="force the simulated backend")
+    mode.add_argument("--hw", action="store_true", help="force the real hardware")
+    parser.add_argument("--stimulus", action="store_true",
+                        help="external stimulus is in place (obstacle in front of the sensor)")
+    parser.add_argument("--only", help="comma separated list of cases to run")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations")
+    parser.add_argument("--out", default=os.path.join(HERE, "results.json"))
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"))
+    parser.add_argument("--thresholds", default=os.path.join(HERE, "thresholds.json"))
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results as the new baseline")
+    args = parser.parse_args()
+
+    sim = None
+    if args.sim or (not args.hw and not board_present()):
+        import micropi_sim
+        sim = micropi_sim.install()
+        micropi_sim.SimI2C.simulate_timing = True
+    import micropi
+
+    ctx = Context(sim, micropi, args.quick)
+    selected = args.only.split(",") if args.only else None
+    results = {"backend": "sim" if sim else "hw",
+               "python": platform.python_version(),
+               "machine": platform.machine(),
+               "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "metrics": {},
+               "skipped": []}
+
+    for name, case, requires in CASES:
+        if selected is not None and name not in selected:
+            continue
+        if (requires == "sim" and sim is None) or \
+                (requires == "stimulus" and sim is None and not args.stimulus):
+            results["skipped"].append(name)
+            print("%-12s skipped (needs %s)" % (name, requires))
+            continue
+        metrics = case(ctx)
+        for metric_name, entry in metrics.items():
+            print("%-12s %-26s %12.3f %s" % (name, metric_name, entry["value"], entry["unit"]))
+        results["metrics"].update(metrics)
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Baseline written to", args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at", args.baseline, "- run with --save-baseline first")
+        return 0
+    baseline = load_json(args.baseline)
+    if baseline.get("backend") != results["backend"]:
+        print("Baseline was recorded on the %s backend, not comparing" % baseline.get("backend"))
+        return 0
+    thresholds = load_json(args.thresholds) if os.path.exists(args.thresholds) else {}
+    regressions = compare(results, baseline, thresholds)
+    for name, before, after, change in regressions:
+        print("REGRESSION %-26s %12.3f -> %12.3f (%+.1f%%)" % (name, before, after, change * 100))
+    if regressions:
+        return 1
+    print("No regressions against", args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
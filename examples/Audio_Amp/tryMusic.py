@@ -1,20 +1,13 @@
-import RPi.GPIO as GPIO 
-import time
-import subprocess
+from micropi import AudioPlayer
 
-GPIO.setmode(GPIO.BCM)
+# The player switches the amplifier (GPIO 13) on while sound is playing
+# and off again after two seconds of silence.
+player = AudioPlayer()
 
-audioPIN = 13
-GPIO.setup(audioPIN, GPIO.OUT)
+player.load("sample1", "/home/pi/Music/sample1.wav")
+print("Playing sample1.wav")
+player.play("sample1")
+player.wait()
 
-GPIO.output(audioPIN, GPIO.HIGH)
-print("Audio PIN is now switched on")
-
-subprocess.run(['aplay', '/home/pi/Music/sample1.wav'], timeout=10)
-
-GPIO.output(audioPIN, GPIO.LOW)
+player.close()
 print("Audio PIN is now switched off")
-
-#Reset ports used by motor program back to input mode
-GPIO.cleanup()
-
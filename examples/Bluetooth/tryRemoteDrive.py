@@ -0,0 +1,15 @@
+# Drives the robot from the BlueDot app on a phone.
+# Hold the dot and move your finger to steer; let go to stop.  The motors
+# also stop if the phone goes quiet for a second.
+
+import time
+from micropi import Motor, LinkedMotors, RemoteDrive
+
+left = LinkedMotors(Motor("MOTOR1"), Motor("MOTOR2"))
+right = LinkedMotors(Motor("MOTOR3"), Motor("MOTOR4"))
+drive = RemoteDrive(left, right).start()
+try:
+    while True:
+        time.sleep(1)
+except KeyboardInterrupt:
+    drive.stop()
@@ -0,0 +1,26 @@
+# Brings the whole robot up from robot.toml and drives until something is
+# in the way.  The bring-up timing shows the OLED starting alongside the
+# motor and sensor pin setup.
+
+import time
+import micropi_board
+
+board = micropi_board.load("robot.toml")
+print(board.report())
+board.display.print(1, "Profile loaded")
+
+try:
+    while True:
+        board.distance.sonicCheck()
+        if board.distance.Triggered:
+            board.left.stop()
+            board.right.stop()
+            board.buzzer.play("C", 0.2)
+        else:
+            board.left.forward(60)
+            board.right.forward(60)
+        time.sleep(0.05)
+except KeyboardInterrupt:
+    pass
+finally:
+    board.close()
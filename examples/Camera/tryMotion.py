@@ -0,0 +1,18 @@
+# Watches the camera and prints where motion is seen and where a dark
+# line is in front of the robot.  Pass a video file or a directory of
+# images instead of using the camera module, e.g.
+#   python3 tryMotion.py frames/
+
+import sys
+import time
+from micropi import Camera
+
+camera = Camera(sys.argv[1] if len(sys.argv) > 1 else "picamera").start()
+try:
+    while True:
+        result = camera.latest()
+        if result is not None:
+            print("frame", result.index, "motion", result.motion, "line", result.line)
+        time.sleep(0.2)
+except KeyboardInterrupt:
+    camera.close()
@@ -0,0 +1,43 @@
+# Drives a timed motion script with the obstacle check running in between.
+# The steps are due at fixed times from the start, so the waits do not
+# drift, and the script stops the motors as soon as the ultrasonic sensor
+# sees something closer than 15 cm.  The timing of every step is printed
+# at the end.
+
+from micropi import LED, Motor, MotionExecutor, Sensor
+
+SCRIPT = """
+until obstacle
+led set_color 0 0 255 0
+left forward 60
+right forward 60
+wait 3
+left stop
+right stop
+led set_color 0 255 128 0
+wait 1
+left reverse 50
+right reverse 50
+wait 1.5
+right forward 50        # spin on the spot
+wait 0.8
+left stop
+right stop
+led set_color 0 0 0 0
+"""
+
+sonar = Sensor("ULTRASONIC", 15)
+
+
+def obstacle():
+    distance = sonar.ping()
+    return distance is not None and distance < sonar.boundary
+
+
+executor = MotionExecutor({"left": Motor("MOTOR1"), "right": Motor("MOTOR2"), "led": LED()},
+                          {"obstacle": obstacle}, poll=0.06)
+run = executor.run(SCRIPT)
+for timing in run.timings:
+    print("%5.2f s  %-6s %-10s late %6.2f ms, took %6.2f ms"
+          % (timing.offset, timing.target, timing.action, timing.error * 1000, timing.duration * 1000))
+print(run.report())
@@ -0,0 +1,29 @@
+# Finds the Grove I2C sensors that are plugged in and shows their latest
+# readings on the Grove LCD (if there is one) and in the terminal.
+# The sensors are read in the background, each at its own rate; the loop
+# here only looks at the shared table of readings.
+
+import time
+from micropi import GroveLCD
+from micropi_grove import GrovePoller
+
+poller = GrovePoller()
+found = poller.discover(rates={"adxl345": 20})
+for address, name in sorted(found.items()):
+    print("0x%02x  %s" % (address, name or "(no driver)"))
+lcd = GroveLCD() if 0x3e in found else None
+poller.start()
+
+try:
+    while True:
+        time.sleep(0.5)
+        table = poller.table()
+        for name, reading in sorted(table.items()):
+            print("%-8s %5.1f s ago  %s" % (name, time.time() - reading.time, reading.values))
+        if lcd is not None and "bmp280" in table:
+            values = table["bmp280"].values
+            lcd.setText("%.1f C\n%.1f hPa" % (values["temperature"], values["pressure"]))
+except KeyboardInterrupt:
+    for name, entry in poller.stats().items():
+        print(name, entry)
+    poller.stop()
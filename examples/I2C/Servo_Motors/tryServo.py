@@ -1,6 +1,22 @@
-import adafruit_pca9685
-#from adafruit_pca9685 import ServoKit
-#kit = ServoKit(channels=16)
+from micropi import ServoBank
+import time
 
 # Initialise the PCA9685 using the default address (0x40).
-pwm = adafruit_pca.pca9685()
\ No newline at end of file
+servos = ServoBank(0x40)
+
+# Calibrate the pulse range of the servo on channel 7 (saved for next time).
+# This is an example for the Micro servo - TowerPro SG-92R
+servos.calibrate(7, min_pulse=500, max_pulse=2400)
+
+# Centre servos 0 to 7, then sweep them all together.
+servos.move({channel: 90 for channel in range(8)}, duration=0)
+servos.wait()
+time.sleep(0.5)
+
+for cycle in range(3):
+    servos.move({channel: 0 for channel in range(8)}, duration=1.0)
+    servos.wait()
+    servos.move({channel: 180 for channel in range(8)}, duration=1.0, profile="ease")
+    servos.wait()
+
+servos.close()
@@ -0,0 +1,54 @@
+# Teach a route with the IR remote, then let the robot drive it again.
+# Up/Down/Left/Right drive and OK stops, as in a normal remote control.
+# 1 starts recording, 2 stops and saves it to route.mpdr, 3 replays it at
+# normal speed, 4 at half speed and 5 at double speed, 6 replays from
+# halfway through.  Any key stops a replay that is still running.
+
+from micropi import IRDetect, Motor, LinkedMotors, DriveRecorder, DrivePlayer, MotionExecutor
+
+left = LinkedMotors(Motor("MOTOR1"), Motor("MOTOR2"))
+right = LinkedMotors(Motor("MOTOR3"), Motor("MOTOR4"))
+recorder = DriveRecorder()
+teach_left = recorder.track("left", left)
+teach_right = recorder.track("right", right)
+ir = IRDetect()
+executor = MotionExecutor()
+route = None
+replay = None
+
+moves = {"Up": (("forward", 60), ("forward", 60)),
+         "Down": (("reverse", 60), ("reverse", 60)),
+         "Left": (("reverse", 40), ("forward", 40)),
+         "Right": (("forward", 40), ("reverse", 40))}
+
+while True:
+    key = ir.read()
+    if key is None:
+        continue
+    if replay is not None:
+        finished = replay.done.is_set()
+        replay.stop().wait()
+        print(replay.report())
+        replay = None
+        if not finished:
+            continue
+    if key in moves:
+        (action, speed), (other, other_speed) = moves[key]
+        getattr(teach_left, action)(speed)
+        getattr(teach_right, other)(other_speed)
+    elif key == "OK":
+        teach_left.stop()
+        teach_right.stop()
+    elif key == "1":
+        recorder.start()
+        print("Recording")
+    elif key == "2":
+        route = recorder.stop()
+        route.save("route.mpdr")
+        print("Saved %d commands over %.1f s (%d repeats dropped)"
+              % (len(route.events), route.duration, recorder.repeats))
+    elif key in ("3", "4", "5", "6") and route is not None:
+        scale = {"3": 1.0, "4": 0.5, "5": 2.0, "6": 1.0}[key]
+        start = route.duration / 2 if key == "6" else 0.0
+        player = DrivePlayer(route, {"left": teach_left, "right": teach_right}, executor)
+        replay = player.start(scale, start)
@@ -0,0 +1,22 @@
+# Maps the surroundings with the ultrasonic sensor on a servo.
+# The sensor sits on the servo on PCA9685 channel 0, facing straight ahead
+# at 90 degrees.  Each sweep is fused into the occupancy grid, which is
+# printed along with the nearest obstacle ahead, to the left and right.
+
+import time
+from micropi import Sensor, ServoBank, ServoMount, SonarMap
+
+servos = ServoBank(0x40)
+sonar = Sensor("ULTRASONIC", 10)
+mapper = SonarMap(sonar, ServoMount(servos, channel=0), size=400)
+
+try:
+    while True:
+        start = time.monotonic()
+        readings = mapper.sweep(-90, 90, 5)
+        print(mapper.render(48))
+        print("%d readings in %.1f s" % (len(readings), time.monotonic() - start))
+        for name, bearing in (("left", 90), ("ahead", 0), ("right", -90)):
+            print("%-6s %s cm" % (name, mapper.nearest(bearing)))
+except KeyboardInterrupt:
+    servos.close()
@@ -0,0 +1,41 @@
+# Obstacle avoider whose control loop is watched by the supervisor.
+# The loop heartbeats every 50 ms; if it ever stalls for more than 150 ms
+# (a sensor hang, a slow print over ssh, the garbage collector...) the
+# supervisor's watchdog thread stops the motors on its own.  The loop
+# timing statistics are printed and saved to loops.json on Ctrl-C, to
+# help pick a loop rate the Pi can actually keep up with.
+
+from micropi import Motor, Sensor, supervisor
+import time
+
+m1 = Motor("MOTOR1")
+m2 = Motor("MOTOR2")
+distance = Sensor("ULTRASONIC", 10)
+supervisor.guard(m1, m2)
+supervisor.on_trip(lambda watch: print("%s loop stalled, motors stopped" % watch.name))
+
+try:
+    with supervisor.watch("avoid", 0.05, timeout=0.15) as loop:
+        while True:
+            if not loop.heartbeat():
+                time.sleep(0.5)     # let things settle after a trip
+                loop.heartbeat()
+            distance.sonicCheck()
+            if distance.Triggered:
+                # a deliberate long manoeuvre, so stop supervising it
+                loop.pause()
+                m1.reverse(50)
+                m2.reverse(50)
+                time.sleep(1)
+                m1.forward(60)
+                m2.stop()
+                time.sleep(1)
+                loop.heartbeat()
+            m1.forward(60)
+            m2.forward(60)
+            time.sleep(0.05)
+except KeyboardInterrupt:
+    m1.stop()
+    m2.stop()
+    print(supervisor.report())
+    supervisor.save("loops.json")
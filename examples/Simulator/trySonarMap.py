@@ -0,0 +1,32 @@
+# Builds an occupancy grid of the simulated arena from sonar sweeps.
+# The robot visits a few places in the arena; at each one a 180 degree
+# sweep with 1 cm of range noise is fused into the map, which is printed
+# along with how long the fusing took and the nearest obstacles.
+#
+#   python3 trySonarMap.py
+
+import math
+import time
+import numpy as np
+import micropi_sim
+
+sim = micropi_sim.install()
+world = micropi_sim.World("arena.json").attach(sim)
+from micropi import SonarMap
+
+mapper = SonarMap(size=300, resolution=2)
+bearings = np.arange(-90, 91, 5)
+# map coordinates are centred on the middle of the 200 x 150 cm arena
+for x, y, heading in ((50, 75, 0), (50, 75, 180), (150, 30, 90), (150, 120, 270), (160, 75, 180)):
+    world.x, world.y, world.heading = x, y, math.radians(heading)
+    pose = (x - 100.0, y - 75.0, heading)
+    ranges = world.scan(bearings, noise=1.0)
+    start = time.perf_counter()
+    mapper.update(bearings, ranges, pose)
+    print("sweep at (%3d, %3d) fused in %.2f ms" % (x, y, (time.perf_counter() - start) * 1000))
+
+print(mapper.render(75))
+world.x, world.y, world.heading = 50, 75, 0.0
+for bearing in (0, 90, -90, 180):
+    print("bearing %4d: map %5.1f cm, true %5.1f cm"
+          % (bearing, mapper.nearest(bearing, pose=(-50, 0, 0)), world.ray(math.radians(bearing))))
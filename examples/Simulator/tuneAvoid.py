@@ -0,0 +1,40 @@
+# Tunes the obstacle avoider in the simulated arena.
+# Each combination of trigger distance and speed drives for two virtual
+# minutes in its own process, much faster than real time, and the runs
+# are ranked by distance covered with a penalty for hitting walls.
+#
+#   python3 tuneAvoid.py
+
+import time
+import micropi_sim
+
+
+def avoid(params):
+    from micropi import Motor, Sensor
+    m1 = Motor("MOTOR1")
+    m2 = Motor("MOTOR2")
+    distance = Sensor("ULTRASONIC", params["distance"])
+    while True:
+        m1.forward(params["speed"])
+        m2.forward(params["speed"])
+        distance.sonicCheck()
+        if distance.Triggered:
+            m1.reverse(50)
+            m2.reverse(50)
+            time.sleep(0.5)
+            m1.forward(60)
+            m2.stop()
+            time.sleep(params["turn"])
+        time.sleep(0.02)
+
+
+if __name__ == "__main__":
+    param_sets = [{"distance": d, "speed": s, "turn": t}
+                  for d in (10, 20, 30) for s in (40, 70, 100) for t in (0.3, 0.6)]
+    start = time.time()
+    runs = micropi_sim.batch(avoid, "arena.json", param_sets, duration=120)
+    print("%d runs of 120 s in %.1f s" % (len(runs), time.time() - start))
+    runs.sort(key=lambda run: run[1]["distance"] - 100 * run[1]["collisions"], reverse=True)
+    for params, result in runs[:5]:
+        print("%(distance)3d cm  speed %(speed)3d  turn %(turn).1f s" % params,
+              " -> %(distance)6.0f cm travelled, %(collisions)d collisions" % result)
@@ -1,20 +1,9 @@
-import RPi.GPIO as GPIO 
-import time
-import subprocess
+from micropi import AudioPlayer
 
-GPIO.setmode(GPIO.BCM)
+player = AudioPlayer()
 
-audioPIN = 13
-GPIO.setup(audioPIN, GPIO.OUT)
-
-GPIO.output(audioPIN, GPIO.HIGH)
-print("Audio PIN is now switched on")
-
-subprocess.run(['aplay', 'voice1.wav'])
-
-GPIO.output(audioPIN, GPIO.LOW)
-print("Audio PIN is now switched off")
-
-#Reset ports used by motor program back to input mode
-GPIO.cleanup()
+print("Playing voice1.wav")
+player.play("voice1.wav")
+player.wait()
 
+player.close()
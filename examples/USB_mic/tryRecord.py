@@ -1,4 +1,10 @@
-import subprocess
+# Records what is said into the USB microphone.
+# Waits for speech and saves the first stretch of it, with a little
+# audio from just before it, to voice1.wav.
 
-subprocess.run(['arecord', 'voice1.wav'], timeout=10)
+from micropi import Microphone
 
+mic = Microphone(device="plughw:1")
+files = mic.save_voiced("voice1.wav")
+mic.close()
+print("Saved", files[0] if files else "nothing")
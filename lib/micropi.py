@@ -4,7 +4,11 @@
 # Developed by: SB Components & Hypersmart Ltd
 # Project: MicroPi
 
-import RPi.GPIO as GPIO                     # RPi GPIO Library
+import os
+if os.environ.get("MICROPI_GPIO") == "gpiod":
+    import micropi_gpiod as GPIO            # GPIO character device backend
+else:
+    import RPi.GPIO as GPIO                 # RPi GPIO Library
 from rpi_ws281x import PixelStrip, Color    # ws281x Library, may need to disable audio?
 #import Adafruit_SSD1306                     # Adafruit SSD1306 LCD Display
 from board import SCL, SDA
@@ -12,16 +16,953 @@ import busio
 import adafruit_ssd1306
 # Create the I2C interface.
 i2c = busio.I2C(SCL, SDA)
-from PIL import Image, ImageDraw, ImageFont # Pillow Image Library
+from PIL import Image, ImageDraw, ImageFont, ImageSequence # Pillow Image Library
 import subprocess
+import sys
 import argparse
+import bisect
+import contextlib
+import gc
+import hashlib
+import heapq
+import json
+import math
+import shlex
+import struct
+import threading
 import time
 from time import sleep
+from collections import deque, namedtuple
+import wave
+try:
+    import numpy as np                      # used by the audio, camera and mapping classes
+except ImportError:
+    np = None
 
 GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
 
-class Motor:
+
+class PinConflictError(Exception):
+
+    # Raised when a pin is claimed by a second device or in another mode
+
+    pass
+
+
+class Clock:
+
+    # Time source used by the device classes for sleeping and timestamps.
+    # Normally the system clock; the simulator switches it to a virtual
+    # clock with use() so controllers run faster than real time.  The
+    # background worker threads (I2C bus, players, PWM, servo ticks) keep
+    # to real time.
+
+    def __init__(self):
+        self.use(None)
+
+    def use(self, source):
+
+        # Arguments:
+        # source = object with sleep(), time(), monotonic() and
+        # perf_counter(), or None for the system clock
+
+        source = source or time
+        self.sleep = source.sleep
+        self.time = source.time
+        self.monotonic = source.monotonic
+        self.perf_counter = source.perf_counter
+
+
+clock = Clock()
+
+
+class Realtime:
+
+    # Opt-in real-time mode for micropi's timing threads.
+    # Long running timing threads (software PWM, servo ticks, audio mixing,
+    # remote drive control) register() themselves, and the timing loops
+    # run in the caller's thread (stepper phases, ultrasonic echo, IR
+    # decoding) are wrapped in critical().  Until enable() is called both
+    # do nothing.  Once enabled, registered threads and critical sections
+    # run under SCHED_FIFO at the given priority, optionally pinned to one
+    # core, memory is locked with mlockall, the objects alive at enable
+    # time are frozen out of the garbage collector, the collector is
+    # paused inside critical sections and the GIL switch interval is cut
+    # so a woken timing thread gets the interpreter back quickly.
+    # Scheduling and locking need root (or CAP_SYS_NICE / CAP_IPC_LOCK);
+    # what could not be applied is listed in errors.
+
+    MCL_CURRENT = 1
+    MCL_FUTURE = 2
+
+    def __init__(self):
+        self.enabled = False
+        self.priority = 50
+        self.cpus = None
+        # native thread id: priority boost over the timing threads
+        self.threads = {}
+        self.errors = []
+        self.local = threading.local()
+        self.switch_interval = sys.getswitchinterval()
+
+    def enable(self, priority=50, cpu=None, lock_memory=True, freeze_gc=True, switch_interval=0.0005):
+
+        # Turns real-time mode on; returns the list of errors
+        # Arguments:
+        # priority = SCHED_FIFO priority (1-99)
+        # cpu = core to pin timing threads to (e.g. 3 with isolcpus=3), or None
+        # lock_memory = mlockall() current and future pages
+        # freeze_gc = gc.freeze() the objects alive now
+        # switch_interval = GIL switch interval in seconds (None leaves it)
+
+        self.enabled = True
+        self.priority = priority
+        self.cpus = None if cpu is None else {cpu}
+        if lock_memory:
+            self.mlockall(self.MCL_CURRENT | self.MCL_FUTURE)
+        if freeze_gc:
+            gc.collect()
+            gc.freeze()
+        if switch_interval:
+            sys.setswitchinterval(switch_interval)
+        for tid, boost in list(self.threads.items()):
+            self.promote(tid, boost)
+        return self.errors
+
+    def disable(self):
+
+        # Returns registered threads to normal scheduling and undoes enable()
+
+        for tid in list(self.threads):
+            self.demote(tid)
+        self.enabled = False
+        gc.unfreeze()
+        sys.setswitchinterval(self.switch_interval)
+        self.mlockall(None)
+
+    def mlockall(self, flags):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        result = libc.mlockall(flags) if flags is not None else libc.munlockall()
+        if result != 0:
+            self.error("mlockall", OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno())))
+
+    def error(self, what, error):
+        message = "%s: %s" % (what, error)
+        if message not in self.errors:
+            self.errors.append(message)
+            print("micropi real-time mode: cannot apply", message)
+
+    def promote(self, tid, boost=0):
+        try:
+            os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(min(99, self.priority + boost)))
+        except OSError as error:
+            self.error("SCHED_FIFO", error)
+        if self.cpus:
+            try:
+                os.sched_setaffinity(tid, self.cpus)
+            except OSError as error:
+                self.error("CPU affinity", error)
+
+    def demote(self, tid):
+        try:
+            os.sched_setscheduler(tid, os.SCHED_OTHER, os.sched_param(0))
+            os.sched_setaffinity(tid, range(os.cpu_count()))
+        except OSError:
+            pass
+
+    def register(self, boost=0):
+
+        # Called at the start of a long running timing thread
+        # Arguments:
+        # boost = priority above the other timing threads (for watchdogs)
+
+        tid = threading.get_native_id()
+        self.threads[tid] = boost
+        if self.enabled:
+            self.promote(tid, boost)
+
+    def unregister(self):
+        self.threads.pop(threading.get_native_id(), None)
+
+    @contextlib.contextmanager
+    def critical(self):
+
+        # Runs the enclosed timing loop under SCHED_FIFO with the garbage
+        # collector paused, restoring the thread's scheduling afterwards
+
+        if not self.enabled or getattr(self.local, "depth", 0):
+            yield
+            return
+        tid = threading.get_native_id()
+        policy = os.sched_getscheduler(tid)
+        param = os.sched_getparam(tid)
+        affinity = os.sched_getaffinity(tid)
+        collecting = gc.isenabled()
+        self.local.depth = 1
+        gc.disable()
+        self.promote(tid)
+        try:
+            yield
+        finally:
+            try:
+                os.sched_setscheduler(tid, policy, param)
+                os.sched_setaffinity(tid, affinity)
+            except OSError:
+                pass
+            if collecting:
+                gc.enable()
+            self.local.depth = 0
+
+    def jitter(self, period=0.001, seconds=2.0):
+
+        # Measures wake-up latency of a periodic loop run as a timing thread
+        # and returns {"p50", "p99", "max"} in microseconds
+        # Arguments:
+        # period = loop period in seconds
+        # seconds = how long to measure
+
+        late = []
+
+        def loop():
+            self.register()
+            with self.critical():
+                deadline = time.perf_counter() + period
+                for i in range(int(seconds / period)):
+                    delay = deadline - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    late.append(time.perf_counter() - deadline)
+                    deadline += period
+            self.unregister()
+
+        thread = threading.Thread(target=loop)
+        thread.start()
+        thread.join()
+        late.sort()
+        return {"p50": late[len(late) // 2] * 1e6, "p99": late[int(len(late) * 0.99)] * 1e6,
+                "max": late[-1] * 1e6}
+
+
+realtime = Realtime()
+
+
+class LoopWatch:
+
+    # One control loop registered with a Supervisor.
+    # Call heartbeat() once per iteration.  Each interval between beats is
+    # recorded: lateness beyond the period goes into a histogram, and an
+    # interval more than 5% over the period counts as an overrun.
+    # heartbeat() returns False on the first beat after the supervisor had
+    # to stop the motors, so the loop knows to re-plan.
+
+    # histogram bucket upper edges, in seconds of lateness
+    EDGES = (0.0, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+    def __init__(self, supervisor, name, period, timeout):
+        self.supervisor = supervisor
+        self.name = name
+        self.period = period
+        self.timeout = timeout
+        self.last = None
+        self.deadline = float("inf")
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.overruns = 0
+        self.trips = 0
+        self.tripped = False
+        self.histogram = [0] * (len(self.EDGES) + 1)
+
+    def heartbeat(self):
+        now = clock.monotonic()
+        if self.last is not None:
+            interval = now - self.last
+            late = interval - self.period
+            self.count += 1
+            self.total += interval
+            if late > self.worst:
+                self.worst = late
+            if late > 0.05 * self.period:
+                self.overruns += 1
+            self.histogram[bisect.bisect_left(self.EDGES, late)] += 1
+        self.last = now
+        self.deadline = now + self.timeout
+        if self.tripped:
+            self.tripped = False
+            return False
+        return True
+
+    def pause(self):
+
+        # Stops supervising until the next heartbeat, e.g. before a
+        # deliberate long wait
+
+        self.deadline = float("inf")
+        self.last = None
+
+    def percentile(self, fraction):
+
+        # Upper edge of the histogram bucket holding the given fraction of
+        # intervals, as an interval in seconds (None if over a second late)
+
+        wanted = fraction * self.count
+        seen = 0
+        for edge, count in zip(self.EDGES + (None,), self.histogram):
+            seen += count
+            if seen >= wanted:
+                return None if edge is None else self.period + max(0.0, edge)
+        return None
+
+    def stats(self):
+        labels = ["on time"] + ["<=%gms" % (edge * 1000) for edge in self.EDGES[1:]] + [">1s"]
+        p99 = self.percentile(0.99) if self.count else None
+        return {"period_ms": self.period * 1000, "timeout_ms": self.timeout * 1000,
+                "intervals": self.count,
+                "mean_ms": 1000 * self.total / self.count if self.count else None,
+                "worst_late_ms": 1000 * self.worst, "overruns": self.overruns, "trips": self.trips,
+                "lateness": dict(zip(labels, self.histogram)),
+                "p99_interval_ms": None if p99 is None else 1000 * p99}
+
+    def close(self):
+        self.supervisor.unwatch(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Supervisor:
+
+    # Deadline supervisor for control loops.
+    # Loops register with watch() and heartbeat every iteration.  A
+    # watchdog thread of its own (a priority step above the timing threads
+    # in real-time mode) checks the deadlines, and when a loop misses one
+    # it stops every guarded Motor, LinkedMotors or Stepper itself, so a
+    # stalled loop cannot leave the motors running.  Overrun statistics for
+    # tuning loop rates come from stats(), report() and save().
+    # Arguments:
+    # grace = default timeout as a multiple of a loop's period
+
+    def __init__(self, grace=3.0):
+        self.grace = grace
+        self.watches = []
+        self.devices = []
+        self.trips = deque(maxlen=100)
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.wake = threading.Event()
+
+    def watch(self, name, period, timeout=None):
+
+        # Registers a control loop and returns its LoopWatch
+        # Arguments:
+        # name = loop name in the statistics
+        # period = intended seconds between iterations
+        # timeout = seconds without a heartbeat before the motors are
+        # stopped (default grace * period)
+
+        watch = LoopWatch(self, name, period, timeout or self.grace * period)
+        with self.lock:
+            self.watches.append(watch)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.wake.set()
+        return watch
+
+    def unwatch(self, watch):
+        with self.lock:
+            if watch in self.watches:
+                self.watches.remove(watch)
+
+    def guard(self, *devices):
+
+        # Adds devices to stop when any loop misses its deadline
+
+        with self.lock:
+            self.devices.extend(device for device in devices if device not in self.devices)
+        return self
+
+    def unguard(self, *devices):
+        with self.lock:
+            self.devices = [device for device in self.devices if device not in devices]
+
+    def on_trip(self, callback):
+
+        # Calls callback(watch) from the watchdog thread after a trip
+
+        self.callbacks.append(callback)
+
+    def run(self):
+        realtime.register(boost=1)
+        while True:
+            with self.lock:
+                watches = list(self.watches)
+            if not watches:
+                self.wake.wait(1.0)
+                self.wake.clear()
+                continue
+            now = clock.monotonic()
+            for watch in watches:
+                if not watch.tripped and now > watch.deadline:
+                    self.trip(watch, now)
+            shortest = min(watch.timeout for watch in watches)
+            self.wake.wait(min(0.1, max(0.001, shortest / 4)))
+            self.wake.clear()
+
+    def trip(self, watch, now):
+
+        # Stops the guarded devices after watch missed its deadline
+
+        watch.tripped = True
+        watch.trips += 1
+        with self.lock:
+            devices = list(self.devices)
+        failures = []
+        for device in devices:
+            try:
+                device.stop()
+            except Exception as error:
+                failures.append("%r: %s" % (device, error))
+        self.trips.append({"time": time.time(), "loop": watch.name,
+                           "silent_ms": 1000 * (now - watch.deadline + watch.timeout),
+                           "failures": failures})
+        for callback in self.callbacks:
+            try:
+                callback(watch)
+            except Exception as error:
+                failures.append("%r: %s" % (callback, error))
+
+    def stats(self):
+
+        # Returns the statistics of every loop by name, plus the trips
+
+        with self.lock:
+            watches = list(self.watches)
+        result = {watch.name: watch.stats() for watch in watches}
+        result["trips"] = list(self.trips)
+        return result
+
+    def report(self):
+
+        # Returns the loop statistics as a table for printing
+
+        lines = ["%-12s %8s %8s %8s %10s %8s %6s %10s" % ("loop", "period", "count", "mean",
+                                                          "worst late", "overruns", "trips", "p99 intvl")]
+        for name, entry in self.stats().items():
+            if name == "trips":
+                continue
+            p99 = entry["p99_interval_ms"]
+            lines.append("%-12s %6.1fms %8d %6.1fms %8.1fms %8d %6d %10s" % (
+                name, entry["period_ms"], entry["intervals"], entry["mean_ms"] or 0,
+                entry["worst_late_ms"], entry["overruns"], entry["trips"],
+                ">1s late" if p99 is None else "%.1fms" % p99))
+        return "\n".join(lines)
+
+    def save(self, path):
+
+        # Writes stats() as JSON
+
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.stats(), f, indent=1)
+        os.replace(path + ".tmp", path)
+
+
+supervisor = Supervisor()
+
+
+class SysfsPWM:
+
+    # Hardware PWM channel driven through the kernel's /sys/class/pwm
+    # interface (needs dtoverlay=pwm-2chan).  Same methods as RPi.GPIO.PWM.
+    # The waveform comes from the PWM peripheral, so there is no thread and
+    # no jitter.
+    # Arguments:
+    # pin = BCM pin number (must be one of the hardware PWM pins)
+    # frequency = PWM frequency in Hz
+    # root = sysfs directory holding the pwmchipN entries
+
+    root = "/sys/class/pwm"
+
+    # BCM pin -> (pwmchip, channel)
+    channels = {12: (0, 0), 18: (0, 0), 13: (0, 1), 19: (0, 1)}
+
+    name = "hardware"
+
+    @classmethod
+    def supports(cls, pin, root=None):
+
+        # True if the pin has a channel that is exported or can be
+
+        if pin not in cls.channels:
+            return False
+        chip, channel = cls.channels[pin]
+        chipdir = os.path.join(root or cls.root, "pwmchip%d" % chip)
+        return (os.path.isdir(os.path.join(chipdir, "pwm%d" % channel)) or
+                os.access(os.path.join(chipdir, "export"), os.W_OK))
+
+    def __init__(self, pin, frequency, root=None):
+        if not self.supports(pin, root):
+            raise IOError("BCM %d has no hardware PWM channel" % pin)
+        chip, channel = self.channels[pin]
+        chipdir = os.path.join(root or self.root, "pwmchip%d" % chip)
+        self.path = os.path.join(chipdir, "pwm%d" % channel)
+        if not os.path.isdir(self.path):
+            with open(os.path.join(chipdir, "export"), "w") as f:
+                f.write(str(channel))
+            # udev may take a moment to make the new files writable
+            deadline = time.monotonic() + 1.0
+            while not os.access(os.path.join(self.path, "period"), os.W_OK):
+                if time.monotonic() > deadline:
+                    raise IOError("%s did not appear after export" % self.path)
+                time.sleep(0.01)
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = 0
+        self.period = 0
+
+    def write(self, name, value):
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(str(value))
+
+    def read(self, name):
+        with open(os.path.join(self.path, name)) as f:
+            return int(f.read().strip() or 0)
+
+    def set_period(self):
+        # the duty cycle may never exceed the period, so clear it first
+        self.write("duty_cycle", 0)
+        self.period = int(round(1e9 / self.frequency))
+        self.write("period", self.period)
+        self.write("duty_cycle", int(self.period * self.duty / 100.0))
+
+    def start(self, duty):
+        self.duty = duty
+        self.set_period()
+        self.write("enable", 1)
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+        self.write("duty_cycle", int(self.period * duty / 100.0))
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+        self.set_period()
+
+    def stop(self):
+        self.write("enable", 0)
+
+    def accuracy(self):
+
+        # Reads back what the kernel actually programmed
+
+        period = self.read("period")
+        duty = self.read("duty_cycle")
+        return pwm_report(self, 1e9 / period if period else 0.0,
+                          100.0 * duty / period if period else 0.0)
+
+
+class PigpioPWM:
+
+    # DMA timed PWM through the pigpio daemon (sudo pigpiod).  Same
+    # methods as RPi.GPIO.PWM.  Works on any pin; the daemon's DMA engine
+    # times the edges, so nothing runs in this process.
+    # Arguments:
+    # pin = BCM pin number
+    # frequency = PWM frequency in Hz
+
+    pi = None
+    name = "pigpio"
+    steps = 1000
+
+    def __init__(self, pin, frequency):
+        import pigpio
+        if PigpioPWM.pi is None:
+            pi = pigpio.pi()
+            if not pi.connected:
+                raise IOError("pigpiod is not running")
+            PigpioPWM.pi = pi
+        self.pin = pin
+        self.duty = 0
+        self.pi.set_PWM_range(pin, self.steps)
+        self.ChangeFrequency(frequency)
+
+    def start(self, duty):
+        self.ChangeDutyCycle(duty)
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+        self.pi.set_PWM_dutycycle(self.pin, int(round(duty * self.steps / 100.0)))
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+        # pigpio picks the nearest frequency its sample rate allows
+        self.actual = self.pi.set_PWM_frequency(self.pin, int(frequency))
+
+    def stop(self):
+        self.pi.set_PWM_dutycycle(self.pin, 0)
+
+    def accuracy(self):
+        real = self.pi.get_PWM_real_range(self.pin)
+        duty = round(self.duty * real / 100.0) * 100.0 / real if real else 0.0
+        return pwm_report(self, self.pi.get_PWM_frequency(self.pin), duty)
+
+
+class SoftPWMScheduler:
+
+    # One thread generating every SoftPWM waveform.
+    # Edges of all channels are kept in a heap ordered by time, so N
+    # channels cost one sleeping thread instead of N busy ones.
+
+    def __init__(self):
+        self.heap = []
+        self.sequence = 0
+        self.lock = threading.Condition()
+        self.thread = None
+
+    def schedule(self, when, channel, level):
+        # caller holds the lock
+        self.sequence += 1
+        heapq.heappush(self.heap, (when, self.sequence, channel, channel.generation, level))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.lock.notify()
+
+    def run(self):
+        realtime.register()
+        with self.lock:
+            while True:
+                if not self.heap:
+                    self.lock.wait()
+                    continue
+                when, _, channel, generation, level = self.heap[0]
+                delay = when - time.perf_counter()
+                if delay > 0:
+                    self.lock.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                if generation != channel.generation:
+                    continue
+                channel.edge(when, level)
+
+
+class SoftPWM:
+
+    # Software PWM multiplexed onto the shared SoftPWMScheduler thread.
+    # Same methods as RPi.GPIO.PWM, plus measured accuracy from the edge
+    # times actually achieved.
+    # Arguments:
+    # pin = BCM pin number (already set up as an output)
+    # frequency = PWM frequency in Hz
+
+    scheduler = SoftPWMScheduler()
+    name = "soft"
+
+    def __init__(self, pin, frequency):
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = 0
+        self.generation = 0
+        self.rise = None
+        self.measured_period = None
+        self.measured_high = None
+
+    def start(self, duty):
+        self.ChangeDutyCycle(duty)
+
+    def restart(self):
+        # caller holds the scheduler lock
+        self.generation += 1
+        if self.duty <= 0 or self.duty >= 100:
+            GPIO.output(self.pin, GPIO.HIGH if self.duty >= 100 else GPIO.LOW)
+            self.rise = None
+            return
+        now = time.perf_counter()
+        when = now if self.rise is None else max(now, self.rise + 1.0 / self.frequency)
+        self.scheduler.schedule(when, self, GPIO.HIGH)
+
+    def ChangeDutyCycle(self, duty):
+        with self.scheduler.lock:
+            self.duty = max(0.0, min(100.0, duty))
+            self.restart()
+
+    def ChangeFrequency(self, frequency):
+        with self.scheduler.lock:
+            self.frequency = frequency
+            self.restart()
+
+    def stop(self):
+        with self.scheduler.lock:
+            self.duty = 0
+            self.restart()
+
+    def edge(self, when, level):
+
+        # Called by the scheduler at each due edge; sets the pin, records
+        # the achieved timing and schedules the following edge
+
+        now = time.perf_counter()
+        GPIO.output(self.pin, level)
+        period = 1.0 / self.frequency
+        if level == GPIO.HIGH:
+            if self.rise is not None and now - self.rise < 2 * period:
+                self.measured_period = self.average(self.measured_period, now - self.rise)
+            self.rise = now
+            self.scheduler.schedule(when + period * self.duty / 100.0, self, GPIO.LOW)
+        else:
+            self.measured_high = self.average(self.measured_high, now - self.rise)
+            # keep the phase unless the thread fell a whole period behind
+            self.scheduler.schedule(max(when + period * (1 - self.duty / 100.0), now), self, GPIO.HIGH)
+
+    def average(self, current, sample):
+        return sample if current is None else current + 0.1 * (sample - current)
+
+    def accuracy(self):
+        if not self.measured_period:
+            return pwm_report(self, None, None)
+        return pwm_report(self, 1.0 / self.measured_period,
+                          100.0 * self.measured_high / self.measured_period if self.measured_high else None)
+
+
+def pwm_report(pwm, frequency, duty):
+
+    # Accuracy of a PWM backend: what was asked for and what was measured
+
+    return {"backend": pwm.name, "frequency": pwm.frequency, "duty": pwm.duty,
+            "measured_frequency": frequency, "measured_duty": duty}
+
+
+PWM_BACKEND = os.environ.get("MICROPI_PWM", "gpio")
+
+
+def make_pwm(pin, frequency, backend=None):
+
+    # Creates a PWM object for an output pin
+    # Arguments:
+    # pin = BCM pin number
+    # frequency = PWM frequency in Hz
+    # backend = "gpio" (RPi.GPIO software PWM, one thread per pin),
+    #           "hardware" (/sys/class/pwm), "pigpio" (DMA timed), "soft"
+    #           (one shared thread for all pins) or "auto" (hardware where
+    #           the pin has a channel, then pigpio, then soft).
+    #           Defaults to $MICROPI_PWM or "gpio".
+
+    backend = backend or PWM_BACKEND
+    if backend == "auto":
+        if SysfsPWM.supports(pin):
+            try:
+                return SysfsPWM(pin, frequency)
+            except IOError:
+                pass
+        try:
+            return PigpioPWM(pin, frequency)
+        except (ImportError, IOError):
+            return SoftPWM(pin, frequency)
+    if backend == "hardware":
+        return SysfsPWM(pin, frequency)
+    if backend == "pigpio":
+        return PigpioPWM(pin, frequency)
+    if backend == "soft":
+        return SoftPWM(pin, frequency)
+    if backend == "gpio":
+        return GPIO.PWM(pin, frequency)
+    raise ValueError("unknown PWM backend %r" % backend)
+
+
+def hardware_pwm(pin, backend=None):
+
+    # True if make_pwm() would drive the pin from the PWM peripheral, which
+    # needs the pin left in its PWM function rather than set up as a GPIO
+    # output
+
+    backend = backend or PWM_BACKEND
+    return backend == "hardware" or (backend == "auto" and SysfsPWM.supports(pin))
+
+
+class PinRegistry:
+
+    # Tracks which device owns each BCM pin and how it is set up.
+    # Several MotorShield devices share pins (STEPPER1 uses the MOTOR3 and
+    # MOTOR4 pins, STEPPER2 those of MOTOR1 and MOTOR2), so every device
+    # claims its pins here instead of calling GPIO.setup directly.  A claim
+    # by another owner, or by the same owner in another mode, raises
+    # PinConflictError.  Repeated claims by the same owner (e.g. two
+    # Motor("MOTOR1") objects) share the setup and are reference counted,
+    # and each pin has at most one PWM object.  When the last claim on a pin
+    # is released the PWM is stopped and the pin is cleaned up.
+
+    # modes that are not set up through RPi.GPIO
+    SPI = "spi"
+    PWM = "pwm"
+
+    def __init__(self):
+        self.pins = {}
+        self.lock = threading.RLock()
+
+    def claim(self, pin, mode, owner, pull=None):
+
+        # Claims a pin, or a list of pins, setting up the ones not claimed
+        # before with a single GPIO.setup call (one line request with the
+        # gpiod backend).  Nothing is claimed if any pin conflicts.
+        # Arguments:
+        # pin = BCM pin number or list of them
+        # mode = GPIO.OUT, GPIO.IN, PinRegistry.SPI or PinRegistry.PWM (a
+        # hardware PWM output, see hardware_pwm())
+        # owner = name of the claiming device, e.g. "MOTOR1"
+        # pull = GPIO.PUD_UP / GPIO.PUD_DOWN for inputs
+
+        wanted = list(pin) if isinstance(pin, (list, tuple)) else [pin]
+        with self.lock:
+            for pin in wanted:
+                entry = self.pins.get(pin)
+                if entry is None:
+                    continue
+                if entry["owner"] != owner:
+                    raise PinConflictError("BCM %d is already used by %s, cannot use it for %s"
+                                           % (pin, entry["owner"], owner))
+                if entry["mode"] != mode or entry["pull"] != pull:
+                    raise PinConflictError("BCM %d is already set up differently by %s"
+                                           % (pin, owner))
+            fresh = [pin for pin in wanted if pin not in self.pins]
+            if fresh and mode not in (self.SPI, self.PWM):
+                if pull is None:
+                    GPIO.setup(fresh, mode)
+                else:
+                    GPIO.setup(fresh, mode, pull_up_down=pull)
+            for pin in wanted:
+                if pin in self.pins:
+                    self.pins[pin]["count"] += 1
+                else:
+                    self.pins[pin] = {"owner": owner, "mode": mode, "pull": pull, "count": 1,
+                                      "pwm": None, "frequency": None}
+
+    def pwm(self, pin, frequency, owner, duty=None, backend=None):
+
+        # Returns the PWM object for a claimed output pin, creating it on
+        # first use.  Every caller gets the same object.
+        # Arguments:
+        # pin = BCM pin number
+        # frequency = PWM frequency in Hz
+        # owner = name of the device that claimed the pin
+        # duty = duty cycle to start a newly created PWM at (None leaves it stopped)
+        # backend = PWM backend for a newly created PWM, see make_pwm()
+
+        with self.lock:
+            entry = self.pins.get(pin)
+            if entry is None or entry["owner"] != owner or entry["mode"] not in (GPIO.OUT, self.PWM):
+                raise PinConflictError("BCM %d is not an output claimed by %s" % (pin, owner))
+            if entry["pwm"] is None:
+                entry["pwm"] = make_pwm(pin, frequency, backend)
+                entry["frequency"] = frequency
+                if entry["mode"] == self.PWM and not isinstance(entry["pwm"], SysfsPWM):
+                    # "auto" fell back to a GPIO driven backend
+                    GPIO.setup(pin, GPIO.OUT)
+                    entry["mode"] = GPIO.OUT
+                if duty is not None:
+                    entry["pwm"].start(duty)
+            elif entry["frequency"] != frequency:
+                raise PinConflictError("BCM %d already runs PWM at %s Hz" % (pin, entry["frequency"]))
+            return entry["pwm"]
+
+    def release(self, pin, owner):
+
+        # Drops one claim on a pin, freeing it after the last one
+
+        with self.lock:
+            entry = self.pins.get(pin)
+            if entry is None or entry["owner"] != owner:
+                return
+            entry["count"] -= 1
+            if entry["count"] > 0:
+                return
+            del self.pins[pin]
+            if entry["pwm"] is not None:
+                entry["pwm"].stop()
+            if entry["mode"] not in (self.SPI, self.PWM):
+                GPIO.cleanup(pin)
+
+    def accuracy(self):
+
+        # Returns {pin: accuracy report} for every PWM whose backend can
+        # measure itself (RPi.GPIO PWM cannot)
+
+        with self.lock:
+            return {pin: e["pwm"].accuracy() for pin, e in sorted(self.pins.items())
+                    if hasattr(e["pwm"], "accuracy")}
+
+    def owner(self, pin):
+        entry = self.pins.get(pin)
+        return entry["owner"] if entry else None
+
+    def table(self):
+
+        # Returns {pin: (owner, mode, claims, pwm frequency)} for debugging
+
+        with self.lock:
+            return {pin: (e["owner"], e["mode"], e["count"], e["frequency"])
+                    for pin, e in sorted(self.pins.items())}
+
+    def close(self):
+
+        # Releases every pin
+
+        with self.lock:
+            for pin, entry in list(self.pins.items()):
+                entry["count"] = 1
+                self.release(pin, entry["owner"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+pins = PinRegistry()
+
+
+class PinOwner:
+
+    # Base for devices that claim pins from the registry.
+    # Provides close() and context manager support releasing the claims.
+
+    owner = None
+
+    def claim(self, pin, mode, pull=None):
+        try:
+            pins.claim(pin, mode, self.owner, pull)
+        except PinConflictError:
+            # give back what this device already took before failing
+            self.release()
+            raise
+        claimed = self.__dict__.setdefault("claimed", [])
+        claimed.extend(pin if isinstance(pin, (list, tuple)) else [pin])
+
+    def pwm(self, pin, frequency, duty=None, backend=None):
+        return pins.pwm(pin, frequency, self.owner, duty, backend)
+
+    def release(self):
+        for pin in self.__dict__.pop("claimed", []):
+            pins.release(pin, self.owner)
+
+    def close(self):
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Motor(PinOwner):
 
     # Class to handle interaction with the motor pins
     # Supports redefinition of "forward" and "backward" depending on how motors
@@ -32,25 +973,32 @@ class Motor:
     # motor = string motor pin label (i.e. "MOTOR1","MOTOR2","MOTOR3","MOTOR4")
     # identifying the pins to which the motor is connected.
     # config = int defines which pins control "forward" and "backward" movement
+    # pwm = PWM backend for the enable pin, see make_pwm()
+    # pins = {"e": enable, "f": forward, "r": reverse} BCM pins to use
+    # instead of the MotorShield ones (see micropi_board)
 
     motorpins = {"MOTOR4": {"e": 12, "f": 8, "r": 7},
                  "MOTOR3": {"e": 21, "f": 9, "r": 11},
                  "MOTOR2": {"e": 25, "f": 24, "r": 23},
                  "MOTOR1": {"e": 17, "f": 27, "r": 22}}
 
-    def __init__(self, motor):
+    def __init__(self, motor, pwm=None, pins=None):
 
         self.testMode = False
-        self.pins = self.motorpins[motor]
-        GPIO.setup(self.pins['e'], GPIO.OUT)
-        GPIO.setup(self.pins['f'], GPIO.OUT)
-        GPIO.setup(self.pins['r'], GPIO.OUT)
-        # 50 Hz frequency
-        self.PWM = GPIO.PWM(self.pins['e'], 50)
-        self.PWM.start(0)
-        GPIO.output(self.pins['e'], GPIO.HIGH)
-        GPIO.output(self.pins['f'], GPIO.LOW)
-        GPIO.output(self.pins['r'], GPIO.LOW)
+        self.owner = motor
+        self.pins = pins or self.motorpins[motor]
+        # signed duty cycle last set: + forward, - reverse
+        self.duty = 0
+        # a hardware PWM enable pin stays in its PWM function
+        enable = PinRegistry.PWM if hardware_pwm(self.pins['e'], pwm) else GPIO.OUT
+        self.claim(self.pins['e'], enable)
+        self.claim([self.pins['f'], self.pins['r']], GPIO.OUT)
+        # 50 Hz frequency, one PWM per pin however many Motor objects share it
+        self.PWM = self.pwm(self.pins['e'], 50, 0, pwm)
+        if not isinstance(self.PWM, SysfsPWM):
+            GPIO.output(self.pins['e'], GPIO.HIGH)
+        self.direction = [self.pins['f'], self.pins['r']]
+        GPIO.output(self.direction, (GPIO.LOW, GPIO.LOW))
 
     def test(self, state):
 
@@ -73,8 +1021,8 @@ class Motor:
             print("arrow")
         else:
             self.PWM.ChangeDutyCycle(speed)
-            GPIO.output(self.pins['f'], GPIO.HIGH)
-            GPIO.output(self.pins['r'], GPIO.LOW)
+            GPIO.output(self.direction, (GPIO.HIGH, GPIO.LOW))
+            self.duty = speed
 
     def reverse(self, speed):
 
@@ -87,22 +1035,30 @@ class Motor:
             print("Arrow")
         else:
             self.PWM.ChangeDutyCycle(speed)
-            GPIO.output(self.pins['f'], GPIO.LOW)
-            GPIO.output(self.pins['r'], GPIO.HIGH)
+            GPIO.output(self.direction, (GPIO.LOW, GPIO.HIGH))
+            self.duty = -speed
 
     def stop(self):
 
         # Stops power to the motor
         print("Stop")
         self.PWM.ChangeDutyCycle(0)
-        GPIO.output(self.pins['f'], GPIO.LOW)
-        GPIO.output(self.pins['r'], GPIO.LOW)
+        GPIO.output(self.direction, (GPIO.LOW, GPIO.LOW))
+        self.duty = 0
 
     def speed(self):
 
         # Control Speed of Motor
         pass
 
+    def close(self):
+
+        # Stops the motor and releases its pins
+
+        if "claimed" in self.__dict__:
+            self.stop()
+        self.release()
+
 
 class LinkedMotors:
 
@@ -149,99 +1105,307 @@ class LinkedMotors:
         for i in range(len(self.motor)):
             self.motor[i].stop()
 
+    def close(self):
+        for motor in self.motor:
+            motor.close()
 
-class Stepper:
+    def __enter__(self):
+        return self
 
-    # Defines stepper motor pins on the MotorShield
-    # Arguments:
-    # motor = stepper motor
+    def __exit__(self, *exc):
+        self.close()
 
-    stepperpins = {"STEPPER1":{"en1": 21, "en2": 12, "c1": 9, "c2": 11, "c3": 8, "c4": 7},
-                   "STEPPER2":{"en1": 17, "en2": 25, "c1": 27, "c2": 22, "c3": 24, "c4": 23}}
 
+class BlueDotSource:
 
-    def __init__(self, motor):
-        self.config = self.stepperpins[motor]
-        GPIO.setup(self.config["en1"], GPIO.OUT)
-        GPIO.setup(self.config["en2"], GPIO.OUT)
-        GPIO.setup(self.config["c1"], GPIO.OUT)
-        GPIO.setup(self.config["c2"], GPIO.OUT)
-        GPIO.setup(self.config["c3"], GPIO.OUT)
-        GPIO.setup(self.config["c4"], GPIO.OUT)
+    # Joystick events from the BlueDot phone app
+    # Arguments:
+    # dot = bluedot.BlueDot instance (one is created if omitted)
 
-        GPIO.output(self.config["en1"], GPIO.HIGH)
-        GPIO.output(self.config["en2"], GPIO.HIGH)
-        GPIO.output(self.config["c1"], GPIO.LOW)
-        GPIO.output(self.config["c2"], GPIO.LOW)
-        GPIO.output(self.config["c3"], GPIO.LOW)
-        GPIO.output(self.config["c4"], GPIO.LOW)
+    def __init__(self, dot=None):
+        if dot is None:
+            from bluedot import BlueDot
+            dot = BlueDot()
+        self.dot = dot
+        self.handler = None
 
+    def start(self, handler):
 
-    def setStep(self, w1, w2, w3, w4):
+        # Calls handler(x, y, pressed) from the Bluetooth thread
 
-        # Set steps of Stepper Motor
-        # Arguments
-        # w1,w2,w3,w4 = Wire of Stepper Motor
+        self.handler = handler
+        self.dot.when_pressed = self.moved
+        self.dot.when_moved = self.moved
+        self.dot.when_released = self.released
+        self.dot.when_client_disconnects = self.released
 
-        GPIO.output(self.config["c1"], w1)
-        GPIO.output(self.config["c2"], w2)
-        GPIO.output(self.config["c3"], w3)
-        GPIO.output(self.config["c4"], w4)
+    def moved(self, position):
+        self.handler(position.x, position.y, True)
 
-    def forward(self, delay, steps):
+    def released(self, position=None):
+        self.handler(0.0, 0.0, False)
 
-        # Rotate Stepper motor in forward direction
-        # delay = time between steps (milliseconds)
-        # Arguments: delay = time between steps in miliseconds
-        # steps = Number of Steps
+    def stop(self):
+        self.dot.when_pressed = None
+        self.dot.when_moved = None
+        self.dot.when_released = None
+        self.dot.when_client_disconnects = None
 
-        for i in range(0, steps):
-            self.setStep(1, 0, 0, 0)
-            time.sleep(delay)
-            self.setStep(0, 1, 0, 0)
-            time.sleep(delay)
-            self.setStep(0, 0, 1, 0)
-            time.sleep(delay)
-            self.setStep(0, 0, 0, 1)
-            time.sleep(delay)
 
-    def backward(self, delay, steps):
+class ScriptedSource:
 
-        # Rotate Stepper motor in backward direction
-        # Arguments:
-        # delay = time between steps
-        # steps = Number of Steps
+    # Plays a list of joystick events in place of BlueDot, for testing
+    # without a phone.
+    # Arguments:
+    # script = list of (delay, x, y, pressed); delay is the seconds to wait
+    #          before the event
 
-        for i in range(0, steps):
-            self.setStep(0, 0, 0, 1)
-            time.sleep(delay)
-            self.setStep(0, 0, 1, 0)
-            time.sleep(delay)
-            self.setStep(0, 1, 0, 0)
-            time.sleep(delay)
-            self.setStep(1, 0, 0, 0)
+    def __init__(self, script):
+        self.script = list(script)
+        self.thread = None
+        self.running = False
+
+    def start(self, handler):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(handler,), daemon=True)
+        self.thread.start()
+
+    def run(self, handler):
+        for delay, x, y, pressed in self.script:
             time.sleep(delay)
+            if not self.running:
+                return
+            handler(x, y, pressed)
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
 
     def stop(self):
+        self.running = False
 
-        # Stops power to the motor
 
-        print("Stop Stepper Motor")
-        GPIO.output(self.config['c1'], GPIO.LOW)
-        GPIO.output(self.config['c2'], GPIO.LOW)
-        GPIO.output(self.config['c3'], GPIO.LOW)
-        GPIO.output(self.config['c4'], GPIO.LOW)
+class RemoteDrive:
 
+    # Drives a pair of motor sets from a remote joystick.
+    # Events from the input source only record the latest joystick state;
+    # a control thread applies it to the motors at a fixed rate, so bursts
+    # of move events are coalesced and the motor pins are only written when
+    # the wheel speeds actually change.  If no event arrives for timeout
+    # seconds while the joystick is held, the motors are stopped.
+    # Arguments:
+    # left, right = Motor or LinkedMotors for each side of the robot
+    # source = input source (BlueDotSource if omitted)
+    # rate = control updates per second
+    # timeout = dead-man timeout in seconds (None to disable)
+    # max_speed = duty cycle at full stick
+    # deadzone = stick movement ignored around the centre
 
-class Sensor:
+    def __init__(self, left, right, source=None, rate=20, timeout=1.0, max_speed=100, deadzone=0.1):
+        self.left = left
+        self.right = right
+        self.source = source
+        self.period = 1.0 / rate
+        self.timeout = timeout
+        self.max_speed = max_speed
+        self.deadzone = deadzone
+        self.state = (0.0, 0.0, False, 0.0)
+        self.applied = [0, 0]
+        self.events = 0
+        self.updates = 0
+        self.timeouts = 0
+        self.thread = None
+        self.running = False
 
-    # Defines a sensor connected to the sensor pins on the MotorShield
-    # Arguments:
+    def event(self, x, y, pressed):
+
+        # Records the latest joystick state; called from the source's thread
+
+        self.events += 1
+        self.state = (x, y, pressed, time.monotonic())
+
+    def speeds(self, x, y):
+
+        # Mixes a joystick position into (left, right) duty cycles from
+        # -max_speed to max_speed
+
+        if abs(x) < self.deadzone:
+            x = 0.0
+        if abs(y) < self.deadzone:
+            y = 0.0
+        left = max(-1.0, min(1.0, y + x))
+        right = max(-1.0, min(1.0, y - x))
+        return int(round(left * self.max_speed)), int(round(right * self.max_speed))
+
+    def drive(self, motors, speed):
+        if speed > 0:
+            motors.forward(speed)
+        elif speed < 0:
+            motors.reverse(-speed)
+        else:
+            motors.stop()
+
+    def apply(self, left, right):
+
+        # Sets the wheel speeds, writing only the sides that changed
+
+        if left != self.applied[0]:
+            self.drive(self.left, left)
+            self.applied[0] = left
+            self.updates += 1
+        if right != self.applied[1]:
+            self.drive(self.right, right)
+            self.applied[1] = right
+            self.updates += 1
+
+    def start(self):
+        if self.source is None:
+            self.source = BlueDotSource()
+        self.left.stop()
+        self.right.stop()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.source.start(self.event)
+        return self
+
+    def run(self):
+        realtime.register()
+        deadline = time.monotonic()
+        expired = False
+        while self.running:
+            x, y, pressed, stamp = self.state
+            now = time.monotonic()
+            if pressed and self.timeout is not None and now - stamp > self.timeout:
+                if not expired:
+                    self.timeouts += 1
+                    expired = True
+                pressed = False
+            elif pressed:
+                expired = False
+            if pressed:
+                self.apply(*self.speeds(x, y))
+            else:
+                self.apply(0, 0)
+            deadline += self.period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+    def stop(self):
+        self.running = False
+        if self.source is not None:
+            self.source.stop()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.left.stop()
+        self.right.stop()
+        self.applied = [0, 0]
+
+
+class Stepper(PinOwner):
+
+    # Defines stepper motor pins on the MotorShield
+    # Arguments:
+    # motor = stepper motor
+    # pins = {"en1", "en2", "c1".."c4": BCM pin} to use instead of the
+    # MotorShield ones
+
+    stepperpins = {"STEPPER1":{"en1": 21, "en2": 12, "c1": 9, "c2": 11, "c3": 8, "c4": 7},
+                   "STEPPER2":{"en1": 17, "en2": 25, "c1": 27, "c2": 22, "c3": 24, "c4": 23}}
+
+
+    def __init__(self, motor, pins=None):
+        self.owner = motor
+        self.config = pins or self.stepperpins[motor]
+        self.claim([self.config[wire] for wire in ("en1", "en2", "c1", "c2", "c3", "c4")], GPIO.OUT)
+        # the coils are always written together so each phase is one call
+        # (a single atomic line update with the gpiod backend)
+        self.coils = [self.config["c1"], self.config["c2"], self.config["c3"], self.config["c4"]]
+        self.enable = [self.config["en1"], self.config["en2"]]
+        # set by stop(), from any thread, to end a move between phases
+        self.aborted = threading.Event()
+
+        GPIO.output(self.enable, (GPIO.HIGH, GPIO.HIGH))
+        GPIO.output(self.coils, (GPIO.LOW, GPIO.LOW, GPIO.LOW, GPIO.LOW))
+
+
+    def setStep(self, w1, w2, w3, w4):
+
+        # Set steps of Stepper Motor
+        # Arguments
+        # w1,w2,w3,w4 = Wire of Stepper Motor
+
+        GPIO.output(self.coils, (w1, w2, w3, w4))
+
+    def forward(self, delay, steps):
+
+        # Rotate Stepper motor in forward direction
+        # delay = time between steps (milliseconds)
+        # Arguments: delay = time between steps in miliseconds
+        # steps = Number of Steps
+        # Returns the number of steps made (fewer if stop() was called)
+
+        return self.move(((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0), (0, 0, 0, 1)), delay, steps)
+
+    def backward(self, delay, steps):
+
+        # Rotate Stepper motor in backward direction
+        # Arguments:
+        # delay = time between steps
+        # steps = Number of Steps
+        # Returns the number of steps made (fewer if stop() was called)
+
+        return self.move(((0, 0, 0, 1), (0, 0, 1, 0), (0, 1, 0, 0), (1, 0, 0, 0)), delay, steps)
+
+    def move(self, phases, delay, steps):
+
+        # Steps through the phases, checking before each one whether
+        # stop() has been called meanwhile (e.g. by the supervisor)
+
+        self.aborted.clear()
+        GPIO.output(self.enable, (GPIO.HIGH, GPIO.HIGH))
+        with realtime.critical():
+            for i in range(0, steps):
+                for phase in phases:
+                    if self.aborted.is_set():
+                        return i
+                    self.setStep(*phase)
+                    clock.sleep(delay)
+        return steps
+
+    def stop(self):
+
+        # Stops power to the motor, ending a move running on another thread
+
+        print("Stop Stepper Motor")
+        self.aborted.set()
+        GPIO.output(self.coils, (GPIO.LOW, GPIO.LOW, GPIO.LOW, GPIO.LOW))
+        GPIO.output(self.enable, (GPIO.LOW, GPIO.LOW))
+
+    def close(self):
+
+        # De-energises the coils and releases the pins
+
+        if "claimed" in self.__dict__:
+            GPIO.output(self.coils, (GPIO.LOW, GPIO.LOW, GPIO.LOW, GPIO.LOW))
+        self.release()
+
+
+class Sensor(PinOwner):
+
+    # Defines a sensor connected to the sensor pins on the MotorShield
+    # Arguments:
     # sensortype = string identifying which sensor is being configured.
     # i.e. "IR1", "IR2", "ULTRASONIC"
     # boundary = an integer specifying the minimum
     # distance at which the sensor
     # will return a Triggered response of True.
+    # pins = {"echo": pin} ({"trigger", "echo"} for the ultrasonic sensor)
+    # to use instead of the MotorShield pins
 
     Triggered = False
 
@@ -258,17 +1422,10 @@ class Sensor:
     def sonicCheck(self):
 
         # print("SonicCheck has been triggered")
-        time.sleep(0.333)
-        GPIO.output(self.config["trigger"], True)
-        time.sleep(0.00001)
-        GPIO.output(self.config["trigger"], False)
-        start = time.time()
-        while GPIO.input(self.config["echo"]) == 0:
-            start = time.time()
-        while GPIO.input(self.config["echo"]) == 1:
-            stop = time.time()
-        elapsed = stop-start
-        measure = (elapsed * 34300)/2
+        clock.sleep(0.333)
+        measure = self.ping()
+        if measure is None:
+            return
         self.lastRead = measure
         if self.boundary > measure:
             print("Boundary breached")
@@ -278,6 +1435,39 @@ class Sensor:
         else:
             self.Triggered = False
 
+    def ping(self, timeout=0.04):
+
+        # Takes one ultrasonic reading straight away and returns the
+        # distance in cm, or None if no echo ends within timeout seconds.
+        # Leave at least 60 ms between pings so old echoes have died away.
+
+        if hasattr(GPIO, "edges"):
+            # the gpiod backend timestamps the echo edges in the kernel
+            GPIO.clear_edges(self.config["echo"])
+        with realtime.critical():
+            GPIO.output(self.config["trigger"], True)
+            clock.sleep(0.00001)
+            GPIO.output(self.config["trigger"], False)
+            if hasattr(GPIO, "edges"):
+                edges = GPIO.edges(self.config["echo"], 2, timeout)
+                if len(edges) < 2 or edges[0][1] != GPIO.HIGH:
+                    return None
+                elapsed = (edges[1][0] - edges[0][0]) / 1e9
+            else:
+                deadline = clock.time() + timeout
+                start = clock.time()
+                while GPIO.input(self.config["echo"]) == 0:
+                    start = clock.time()
+                    if start > deadline:
+                        return None
+                stop = start
+                while GPIO.input(self.config["echo"]) == 1:
+                    stop = clock.time()
+                    if stop > deadline:
+                        return None
+                elapsed = stop-start
+        return (elapsed * 34300)/2
+
     sensorpins = {"IR1":{"echo":4,"check":iRCheck}, "IR2":{"echo":18, "check":iRCheck},
                       "ULTRASONIC":{"trigger": 5, "echo": 6, "check":sonicCheck}}
 
@@ -291,22 +1481,32 @@ class Sensor:
         self.config["check"](self)
         print("Trigger Called")
 
-    def __init__(self, sensortype, boundary):
-        self.config = self.sensorpins[sensortype]
+    def __init__(self, sensortype, boundary, pins=None):
+        self.owner = sensortype
+        self.config = dict(self.sensorpins[sensortype], **(pins or {}))
         self.boundary = boundary
         self.lastRead = 0
         if "trigger" in self.config:
             print("trigger")
-            GPIO.setup(self.config["trigger"], GPIO.OUT)
-        GPIO.setup(self.config["echo"], GPIO.IN)
+            self.claim(self.config["trigger"], GPIO.OUT)
+        self.claim(self.config["echo"], GPIO.IN)
 
 
-class Buzzer:
-    
-    def __init__(self):
+class Buzzer(PinOwner):
+
+    owner = "BUZZER"
+
+    # Arguments:
+    # pwm = PWM backend for the buzzer pin, see make_pwm()
+    # pins = {"pin": BCM pin} to use instead of the MotorShield one
+
+    buzzerpins = {"BUZZER": {"pin": 16}}
+
+    def __init__(self, pwm=None, pins=None):
         
-        self.buzzerPIN = 16
-        GPIO.setup(self.buzzerPIN, GPIO.OUT)
+        self.buzzerPIN = (pins or self.buzzerpins[self.owner])["pin"]
+        self.backend = pwm
+        self.claim(self.buzzerPIN, GPIO.OUT)
         
     def play(self, tone, duration):
         
@@ -324,18 +1524,793 @@ class Buzzer:
         self.note = notes[note_index + 1]
         #print(tone, note_index, self.note)
 
-        buzzer = GPIO.PWM(self.buzzerPIN, 1000) # buzzer initialization to 1KHz
-        buzzer.start(10) # set duty cycle to 10
+        buzzer = self.pwm(self.buzzerPIN, 1000, backend=self.backend) # buzzer initialization to 1KHz
         buzzer.ChangeFrequency(self.note)
-        time.sleep(duration)
+        buzzer.start(10) # set duty cycle to 10
+        clock.sleep(duration)
         buzzer.stop()
         
         
-class IRDetect:
-    
-    def __init__(self):
-        self.irPIN = 20
-        GPIO.setup(self.irPIN,GPIO.IN,GPIO.PUD_UP)
+class AudioSink:
+
+    # Stand-in audio output used when no sound card is wanted.
+    # Paces writes to the real-time rate of the stream and optionally
+    # records what was played to a WAV file.
+    # Arguments:
+    # rate, channels = stream format
+    # path = WAV file to record into, or None to discard the audio
+
+    def __init__(self, rate, channels, path=None):
+        self.rate = rate
+        self.channels = channels
+        self.deadline = None
+        self.file = None
+        if path is not None:
+            self.file = wave.open(path, "wb")
+            self.file.setnchannels(channels)
+            self.file.setsampwidth(2)
+            self.file.setframerate(rate)
+
+    def write(self, data, frames):
+        now = time.monotonic()
+        if self.deadline is None or self.deadline < now:
+            self.deadline = now
+        self.deadline += frames / float(self.rate)
+        if self.file is not None:
+            self.file.writeframes(data)
+        delay = self.deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def idle(self):
+        self.deadline = None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class AlsaSink:
+
+    # ALSA playback stream, kept open for the life of the AudioPlayer
+    # Arguments:
+    # rate, channels = stream format
+    # period = frames per period
+    # periods = periods in the ALSA buffer
+    # device = ALSA device name
+
+    def __init__(self, rate, channels, period, periods, device="default"):
+        import alsaaudio
+        self.pcm = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, rate=rate, channels=channels,
+                                 format=alsaaudio.PCM_FORMAT_S16_LE, periodsize=period,
+                                 periods=periods, device=device)
+
+    def write(self, data, frames):
+        # A negative result is an underrun; writing again restarts the stream
+        if self.pcm.write(data) < 0:
+            self.pcm.write(data)
+
+    def idle(self):
+        pass
+
+    def close(self):
+        self.pcm.close()
+
+
+class AudioPlayer(PinOwner):
+
+    # In-process sound playback on the audio amplifier channel.
+    # Clips are decoded into memory once with load() and any number of
+    # them can play at the same time; a background thread mixes the active
+    # voices into one ALSA stream that stays open, so a sound starts within
+    # one or two periods of play() being called.  The amplifier enable pin
+    # (GPIO 13) is switched on when a sound starts and off again once
+    # nothing has played for idle_timeout seconds.
+    # Arguments:
+    # sink = "alsa", None (discard, for tests) or a WAV file path to record to
+    # rate, channels = output stream format
+    # period = frames mixed per block (128 frames is 2.9 ms at 44.1 kHz)
+    # periods = ALSA buffer size in periods
+    # idle_timeout = seconds of silence before the amplifier is disabled
+    # device = ALSA device name
+
+    audioPIN = 13
+    owner = "AUDIO"
+
+    def __init__(self, sink="alsa", rate=44100, channels=2, period=128, periods=3,
+                 idle_timeout=2.0, device="default", max_voices=8):
+        if np is None:
+            raise ImportError("AudioPlayer needs numpy")
+        self.rate = rate
+        self.channels = channels
+        self.period = period
+        self.idle_timeout = idle_timeout
+        self.max_voices = max_voices
+        if sink == "alsa":
+            self.sink = AlsaSink(rate, channels, period, periods, device)
+        else:
+            self.sink = AudioSink(rate, channels, sink)
+        self.claim(self.audioPIN, GPIO.OUT)
+        GPIO.output(self.audioPIN, GPIO.LOW)
+        self.amp = False
+        self.clips = {}
+        self.voices = []
+        self.next_voice = 0
+        self.last_sound = 0
+        self.mix = np.zeros((period, channels), dtype=np.int32)
+        self.out = np.zeros((period, channels), dtype=np.int16)
+        self.lock = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def load(self, name, path=None):
+
+        # Decodes a WAV file into memory, converted to the stream format.
+        # Arguments:
+        # name = name to play the clip by
+        # path = WAV file, defaults to name
+
+        with wave.open(path or name, "rb") as f:
+            channels = f.getnchannels()
+            width = f.getsampwidth()
+            rate = f.getframerate()
+            raw = f.readframes(f.getnframes())
+        if width == 1:
+            samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128) << 8
+        elif width == 2:
+            samples = np.frombuffer(raw, dtype="<i2")
+        elif width == 3:
+            bytes3 = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+            samples = (bytes3[:, 1].astype(np.int16) | (bytes3[:, 2].astype(np.int16) << 8))
+        else:
+            samples = (np.frombuffer(raw, dtype="<i4") >> 16).astype(np.int16)
+        samples = samples.reshape(-1, channels)
+        if channels != self.channels:
+            mono = samples.mean(axis=1)
+            samples = np.repeat(mono[:, None], self.channels, axis=1)
+        if rate != self.rate and len(samples):
+            count = int(round(len(samples) * self.rate / float(rate)))
+            source = np.arange(len(samples))
+            target = np.linspace(0, len(samples) - 1, count)
+            samples = np.stack([np.interp(target, source, samples[:, c])
+                                for c in range(self.channels)], axis=1)
+        self.clips[name] = np.ascontiguousarray(samples, dtype=np.int16)
+        return name
+
+    def play(self, name, volume=1.0, loop=False):
+
+        # Starts a clip (loading it first if it is a file not yet loaded).
+        # Returns a voice number that can be passed to stop().
+        # Arguments:
+        # name = clip name or WAV file path
+        # volume = 0.0 to 1.0 (or more to amplify)
+        # loop = repeat until stopped
+
+        if name not in self.clips:
+            self.load(name)
+        with self.lock:
+            self.next_voice += 1
+            self.voices.append([self.next_voice, self.clips[name], 0, int(volume * 256), loop])
+            if len(self.voices) > self.max_voices:
+                self.voices.pop(0)
+            if not self.amp:
+                GPIO.output(self.audioPIN, GPIO.HIGH)
+                self.amp = True
+            self.lock.notify()
+            return self.next_voice
+
+    def stop(self, voice=None):
+
+        # Stops one voice, or every voice when voice is None
+
+        with self.lock:
+            self.voices = [v for v in self.voices if voice is not None and v[0] != voice]
+
+    def playing(self):
+        return bool(self.voices)
+
+    def wait(self):
+
+        # Blocks until every non looping voice has finished
+
+        while any(not v[4] for v in self.voices):
+            time.sleep(self.period / float(self.rate))
+
+    def render(self):
+
+        # Mixes one period of every active voice into self.out
+
+        mix = self.mix
+        mix[:] = 0
+        with self.lock:
+            voices = list(self.voices)
+        finished = []
+        for voice in voices:
+            number, clip, position, volume, loop = voice
+            filled = 0
+            while filled < self.period:
+                count = min(self.period - filled, len(clip) - position)
+                if count > 0:
+                    mix[filled:filled + count] += clip[position:position + count].astype(np.int32) * volume >> 8
+                    filled += count
+                    position += count
+                if position >= len(clip):
+                    if not loop or len(clip) == 0:
+                        finished.append(number)
+                        break
+                    position = 0
+            voice[2] = position
+        if finished:
+            with self.lock:
+                self.voices = [v for v in self.voices if v[0] not in finished]
+        np.clip(mix, -32768, 32767, out=mix)
+        self.out[:] = mix
+        return bool(voices)
+
+    def run(self):
+        realtime.register()
+        while self.running:
+            with self.lock:
+                if not self.voices and self.amp and \
+                        time.monotonic() - self.last_sound > self.idle_timeout:
+                    GPIO.output(self.audioPIN, GPIO.LOW)
+                    self.amp = False
+                while self.running and not self.amp:
+                    self.sink.idle()
+                    self.lock.wait()
+            if not self.running:
+                break
+            if self.render():
+                self.last_sound = time.monotonic()
+            self.sink.write(self.out.tobytes(), self.period)
+
+    def close(self):
+
+        # Stops playback, disables the amplifier and closes the stream
+
+        with self.lock:
+            self.running = False
+            self.lock.notify()
+        self.thread.join()
+        GPIO.output(self.audioPIN, GPIO.LOW)
+        self.sink.close()
+        self.release()
+
+
+class AlsaSource:
+
+    # ALSA capture stream delivering int16 samples
+    # Arguments:
+    # rate, channels = capture format
+    # period = frames per read
+    # device = ALSA device name (the USB microphone is usually "plughw:1")
+
+    def __init__(self, rate, channels, period, device="default"):
+        import alsaaudio
+        self.rate = rate
+        self.channels = channels
+        self.pcm = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, rate=rate, channels=channels,
+                                 format=alsaaudio.PCM_FORMAT_S16_LE, periodsize=period,
+                                 periods=4, device=device)
+
+    def read(self):
+        while True:
+            length, data = self.pcm.read()
+            if length > 0:
+                return data
+            # negative length is an overrun: samples were lost, read again
+
+    def close(self):
+        self.pcm.close()
+
+
+class WavSource:
+
+    # WAV file standing in for the microphone in tests.
+    # Delivers the file in period sized reads, optionally at the real-time
+    # rate, and returns None at the end of the file.
+    # Arguments:
+    # path = WAV file (16 bit)
+    # period = frames per read
+    # realtime = pace reads at the file's sample rate
+
+    def __init__(self, path, period, realtime=False):
+        self.file = wave.open(path, "rb")
+        if self.file.getsampwidth() != 2:
+            raise ValueError("WavSource needs a 16 bit WAV file")
+        self.rate = self.file.getframerate()
+        self.channels = self.file.getnchannels()
+        self.period = period
+        self.realtime = realtime
+        self.deadline = None
+
+    def read(self):
+        data = self.file.readframes(self.period)
+        if not data:
+            return None
+        if self.realtime:
+            now = time.monotonic()
+            if self.deadline is None:
+                self.deadline = now
+            self.deadline += self.period / float(self.rate)
+            if self.deadline > now:
+                time.sleep(self.deadline - now)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class Microphone:
+
+    # Streaming capture from the USB microphone with voice activity
+    # detection.
+    # Samples are captured on a background thread into a preallocated ring
+    # buffer of fixed size frames (20 ms by default).  For each frame the
+    # RMS level is computed (vectorised over every frame of a read) and a
+    # simple detector marks it voiced when the level is well above the
+    # tracked noise floor, holding the decision for a short hangover.
+    # Callers either iterate frames() or collect voiced segments with
+    # segments() / save_voiced().
+    # Arguments:
+    # source = "alsa" or the path of a WAV file to use instead
+    # rate = sample rate in Hz
+    # frame = samples per frame
+    # seconds = length of the ring buffer
+    # threshold = minimum RMS level (int16 scale) for speech
+    # ratio = how far above the noise floor a voiced frame must be
+    # hangover = frames a voiced decision is held after the level drops
+    # device = ALSA capture device
+    # realtime = pace a WAV source at its sample rate
+
+    def __init__(self, source="alsa", rate=16000, frame=320, seconds=10, threshold=300,
+                 ratio=3.0, hangover=10, device="default", realtime=False):
+        if np is None:
+            raise ImportError("Microphone needs numpy")
+        if source == "alsa":
+            self.source = AlsaSource(rate, 1, frame, device)
+        else:
+            self.source = WavSource(source, frame, realtime)
+        self.rate = self.source.rate
+        self.channels = self.source.channels
+        self.frame = frame
+        self.capacity = max(2, int(seconds * self.rate / frame))
+        self.ring = np.zeros((self.capacity, frame), dtype=np.int16)
+        self.rms = np.zeros(self.capacity, dtype=np.float32)
+        self.voiced = np.zeros(self.capacity, dtype=bool)
+        self.threshold = threshold
+        self.ratio = ratio
+        self.hangover = hangover
+        self.noise = float(threshold) / ratio
+        self.hold = 0
+        self.written = 0
+        self.pending = np.zeros(0, dtype=np.int16)
+        self.finished = False
+        self.lock = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+
+        # Starts capturing on the background thread
+
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def close(self):
+        self.stop()
+        self.source.close()
+
+    def run(self):
+        while self.running:
+            data = self.source.read()
+            if data is None:
+                break
+            samples = np.frombuffer(data, dtype="<i2")
+            if self.channels > 1:
+                samples = samples.reshape(-1, self.channels).mean(axis=1).astype(np.int16)
+            if len(self.pending):
+                samples = np.concatenate((self.pending, samples))
+            count = len(samples) // self.frame
+            self.pending = samples[count * self.frame:].copy()
+            if count:
+                self.store(samples[:count * self.frame].reshape(count, self.frame))
+        with self.lock:
+            self.finished = True
+            self.lock.notify_all()
+
+    def store(self, frames):
+
+        # Writes whole frames into the ring and classifies them
+
+        blocks = frames.astype(np.float32)
+        levels = np.sqrt(np.einsum("ij,ij->i", blocks, blocks) / self.frame)
+        flags = np.empty(len(levels), dtype=bool)
+        for i, level in enumerate(levels):
+            if level > max(self.threshold, self.noise * self.ratio):
+                self.hold = self.hangover
+            elif self.hold > 0:
+                self.hold -= 1
+            else:
+                # only follow the noise floor while nobody is speaking
+                self.noise += 0.05 * (level - self.noise) if level > self.noise else \
+                    0.5 * (level - self.noise)
+            flags[i] = self.hold > 0
+        slots = (self.written + np.arange(len(frames))) % self.capacity
+        self.ring[slots] = frames
+        self.rms[slots] = levels
+        self.voiced[slots] = flags
+        with self.lock:
+            self.written += len(frames)
+            self.lock.notify_all()
+
+    def frames(self, timeout=None):
+
+        # Generator of (index, samples, rms, voiced) for every frame
+        # captured from now on.  samples is a view into the ring buffer and
+        # is only valid until the ring wraps round to it again.  A reader
+        # that falls more than the ring length behind skips ahead.
+        # Arguments:
+        # timeout = seconds to wait for a frame before giving up
+
+        self.start()
+        index = self.written
+        while True:
+            with self.lock:
+                while index >= self.written and not self.finished:
+                    if not self.lock.wait(timeout):
+                        return
+                if index >= self.written:
+                    return
+                written = self.written
+            if written - index > self.capacity - 1:
+                index = written - self.capacity + 1
+            while index < written:
+                slot = index % self.capacity
+                yield index, self.ring[slot], float(self.rms[slot]), bool(self.voiced[slot])
+                index += 1
+
+    def segments(self, pre_roll=0.3, timeout=None):
+
+        # Generator of voiced segments as int16 arrays, each starting
+        # pre_roll seconds before speech was detected
+        # Arguments:
+        # pre_roll = seconds of audio kept from before each segment
+        # timeout = seconds to wait for audio before giving up
+
+        before = deque(maxlen=max(0, int(pre_roll * self.rate / self.frame)))
+        current = None
+        for index, samples, level, voiced in self.frames(timeout):
+            if voiced:
+                if current is None:
+                    current = list(before)
+                    before.clear()
+                current.append(samples.copy())
+            elif current is not None:
+                yield np.concatenate(current)
+                current = None
+            else:
+                before.append(samples.copy())
+        if current:
+            yield np.concatenate(current)
+
+    def save_voiced(self, path, pre_roll=0.3, count=1, timeout=None):
+
+        # Records voiced segments to WAV files.
+        # Returns the list of files written.
+        # Arguments:
+        # path = file name; "{n}" in it is replaced by the segment number
+        # pre_roll = seconds kept from before each segment
+        # count = number of segments to record (None for no limit)
+        # timeout = seconds to wait for audio before giving up
+
+        written = []
+        for n, segment in enumerate(self.segments(pre_roll, timeout)):
+            name = path.format(n=n) if "{n}" in path else path
+            with wave.open(name, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(self.rate)
+                f.writeframes(segment.astype("<i2").tobytes())
+            written.append(name)
+            if count is not None and len(written) >= count:
+                break
+        return written
+
+
+class PiCameraSource:
+
+    # Camera module frames through picamera2
+
+    def __init__(self, size, fps):
+        from picamera2 import Picamera2
+        self.camera = Picamera2()
+        config = self.camera.create_video_configuration(
+            main={"size": size, "format": "RGB888"}, controls={"FrameRate": fps}, buffer_count=4)
+        self.camera.configure(config)
+        self.camera.start()
+
+    def read(self, out):
+        # picamera2 hands back its own array; copy it into the reusable buffer
+        np.copyto(out, self.camera.capture_array("main")[:out.shape[0], :out.shape[1], :3])
+        return True
+
+    def close(self):
+        self.camera.stop()
+        self.camera.close()
+
+
+class VideoSource:
+
+    # Video file standing in for the camera (needs OpenCV)
+    # Arguments:
+    # path = video file
+    # loop = start again at the end of the file
+
+    def __init__(self, path, loop=True):
+        import cv2
+        self.cv2 = cv2
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError("cannot open video %s" % path)
+        self.loop = loop
+        self.scratch = None
+
+    def read(self, out):
+        for attempt in range(2):
+            # OpenCV refills the scratch frame in place once it has the right shape
+            ok, self.scratch = self.capture.read(self.scratch)
+            if ok:
+                frame = self.scratch
+                if frame.shape[:2] != out.shape[:2]:
+                    frame = self.cv2.resize(frame, (out.shape[1], out.shape[0]))
+                # OpenCV delivers BGR
+                np.copyto(out, frame[..., ::-1])
+                return True
+            if not self.loop:
+                return False
+            self.capture.set(self.cv2.CAP_PROP_POS_FRAMES, 0)
+        return False
+
+    def close(self):
+        self.capture.release()
+
+
+class ImageDirSource:
+
+    # Directory of still images standing in for the camera, read in name order
+    # Arguments:
+    # path = directory of images
+    # loop = start again after the last image
+
+    def __init__(self, path, loop=True):
+        self.files = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                      if name.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".ppm"))]
+        if not self.files:
+            raise IOError("no images in %s" % path)
+        self.loop = loop
+        self.index = 0
+
+    def read(self, out):
+        if self.index >= len(self.files):
+            if not self.loop:
+                return False
+            self.index = 0
+        image = Image.open(self.files[self.index]).convert("RGB")
+        self.index += 1
+        if image.size != (out.shape[1], out.shape[0]):
+            image = image.resize((out.shape[1], out.shape[0]))
+        np.copyto(out, np.asarray(image))
+        return True
+
+    def close(self):
+        pass
+
+
+CameraResult = namedtuple("CameraResult", ["index", "timestamp", "motion", "motion_pixels", "line"])
+
+
+class Camera:
+
+    # Camera frame pipeline with motion detection and line finding.
+    # Frames are captured into preallocated buffers and processed by
+    # vectorised numpy stages on a worker thread: block averaged grayscale
+    # at 1/scale resolution, difference against the previous frame, the
+    # bounding box of the changed pixels and the position of a dark line in
+    # the bottom band of the image.  The control loop reads latest() without
+    # blocking; numpy releases the GIL for the heavy stages.
+    # Arguments:
+    # source = "picamera", a video file, a directory of images, or an
+    #          object with read(out) and close()
+    # size = (width, height) of captured frames
+    # scale = downscale factor for processing (must divide the size)
+    # fps = frame rate requested from the camera / used to pace stand-ins
+    # threshold = grey level change that counts as motion
+    # min_pixels = changed pixels needed to report motion
+    # band = fraction of the image height searched for the line
+    # contrast = minimum grey level contrast for a line to be reported
+
+    def __init__(self, source="picamera", size=(320, 240), scale=4, fps=30, threshold=25,
+                 min_pixels=4, band=0.25, contrast=30):
+        if np is None:
+            raise ImportError("Camera needs numpy")
+        width, height = size
+        if width % scale or height % scale:
+            raise ValueError("scale must divide the frame size")
+        if source == "picamera":
+            self.source = PiCameraSource(size, fps)
+            self.period = 0
+        elif isinstance(source, str) and os.path.isdir(source):
+            self.source = ImageDirSource(source)
+            self.period = 1.0 / fps
+        elif isinstance(source, str):
+            self.source = VideoSource(source)
+            self.period = 1.0 / fps
+        else:
+            self.source = source
+            self.period = 0
+        self.size = size
+        self.scale = scale
+        self.threshold = threshold
+        self.min_pixels = min_pixels
+        self.contrast = contrast
+        small = (height // scale, width // scale)
+        self.band = max(1, int(small[0] * band))
+        self.weights = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        self.frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self.rgb = np.zeros((height, width, 3), dtype=np.float32)
+        self.luma = np.zeros((height, width), dtype=np.float32)
+        self.gray = np.zeros(small, dtype=np.float32)
+        self.previous = np.zeros(small, dtype=np.float32)
+        self.diff = np.zeros(small, dtype=np.float32)
+        self.mask = np.zeros(small, dtype=bool)
+        self.profile = np.zeros(small[1], dtype=np.float32)
+        self.columns = np.arange(small[1], dtype=np.float32)
+        self.index = 0
+        self.result = None
+        self.lock = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def read(self):
+
+        # Captures the next frame into self.frame.  Returns False when a
+        # stand-in source has run out of frames.
+
+        return self.source.read(self.frame)
+
+    def grayscale(self):
+
+        # Block averaged grayscale of self.frame into self.gray
+
+        np.multiply(self.frame, self.weights, out=self.rgb)
+        np.sum(self.rgb, axis=2, out=self.luma)
+        height, width = self.gray.shape
+        np.mean(self.luma.reshape(height, self.scale, width, self.scale), axis=(1, 3), out=self.gray)
+
+    def motion(self):
+
+        # Returns ((x0, y0, x1, y1), pixels) of the area that changed since
+        # the previous frame in full frame coordinates, or (None, pixels)
+
+        np.subtract(self.gray, self.previous, out=self.diff)
+        np.abs(self.diff, out=self.diff)
+        np.greater(self.diff, self.threshold, out=self.mask)
+        pixels = int(np.count_nonzero(self.mask))
+        if pixels < self.min_pixels:
+            return None, pixels
+        rows = np.flatnonzero(self.mask.any(axis=1))
+        cols = np.flatnonzero(self.mask.any(axis=0))
+        s = self.scale
+        return (int(cols[0]) * s, int(rows[0]) * s, (int(cols[-1]) + 1) * s, (int(rows[-1]) + 1) * s), pixels
+
+    def line(self):
+
+        # Returns the position of a dark line in the bottom band of the
+        # image from -1 (left edge) to 1 (right edge), or None
+
+        np.mean(self.gray[-self.band:], axis=0, out=self.profile)
+        darkest = float(self.profile.min())
+        if float(self.profile.max()) - darkest < self.contrast:
+            return None
+        # weight the columns by how dark they are, ignoring the light floor
+        np.subtract(darkest + self.contrast / 2.0, self.profile, out=self.profile)
+        np.maximum(self.profile, 0, out=self.profile)
+        centre = float(np.dot(self.profile, self.columns) / self.profile.sum())
+        return centre / (len(self.columns) - 1) * 2 - 1
+
+    def process(self):
+
+        # Runs the processing stages on self.frame and returns a CameraResult
+
+        self.grayscale()
+        if self.index:
+            box, pixels = self.motion()
+        else:
+            box, pixels = None, 0
+        line = self.line()
+        self.gray, self.previous = self.previous, self.gray
+        self.index += 1
+        return CameraResult(self.index, time.time(), box, pixels, line)
+
+    def start(self):
+
+        # Starts capturing and processing on the worker thread
+
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+        self.source.close()
+
+    def run(self):
+        deadline = time.monotonic()
+        while self.running:
+            if not self.read():
+                break
+            result = self.process()
+            with self.lock:
+                self.result = result
+                self.lock.notify_all()
+            if self.period:
+                deadline += self.period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    deadline = time.monotonic()
+        self.running = False
+        with self.lock:
+            self.lock.notify_all()
+
+    def latest(self):
+
+        # Returns the most recent CameraResult (None before the first frame)
+        # without waiting
+
+        return self.result
+
+    def wait(self, timeout=None):
+
+        # Waits for a result newer than the current one and returns it
+
+        with self.lock:
+            index = self.result.index if self.result else 0
+            self.lock.wait_for(lambda: (self.result and self.result.index > index)
+                               or not self.running, timeout)
+            return self.result
+
+
+class IRDetect(PinOwner):
+
+    owner = "IR_REMOTE"
+
+    irpins = {"IR_REMOTE": {"pin": 20}}
+
+    def __init__(self, pins=None):
+        self.irPIN = (pins or self.irpins[self.owner])["pin"]
+        self.claim(self.irPIN, GPIO.IN, GPIO.PUD_UP)
         
     def exec_cmd(self, key_val):
         if(key_val==0x45):
@@ -373,42 +2348,55 @@ class IRDetect:
         elif(key_val==0x52):
             return("Down")
     
+    def read_edges(self):
+
+        # Decodes an NEC frame from kernel timestamped edges (gpiod backend).
+        # Returns None straight away when no frame has started.
+
+        edges = GPIO.edges(self.irPIN, 68, 0, 0.012)
+        if len(edges) < 68 or edges[0][1] != GPIO.LOW:
+            return None
+        data = [0, 0, 0, 0]
+        for i in range(32):
+            high = edges[4 + 2 * i][0] - edges[3 + 2 * i][0]
+            if high > 1100000:
+                data[i // 8] |= 1 << (i % 8)
+        if data[0]+data[1] == 0xFF and data[2]+data[3] == 0xFF:
+            return self.exec_cmd(data[2])
+
+    def pulse(self, level, limit):
+
+        # Waits while the receiver stays at level (at most limit seconds)
+        # and returns how long that was
+
+        start = clock.perf_counter()
+        while GPIO.input(self.irPIN) == level and clock.perf_counter() - start < limit:
+            clock.sleep(0.00006)
+        return clock.perf_counter() - start
+
     def read(self):
+        if hasattr(GPIO, "edges"):
+            return self.read_edges()
         if GPIO.input(self.irPIN) == 0:
-            count = 0
-            while GPIO.input(self.irPIN) == 0 and count < 200:
-                count += 1
-                time.sleep(0.00006)
-            count = 0
-            while GPIO.input(self.irPIN) == 1 and count < 80:
-                count += 1
-                time.sleep(0.00006)
-            idx = 0
-            cnt = 0
-            data = [0,0,0,0]
-            for i in range(0,32):
-                count = 0
-                while GPIO.input(self.irPIN) == 0 and count < 15:
-                    count += 1
-                    time.sleep(0.00006)
-                count = 0
-                while GPIO.input(self.irPIN) == 1 and count < 40:
-                    count += 1
-                    time.sleep(0.00006)
-                if count > 8:
-                    data[idx] |= 1<<cnt
-                if cnt == 7:
-                    cnt = 0
-                    idx += 1
-                else:
-                    cnt += 1
+            with realtime.critical():
+                # pulse lengths are timed rather than counted in polls, so
+                # decoding doesn't depend on how long each sleep really takes
+                self.pulse(0, 0.012)
+                self.pulse(1, 0.005)
+                data = [0,0,0,0]
+                for i in range(0,32):
+                    self.pulse(0, 0.001)
+                    if self.pulse(1, 0.0025) > 0.0011:
+                        data[i // 8] |= 1 << (i % 8)
             if data[0]+data[1] == 0xFF and data[2]+data[3] == 0xFF:
                    # print("Get the key: 0x%02x" %data[2])
                     
                     return self.exec_cmd(data[2])
                             
     
-class LED:
+class LED(PinOwner):
+
+    owner = "LED"
 
     def __init__(self):
 
@@ -427,6 +2415,8 @@ class LED:
         LED_INVERT = False
         # set to '1' for GPIOs 13. 19, 41, 45 or 53
         LED_CHANNEL = 0
+        # The strip drives the pin through SPI rather than RPi.GPIO
+        self.claim(LED_PIN, PinRegistry.SPI)
         # Create NeoPixel object with appropriate configuration.
         self.strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
         # Intialize the library (must be called once before other functions).
@@ -451,21 +2441,372 @@ class LED:
         self.strip.show()
     
 
-class OLED:
+class I2CTransaction:
 
-    def __init__(self):
+    # One queued I2C transfer
+    # kind = "w" (write), "r" (read) or "wr" (write then read)
 
-        #self.disp32 = adafruit_ssd1306.SSD1306_I2C(128, 32, i2c)
-        #self.disp64 = adafruit_ssd1306.SSD1306_I2C(128, 64, i2c)
-        self.line = ["","","",""]
-        pass
+    def __init__(self, address, kind, data, readbuf, key):
+        self.address = address
+        self.kind = kind
+        self.data = data
+        self.readbuf = readbuf
+        self.key = key
+        self.queued = time.perf_counter()
+        self.done = threading.Event()
+        self.error = None
 
-    def stats(self):
-        
-        self.disp32 = adafruit_ssd1306.SSD1306_I2C(128, 32, i2c)
-        # Clear display.
-        self.disp32.fill(0)
-        self.disp32.show()
+
+class I2CBus:
+
+    # Shared manager for the I2C bus used by the OLED, the Grove sockets
+    # and the PCA9685.
+    # Every transfer is queued and executed by one bus thread in priority
+    # order, so motor/servo traffic goes ahead of display traffic instead
+    # of waiting behind a whole frame.  Asynchronous writes queued with a
+    # key replace any still-queued write to the same device with the same
+    # key.  Bus time, byte counts and queue wait times are accounted per
+    # device address (see stats()).
+    # Drivers use one of three views of the bus:
+    # device() = I2CDevice style handle (with dev: dev.write(...))
+    # port() = busio.I2C style object for drivers that take an i2c bus
+    # smbus() = smbus.SMBus style object
+    # Arguments:
+    # i2c = busio.I2C bus
+
+    CONTROL = 0
+    SENSOR = 1
+    DISPLAY = 2
+
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.queue = []
+        self.pending = {}
+        self.ready = threading.Condition()
+        self.sequence = 0
+        self.thread = None
+        self.names = {}
+        self.reset_stats()
+
+    def device(self, address, priority=SENSOR, name=None):
+        if name:
+            self.names[address] = name
+        return I2CHandle(self, address, priority)
+
+    def port(self, priority=SENSOR, name=None):
+        return I2CPort(self, priority, name)
+
+    def smbus(self, priority=SENSOR, name=None):
+        return I2CSMBus(self, priority, name)
+
+    def submit(self, address, priority, kind, data=b"", readbuf=None, wait=True, key=None):
+
+        # Queues a transfer.  With wait (the default) blocks until it has
+        # been executed and raises any bus error; otherwise returns at once.
+        # Arguments:
+        # address = 7 bit device address
+        # priority = I2CBus.CONTROL, SENSOR or DISPLAY (lower goes first)
+        # kind = "w", "r" or "wr"
+        # data = bytes to write
+        # readbuf = buffer to read into
+        # wait = block until done
+        # key = coalescing key for asynchronous writes
+
+        with self.ready:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            if not wait and key is not None:
+                queued = self.pending.get((address, key))
+                if queued is not None:
+                    queued.data = data
+                    self.stat(address)["coalesced"] += 1
+                    return queued
+            transaction = I2CTransaction(address, kind, data, readbuf, key if not wait else None)
+            if transaction.key is not None:
+                self.pending[(address, key)] = transaction
+            self.sequence += 1
+            heapq.heappush(self.queue, (priority, self.sequence, transaction))
+            self.ready.notify()
+        if wait:
+            transaction.done.wait()
+            if transaction.error is not None:
+                raise transaction.error
+        return transaction
+
+    def run(self):
+        while True:
+            with self.ready:
+                while not self.queue:
+                    self.ready.wait()
+                priority, sequence, transaction = heapq.heappop(self.queue)
+                if transaction.key is not None:
+                    self.pending.pop((transaction.address, transaction.key), None)
+            i2c = self.i2c
+            while not i2c.try_lock():
+                pass
+            start = time.perf_counter()
+            try:
+                if transaction.kind == "w":
+                    i2c.writeto(transaction.address, transaction.data)
+                elif transaction.kind == "r":
+                    i2c.readfrom_into(transaction.address, transaction.readbuf)
+                else:
+                    i2c.writeto_then_readfrom(transaction.address, transaction.data,
+                                              transaction.readbuf)
+            except Exception as error:
+                transaction.error = error
+            finally:
+                i2c.unlock()
+            end = time.perf_counter()
+            wait = start - transaction.queued
+            with self.ready:
+                stat = self.stat(transaction.address)
+                stat["transactions"] += 1
+                stat["bytes"] += len(transaction.data) + \
+                    (len(transaction.readbuf) if transaction.readbuf is not None else 0)
+                stat["busy"] += end - start
+                stat["wait"] += wait
+                stat["wait_max"] = max(stat["wait_max"], wait)
+                stat["waits"].append(wait)
+                if transaction.error is not None:
+                    stat["errors"] += 1
+            transaction.done.set()
+
+    def stat(self, address):
+
+        # Returns the counters of one address, creating them on first use
+
+        with self.ready:
+            entry = self.counters.get(address)
+            if entry is None:
+                entry = {"transactions": 0, "bytes": 0, "busy": 0.0, "wait": 0.0, "wait_max": 0.0,
+                         "waits": deque(maxlen=1000), "coalesced": 0, "errors": 0}
+                self.counters[address] = entry
+            return entry
+
+    def reset_stats(self):
+        with self.ready:
+            self.counters = {}
+            self.since = time.perf_counter()
+
+    def stats(self):
+
+        # Returns bus accounting per device since the last reset_stats():
+        # transactions, bytes, busy seconds, utilisation (fraction of wall
+        # time the device held the bus), mean / p99 / max queue wait in
+        # seconds, coalesced writes and errors.
+
+        with self.ready:
+            elapsed = max(time.perf_counter() - self.since, 1e-9)
+            counters = [(address, dict(entry, waits=sorted(entry["waits"])))
+                        for address, entry in sorted(self.counters.items())]
+        report = {}
+        for address, entry in counters:
+            waits = entry["waits"]
+            count = max(entry["transactions"], 1)
+            report[self.names.get(address, "0x%02x" % address)] = {
+                "transactions": entry["transactions"],
+                "bytes": entry["bytes"],
+                "busy": entry["busy"],
+                "utilisation": entry["busy"] / elapsed,
+                "wait_mean": entry["wait"] / count,
+                "wait_p99": waits[int(0.99 * (len(waits) - 1))] if waits else 0.0,
+                "wait_max": entry["wait_max"],
+                "coalesced": entry["coalesced"],
+                "errors": entry["errors"]}
+        return report
+
+    def scan(self):
+        while not self.i2c.try_lock():
+            pass
+        try:
+            return self.i2c.scan()
+        finally:
+            self.i2c.unlock()
+
+
+class I2CHandle:
+
+    # Handle on one device of an I2CBus, usable wherever an
+    # adafruit_bus_device I2CDevice is expected.  Holding the handle
+    # (with handle: ...) keeps other threads from interleaving transfers
+    # to this device; other devices can still use the bus in between.
+
+    def __init__(self, bus, address, priority):
+        self.bus = bus
+        self.device_address = address
+        self.priority = priority
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.lock.release()
+        return False
+
+    def write(self, buf, start=0, end=None, wait=True, key=None):
+        self.bus.submit(self.device_address, self.priority, "w", bytes(buf[start:end]),
+                        wait=wait, key=key)
+
+    def readinto(self, buf, start=0, end=None):
+        view = memoryview(buf)[start:end]
+        self.bus.submit(self.device_address, self.priority, "r", readbuf=view)
+
+    def write_then_readinto(self, out_buffer, in_buffer, out_start=0, out_end=None,
+                            in_start=0, in_end=None):
+        view = memoryview(in_buffer)[in_start:in_end]
+        self.bus.submit(self.device_address, self.priority, "wr",
+                        bytes(out_buffer[out_start:out_end]), view)
+
+
+class I2CPort:
+
+    # busio.I2C style view of an I2CBus at a fixed priority, for drivers
+    # such as adafruit_ssd1306 that are given a bus rather than a device.
+    # try_lock() blocks until this port is free, so two threads sharing
+    # one driver cannot interleave its transfers.
+
+    def __init__(self, bus, priority, name):
+        self.bus = bus
+        self.priority = priority
+        self.name = name
+        self.lock = threading.RLock()
+
+    def try_lock(self):
+        self.lock.acquire()
+        return True
+
+    def unlock(self):
+        self.lock.release()
+
+    def writeto(self, address, buffer, start=0, end=None):
+        if self.name:
+            self.bus.names.setdefault(address, self.name)
+        self.bus.submit(address, self.priority, "w", bytes(buffer[start:end]))
+
+    def readfrom_into(self, address, buffer, start=0, end=None):
+        self.bus.submit(address, self.priority, "r", readbuf=memoryview(buffer)[start:end])
+
+    def writeto_then_readfrom(self, address, out_buffer, in_buffer, out_start=0,
+                              out_end=None, in_start=0, in_end=None):
+        self.bus.submit(address, self.priority, "wr", bytes(out_buffer[out_start:out_end]),
+                        memoryview(in_buffer)[in_start:in_end])
+
+    def scan(self):
+        return self.bus.scan()
+
+    def deinit(self):
+        pass
+
+
+class I2CSMBus:
+
+    # smbus.SMBus style view of an I2CBus at a fixed priority
+
+    def __init__(self, bus, priority, name):
+        self.bus = bus
+        self.priority = priority
+        self.name = name
+
+    def write(self, address, data):
+        if self.name:
+            self.bus.names.setdefault(address, self.name)
+        self.bus.submit(address, self.priority, "w", bytes(data))
+
+    def read(self, address, register, count):
+        buf = bytearray(count)
+        if register is None:
+            self.bus.submit(address, self.priority, "r", readbuf=buf)
+        else:
+            self.bus.submit(address, self.priority, "wr", bytes([register]), buf)
+        return list(buf)
+
+    def write_quick(self, address):
+        self.write(address, b"")
+
+    def write_byte(self, address, value):
+        self.write(address, [value])
+
+    def read_byte(self, address):
+        return self.read(address, None, 1)[0]
+
+    def write_byte_data(self, address, register, value):
+        self.write(address, [register, value])
+
+    def read_byte_data(self, address, register):
+        return self.read(address, register, 1)[0]
+
+    def write_word_data(self, address, register, value):
+        self.write(address, [register, value & 0xFF, (value >> 8) & 0xFF])
+
+    def read_word_data(self, address, register):
+        low, high = self.read(address, register, 2)
+        return low | (high << 8)
+
+    def write_i2c_block_data(self, address, register, data):
+        self.write(address, [register] + list(data))
+
+    def read_i2c_block_data(self, address, register, length=32):
+        return self.read(address, register, length)
+
+    def close(self):
+        pass
+
+
+# Shared manager for the board's I2C bus
+i2cbus = I2CBus(i2c)
+
+
+class OLED:
+
+    # Default image shown by img()
+    image_path = "/home/pi/micropi/images/micropi_oled_64.ppm"
+    # Converted image frames are cached here, keyed by file hash and size
+    cache_dir = os.path.expanduser("~/.cache/micropi/oled")
+
+    def __init__(self):
+
+        #self.disp32 = adafruit_ssd1306.SSD1306_I2C(128, 32, i2c)
+        #self.disp64 = adafruit_ssd1306.SSD1306_I2C(128, 64, i2c)
+        self.line = ["","","",""]
+        self.disp = None
+        self.port = i2cbus.port(I2CBus.DISPLAY, "oled")
+        self.player = None
+        self.playing = threading.Event()
+
+    def display(self, height):
+
+        # Returns the SSD1306 driver for the given panel height (32 or 64).
+        # The driver is kept and reused; a new one is only built when the
+        # panel height changes.  The panel is cleared whenever a driver is
+        # built so that its buffer always matches what is on the glass.
+        # Display traffic goes through i2cbus at display priority.
+
+        if self.disp is not None and self.disp.height == height:
+            return self.disp
+        self.disp = adafruit_ssd1306.SSD1306_I2C(128, height, self.port)
+        self.disp.fill(0)
+        self.disp.show()
+        return self.disp
+
+    def stats(self, info=None):
+
+        # Shows the IP address, CPU load, memory and disk use
+        # Arguments:
+        # info = (IP, CPU, MemUsage, Disk) from system_info(), collected
+        # here when omitted
+
+        if info is None:
+            info = self.system_info()
+        IP, CPU, MemUsage, Disk = info
+        self.stop()
+        self.disp32 = self.display(32)
+        # Clear display.
+        self.disp32.fill(0)
+        self.disp32.show()
         
         # Create blank image for drawing.
         # Make sure to create image with mode '1' for 1-bit color.
@@ -499,23 +2840,6 @@ class OLED:
         # Draw a black filled box to clear the image.
         self.draw.rectangle((0, 0, width, height), outline=0, fill=0)
 
-        # Shell scripts for system monitoring from here:
-        # https://unix.stackexchange.com/questions/119126/command-to-display-memory-usage-disk-usage-and-cpu-load
-        cmd = "hostname -I | cut -d' ' -f1"
-        IP = subprocess.check_output(cmd, shell=True).decode("utf-8")
-        #self.setline(0,IP)
-        cmd = 'cut -f 1 -d " " /proc/loadavg'
-        CPU = subprocess.check_output(cmd, shell=True).decode("utf-8")
-        cmd = "free -m | awk 'NR==2{printf \"Mem: %s/%s MB  %.2f%%\", $3,$2,$3*100/$2 }'"
-        #self.setline(1,CPU)
-        MemUsage = subprocess.check_output(cmd, shell=True).decode("utf-8")
-        cmd = 'df -h | awk \'$NF=="/"{printf "Disk: %d/%d GB  %s", $3,$2,$5}\''
-        #self.setline(2,MemUsage)
-        Disk = subprocess.check_output(cmd, shell=True).decode("utf-8")
-        #self.setline(3,Disk)
-        
-        IP = "IP:" + self.get_ip_address() # Keep checking for IP Address to appear
-            
         self.draw.text((x, top + 0), "IP: " + IP, font=font, fill=255)
         self.draw.text((x, top + 8), "CPU load: " + CPU, font=font, fill=255)
         self.draw.text((x, top + 16), MemUsage, font=font, fill=255)
@@ -524,20 +2848,55 @@ class OLED:
         # Display image.
         self.disp32.image(self.image)
         self.disp32.show()
-        time.sleep(0.1)
+        clock.sleep(0.1)
         
 
-    def get_ip_address(self):
+    def system_info(self, ip_timeout=None):
+
+        # Returns the (IP, CPU, MemUsage, Disk) text lines shown by stats().
+        # The figures are read from /proc and statvfs rather than from
+        # shell pipelines, which cost a process start each on a Pi Zero.
+        # Arguments:
+        # ip_timeout = seconds to wait for an IP address (None waits for it)
+
+        IP = self.get_ip_address(ip_timeout).split(" ")[0].strip() or "no network"
+        with open("/proc/loadavg") as f:
+            CPU = f.read().split()[0]
+        meminfo = {}
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                meminfo[key] = int(value.split()[0])
+        total = meminfo["MemTotal"] // 1024
+        used = total - meminfo.get("MemAvailable", meminfo["MemFree"]) // 1024
+        MemUsage = "Mem: %s/%s MB  %.2f%%" % (used, total, used * 100.0 / total)
+        disk = os.statvfs("/")
+        size = disk.f_blocks * disk.f_frsize
+        free = disk.f_bavail * disk.f_frsize
+        taken = (disk.f_blocks - disk.f_bfree) * disk.f_frsize
+        Disk = "Disk: %d/%d GB  %d%%" % (taken / 2.0 ** 30, size / 2.0 ** 30,
+                                          math.ceil(taken * 100.0 / (taken + free)) if taken + free else 0)
+        return IP, CPU, MemUsage, Disk
+
+    @staticmethod
+    def get_ip_address(timeout=None):
 
-        ip = "0.0.0.0"
-        while len(ip) < 8:
-            cmd = "hostname -I"
-            ip = subprocess.check_output(cmd, shell = True ).decode('ASCII')
-        return ip
+        # Waits for the network to give the Pi an address and returns the
+        # output of hostname -I ("" if timeout seconds pass first)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ip = subprocess.check_output(["hostname", "-I"]).decode('ASCII')
+            if len(ip) >= 8:
+                return ip
+            if deadline is not None and time.monotonic() >= deadline:
+                return ""
+            clock.sleep(0.25)
     
     def print(self, line, str):
         
-        self.disp32 = adafruit_ssd1306.SSD1306_I2C(128, 32, i2c)
+        self.stop()
+        self.disp32 = self.display(32)
         # Clear display.
         self.disp32.fill(0)
         self.disp32.show()
@@ -587,43 +2946,1000 @@ class OLED:
         
         self.disp32.image(self.image)
         self.disp32.show()
-        time.sleep(0.1)
+        clock.sleep(0.1)
              
             
             
-    def img(self):
-            
-            self.disp64 = adafruit_ssd1306.SSD1306_I2C(128, 64, i2c)
-            # Clear display.
-            self.disp64.fill(0)
-            self.disp64.show()
-
-            # Load image based on OLED display height.  Note that image is converted to 1 bit color.
-            #print(self.disp64.height)
-            self.image = Image.open("/home/pi/micropi/images/micropi_oled_64.ppm").convert("1")
-                
-            # Display image.
-            self.disp64.image(self.image)
-            self.disp64.show()
+    def img(self, path=None):
+
+        # Shows the MicroPi logo (or another image) on the 128x64 panel
+        # Arguments:
+        # path = image file, defaults to OLED.image_path
+
+        self.show_image(path or self.image_path)
+
+    def pack(self, image, width=128, height=64):
+
+        # Converts a PIL image into the SSD1306 page buffer layout.
+        # The image is scaled to the panel, dithered down to 1 bit and
+        # packed as height/8 pages of width bytes, bit 0 being the top row
+        # of each page.
+        # Arguments:
+        # image = PIL Image
+        # width, height = panel size in pixels
+
+        if image.size != (width, height):
+            image = image.convert("L").resize((width, height), Image.LANCZOS)
+        if image.mode != "1":
+            image = image.convert("1")
+        # Rotating clockwise turns every panel column into one packed row,
+        # most significant bit first from the bottom of the panel.
+        columns = image.transpose(Image.ROTATE_270).tobytes()
+        pages = height // 8
+        return b"".join(columns[pages - 1 - page::pages] for page in range(pages))
+
+    def load(self, source, width=128, height=64):
+
+        # Returns the packed page buffers for every frame of an image file
+        # (one for a still image, several for an animated GIF) or for a PIL
+        # image.  Files are converted once and kept in OLED.cache_dir.
+        # Arguments:
+        # source = file path or PIL Image
+        # width, height = panel size in pixels
+
+        if isinstance(source, Image.Image):
+            return [self.pack(frame.copy(), width, height)
+                    for frame in ImageSequence.Iterator(source)]
+        with open(source, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        size = width * height // 8
+        cached = os.path.join(self.cache_dir, "%s-%dx%d.bin" % (digest, width, height))
+        if os.path.exists(cached):
+            with open(cached, "rb") as f:
+                data = f.read()
+            if data and len(data) % size == 0:
+                return [data[i:i + size] for i in range(0, len(data), size)]
+        with Image.open(source) as image:
+            frames = [self.pack(frame.copy(), width, height)
+                      for frame in ImageSequence.Iterator(image)]
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(cached + ".tmp", "wb") as f:
+                f.write(b"".join(frames))
+            os.replace(cached + ".tmp", cached)
+        except OSError:
+            pass
+        return frames
+
+    def push(self, disp, pages):
+
+        # Sends a packed page buffer to the panel, transferring only what
+        # changed since the last frame: each changed page is sent as one
+        # addressing window covering its changed columns, so an unchanged
+        # frame costs no bus traffic at all.  Pages go out as separate
+        # transfers so higher priority I2C traffic can run in between.
+        # Returns the number of data bytes written.
+        # Arguments:
+        # disp = SSD1306 driver from display()
+        # pages = packed page buffer
+
+        width = disp.width
+        buffer = disp.buffer
+        device = disp.i2c_device
+        sent = 0
+        with device:
+            for page in range(disp.height // 8):
+                start = page * width
+                new = pages[start:start + width]
+                old = buffer[1 + start:1 + start + width]
+                if new == old:
+                    continue
+                first = 0
+                while new[first] == old[first]:
+                    first += 1
+                last = width - 1
+                while new[last] == old[last]:
+                    last -= 1
+                # Co=0, D/C=0: the rest of the transfer is command bytes
+                device.write(bytes((0x00, 0x21, first, last, 0x22, page, page)))
+                data = bytearray(1 + last - first + 1)
+                data[0] = 0x40
+                data[1:] = new[first:last + 1]
+                device.write(data)
+                buffer[1 + start + first:1 + start + last + 1] = data[1:]
+                sent += len(data)
+        return sent
+
+    def show_image(self, source, height=64):
+
+        # Displays an image file or PIL image.
+        # Arguments:
+        # source = file path or PIL Image (first frame is used)
+        # height = panel height, 32 or 64
+
+        self.stop()
+        disp = self.display(height)
+        self.push(disp, self.load(source, disp.width, height)[0])
+
+    def play(self, frames, fps=20, height=64, loop=False):
+
+        # Plays an animation on a timing thread.
+        # All frames are converted (or fetched from the cache) before
+        # playback starts; during playback only changed pages are sent.
+        # If the bus cannot keep up with the requested rate, frames are
+        # shown as fast as the bus allows.
+        # Arguments:
+        # frames = animated image file, or a list of files / PIL Images
+        # fps = frames per second
+        # height = panel height, 32 or 64
+        # loop = repeat until stop() is called
+
+        self.stop()
+        disp = self.display(height)
+        if isinstance(frames, (str, Image.Image)):
+            frames = [frames]
+        buffers = []
+        for frame in frames:
+            buffers.extend(self.load(frame, disp.width, height))
+        self.play_stats = {"frames": 0, "bytes": 0, "fps": 0.0}
+        self.playing.set()
+        self.player = threading.Thread(target=self.run_player,
+                                       args=(disp, buffers, 1.0 / fps, loop), daemon=True)
+        self.player.start()
+        return self.player
+
+    def run_player(self, disp, buffers, period, loop):
+        start = time.monotonic()
+        deadline = start
+        shown = 0
+        while self.playing.is_set():
+            for pages in buffers:
+                if not self.playing.is_set():
+                    break
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.play_stats["bytes"] += self.push(disp, pages)
+                shown += 1
+                self.play_stats["frames"] = shown
+                deadline += period
+                if deadline < time.monotonic() - period:
+                    deadline = time.monotonic()
+            if not loop:
+                break
+        elapsed = time.monotonic() - start
+        self.play_stats["fps"] = shown / elapsed if elapsed > 0 else 0.0
+        self.playing.clear()
+
+    def wait(self):
+
+        # Blocks until a non looping animation has finished
+
+        if self.player is not None:
+            self.player.join()
+
+    def stop(self):
+
+        # Stops any animation started by play()
+
+        if self.player is not None and self.player is not threading.current_thread():
+            self.playing.clear()
+            self.player.join()
+            self.player = None
 
-            
     def __del__(self):
         # GPIO.cleanup()
         pass
 
 
-class Buttons:
+class OLEDGraph:
 
-    def __init__(self):
+    # Scrolling sparkline graphs on the 128x32 OLED panel.
+    # Each series gets its own horizontal band with a scale label on the
+    # left and keeps a circular buffer of one sample per plot column.
+    # Adding a sample shifts the plot area one column to the left inside
+    # the page buffer and draws only the new column; the whole plot is
+    # only redrawn when a series has to be rescaled.
+    # For 30+ samples per second the I2C bus should run at 400 kHz
+    # (dtparam=i2c_arm_baudrate=400000 in /boot/config.txt).
+    # Arguments:
+    # oled = OLED object
+    # series = list of series names
+    # minimum, maximum = fixed scale for every series; None autoscales
+    # label_width = pixels reserved on the left for the scale labels
+
+    def __init__(self, oled, series, minimum=None, maximum=None, label_width=24, height=32):
+        self.oled = oled
+        self.disp = oled.display(height)
+        self.width = self.disp.width
+        self.height = height
+        self.pages = bytearray(self.width * (height // 8))
+        self.label_width = label_width
+        self.plot_width = self.width - label_width
+        self.names = list(series)
+        band = height // len(self.names)
+        self.bands = [(i * band, (i + 1) * band - 2 if i < len(self.names) - 1 else height - 1)
+                      for i in range(len(self.names))]
+        self.samples = [deque(maxlen=self.plot_width) for _ in self.names]
+        self.minimum = minimum
+        self.maximum = maximum
+        self.scales = [None] * len(self.names)
+        self.last_y = [None] * len(self.names)
+        self.labels = {}
+        self.font = ImageFont.load_default()
+
+    def add(self, *values, push=True):
+
+        # Adds one sample to every series and scrolls the graph.
+        # Arguments:
+        # *values = one value per series, in the order given at creation
+        # push = send the frame to the panel straight away
+
+        if len(values) != len(self.names):
+            raise ValueError("OLEDGraph.add() needs %d values (%s), got %d"
+                             % (len(self.names), ", ".join(self.names), len(values)))
+        redraw = False
+        for i, value in enumerate(values):
+            self.samples[i].append(value)
+            scale = self.fit(i)
+            if scale != self.scales[i]:
+                self.scales[i] = scale
+                redraw = True
+        if redraw:
+            self.redraw()
+        else:
+            self.scroll()
+            self.draw_column(self.width - 1, [self.y(i, v) for i, v in enumerate(values)])
+        if push:
+            self.refresh()
+
+    def refresh(self):
+
+        # Sends the current graph to the panel (only changed pages)
+
+        self.oled.push(self.disp, self.pages)
+
+    def fit(self, i):
+
+        # Returns the (low, high) scale for a series.
+        # Autoscaled limits are rounded out to 1, 2 or 5 times a power of
+        # ten so that the scale (and its label) only changes occasionally.
+
+        samples = self.samples[i]
+        low = self.minimum if self.minimum is not None else min(min(samples), 0)
+        high = self.maximum if self.maximum is not None else max(samples)
+        if self.maximum is None:
+            high = self.nice(high)
+            current = self.scales[i]
+            if current is not None and current[1] >= high and max(samples) > current[1] / 4:
+                high = current[1]
+        if high <= low:
+            high = low + 1
+        return (low, high)
+
+    def nice(self, value):
+        if value <= 0:
+            return 1
+        power = 10 ** math.floor(math.log10(value))
+        for step in (1, 2, 5, 10):
+            if value <= step * power:
+                return step * power
+        return 10 * power
+
+    def y(self, i, value):
+        top, bottom = self.bands[i]
+        low, high = self.scales[i]
+        fraction = (value - low) / float(high - low)
+        fraction = min(1.0, max(0.0, fraction))
+        return bottom - int(round(fraction * (bottom - top)))
+
+    def scroll(self):
+        width = self.width
+        first = self.label_width
+        for page in range(self.height // 8):
+            start = page * width
+            self.pages[start + first:start + width - 1] = self.pages[start + first + 1:start + width]
+
+    def draw_column(self, x, ys):
+
+        # Draws one plot column, joining each series to its previous point
+        # with a vertical run so the trace stays continuous.
+        # Arguments:
+        # ys = one y per series, None for a series with no sample there
+
+        column = 0
+        for i, y in enumerate(ys):
+            if y is None:
+                continue
+            previous = self.last_y[i]
+            if previous is None:
+                previous = y
+            low = min(previous, y)
+            high = max(previous, y)
+            column |= ((1 << (high + 1)) - 1) ^ ((1 << low) - 1)
+            self.last_y[i] = y
+        for page in range(self.height // 8):
+            self.pages[page * self.width + x] = (column >> (page * 8)) & 0xFF
+
+    def redraw(self):
+
+        # Redraws labels and the whole plot from the sample buffers
+
+        for i in range(len(self.pages)):
+            self.pages[i] = 0
+        for i, name in enumerate(self.names):
+            self.draw_label(i, self.label(self.scales[i][1]))
+        self.last_y = [None] * len(self.names)
+        count = max(len(samples) for samples in self.samples)
+        for column in range(count):
+            ys = []
+            for i, samples in enumerate(self.samples):
+                offset = column - (count - len(samples))
+                ys.append(self.y(i, samples[offset]) if offset >= 0 else None)
+            self.draw_column(self.width - count + column, ys)
+
+    def label(self, value):
+        if value >= 1000:
+            return "%dk" % (value // 1000)
+        if value == int(value):
+            return "%d" % value
+        return "%.2g" % value
+
+    def draw_label(self, i, text):
+
+        # Copies a label into the label area of band i.
+        # Rendered labels are cached as column bitmaps.
+
+        top, bottom = self.bands[i]
+        key = (text, bottom - top + 1)
+        columns = self.labels.get(key)
+        if columns is None:
+            image = Image.new("1", (self.label_width, bottom - top + 1))
+            ImageDraw.Draw(image).text((0, -1), text, font=self.font, fill=255)
+            pixels = image.load()
+            columns = []
+            for x in range(self.label_width):
+                bits = 0
+                for y in range(bottom - top + 1):
+                    if pixels[x, y]:
+                        bits |= 1 << y
+                columns.append(bits)
+            self.labels[key] = columns
+        for x, bits in enumerate(columns):
+            bits <<= top
+            for page in range(self.height // 8):
+                self.pages[page * self.width + x] |= (bits >> (page * 8)) & 0xFF
+
+
+class GroveLCD:
+
+    # Grove 16x2 LCD with RGB backlight on the I2C Grove sockets.
+    # Keeps a shadow copy of the character grid and the backlight colour
+    # so that only what changed is sent: each row costs at most one cursor
+    # move and one block write, and an unchanged colour costs nothing.
+    # The number of bus transactions issued is kept in self.transactions.
+    # Arguments:
+    # bus = SMBus-like object, defaults to i2cbus at display priority
+
+    DISPLAY_RGB_ADDR = 0x62
+    DISPLAY_TEXT_ADDR = 0x3e
+    COLUMNS = 16
+    ROWS = 2
+
+    def __init__(self, bus=None):
+        if bus is None:
+            bus = i2cbus.smbus(I2CBus.DISPLAY, "grove-lcd")
+        self.bus = bus
+        self.transactions = 0
+        self.shadow = bytearray(b" " * (self.COLUMNS * self.ROWS))
+        self.cursor = None
+        self.rgb = None
+        self.textCommand(0x01) # clear display
+        clock.sleep(0.002)
+        self.textCommand(0x08 | 0x04) # display on, no cursor
+        self.textCommand(0x28) # 2 lines
+        self.cursor = 0
+        self.write_rgb(0, 0x00)
+        self.write_rgb(1, 0x00)
+        self.write_rgb(0x08, 0xaa)
+
+    def write_rgb(self, register, value):
+        self.bus.write_byte_data(self.DISPLAY_RGB_ADDR, register, value)
+        self.transactions += 1
+
+    def textCommand(self, cmd):
+
+        # Sends a command byte to the display controller
+
+        self.bus.write_byte_data(self.DISPLAY_TEXT_ADDR, 0x80, cmd)
+        self.transactions += 1
+
+    def setRGB(self, r, g, b):
+
+        # Sets the backlight colour (values from 0..255 for each).
+        # The three PWM registers are written in one auto-increment block
+        # and only when the colour actually changes.
+
+        rgb = (r & 0xFF, g & 0xFF, b & 0xFF)
+        if rgb == self.rgb:
+            return
+        # 0xA2: auto-increment over the individual brightness registers,
+        # starting at register 2 (blue), then 3 (green) and 4 (red)
+        self.bus.write_i2c_block_data(self.DISPLAY_RGB_ADDR, 0xA2, [rgb[2], rgb[1], rgb[0]])
+        self.transactions += 1
+        self.rgb = rgb
+
+    def layout(self, text):
+
+        # Lays text out on the grid the way the display wraps it:
+        # "\n" starts the second line, long first lines wrap onto it.
+
+        grid = bytearray(b" " * (self.COLUMNS * self.ROWS))
+        row = 0
+        count = 0
+        for c in text:
+            if c == "\n":
+                row += 1
+                count = 0
+                continue
+            if count == self.COLUMNS:
+                row += 1
+                count = 0
+            if row >= self.ROWS:
+                break
+            grid[row * self.COLUMNS + count] = ord(c) & 0xFF
+            count += 1
+        return grid
+
+    def setText(self, text):
+
+        # Shows text on the display, "\n" for the second line (or auto
+        # wrap).  Only the characters that differ from what is already on
+        # the display are sent.
+
+        self.update(self.layout(text))
+
+    def write(self, row, column, text):
+
+        # Writes text at a position without touching the rest of the display
+        # Arguments:
+        # row = 0 or 1
+        # column = 0 to 15
+        # text = characters to write (clipped at the end of the row)
+
+        grid = bytearray(self.shadow)
+        for i, c in enumerate(text[:self.COLUMNS - column]):
+            grid[row * self.COLUMNS + column + i] = ord(c) & 0xFF
+        self.update(grid)
+
+    def clear(self):
+        self.textCommand(0x01)
+        clock.sleep(0.002)
+        self.cursor = 0
+        self.shadow = bytearray(b" " * (self.COLUMNS * self.ROWS))
+
+    def update(self, grid):
+
+        # Sends the difference between grid and the shadow copy.
+        # Per row, the span from the first to the last changed character is
+        # sent as one block write after a single cursor move (skipped when
+        # the cursor is already there).
+
+        for row in range(self.ROWS):
+            start = row * self.COLUMNS
+            end = start + self.COLUMNS
+            changed = [i for i in range(start, end) if grid[i] != self.shadow[i]]
+            if not changed:
+                continue
+            first = changed[0]
+            last = changed[-1]
+            address = row * 0x40 + (first - start)
+            if self.cursor != address:
+                self.textCommand(0x80 | address)
+            self.bus.write_i2c_block_data(self.DISPLAY_TEXT_ADDR, 0x40, list(grid[first:last + 1]))
+            self.transactions += 1
+            self.cursor = address + last - first + 1
+            self.shadow[first:last + 1] = grid[first:last + 1]
+
+
+class ServoBank:
+
+    # Up to 16 servos on a PCA9685 PWM controller on the I2C Grove sockets.
+    # Moves are planned as smooth trajectories for any number of channels
+    # at once and played out by a single tick thread (50 Hz by default).
+    # On every tick all channels whose pulse changed are written in one
+    # auto-increment block transaction, however many servos are moving.
+    # Per servo pulse calibration is kept in a JSON file.
+    # Arguments:
+    # address = PCA9685 I2C address
+    # frequency = servo PWM frequency in Hz
+    # rate = trajectory ticks per second
+    # reference_clock = PCA9685 oscillator frequency in Hz (calibrate with
+    # examples/I2C/Servo_Motors/pca9685_calibration.py)
+    # calibration = path of the calibration file
+    # bus = I2CBus to use, defaults to i2cbus (servo traffic is sent at
+    # control priority)
+
+    MODE1 = 0x00
+    MODE2 = 0x01
+    LED0_ON_L = 0x06
+    PRESCALE = 0xFE
+
+    calibration_path = os.path.expanduser("~/.micropi/servo_calibration.json")
+
+    def __init__(self, address=0x40, frequency=50, rate=50, reference_clock=25000000,
+                 calibration=None, bus=None):
+        self.address = address
+        self.device = (bus or i2cbus).device(address, I2CBus.CONTROL, "pca9685")
+        self.rate = rate
+        self.calibration_path = calibration or self.calibration_path
+        self.calibration = {}
+        self.load_calibration()
+        prescale = int(round(reference_clock / (4096.0 * frequency))) - 1
+        prescale = min(255, max(3, prescale))
+        self.frequency = reference_clock / (4096.0 * (prescale + 1))
+        self.write(bytes([self.MODE1, 0x10]))             # sleep
+        self.write(bytes([self.PRESCALE, prescale]))
+        self.write(bytes([self.MODE2, 0x04]))             # totem pole outputs
+        self.write(bytes([self.MODE1, 0x20]))             # wake, auto-increment
+        time.sleep(0.0005)
+        self.write(bytes([self.MODE1, 0xA0]))             # restart
+        self.angles = [None] * 16
+        self.written = [None] * 16
+        self.moves = {}
+        self.lock = threading.Condition()
+        self.running = True
+        self.ticks = 0
+        self.transactions = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        with self.device:
+            self.device.write(data)
+
+    # ---- Calibration ----
+
+    def load_calibration(self):
+        try:
+            with open(self.calibration_path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+        for channel, entry in stored.get("0x%02x" % self.address, {}).items():
+            self.calibration[int(channel)] = entry
+
+    def calibrate(self, channel, min_pulse=750, max_pulse=2250, actuation_range=180):
+
+        # Sets and saves the pulse range of one servo
+        # Arguments:
+        # channel = 0 to 15
+        # min_pulse, max_pulse = pulse width in microseconds at 0 and at
+        # actuation_range degrees
+        # actuation_range = degrees of travel between the two pulses
+
+        self.calibration[channel] = {"min_pulse": min_pulse, "max_pulse": max_pulse,
+                                     "range": actuation_range}
+        try:
+            with open(self.calibration_path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+        stored["0x%02x" % self.address] = {str(c): e for c, e in self.calibration.items()}
+        os.makedirs(os.path.dirname(self.calibration_path), exist_ok=True)
+        with open(self.calibration_path + ".tmp", "w") as f:
+            json.dump(stored, f, indent=2)
+        os.replace(self.calibration_path + ".tmp", self.calibration_path)
+
+    def counts(self, channel, angle):
+
+        # Converts an angle into PCA9685 OFF counts for the channel
+
+        entry = self.calibration.get(channel, {"min_pulse": 750, "max_pulse": 2250, "range": 180})
+        angle = min(entry["range"], max(0, angle))
+        pulse = entry["min_pulse"] + (entry["max_pulse"] - entry["min_pulse"]) * angle / entry["range"]
+        return int(round(pulse * self.frequency * 4096 / 1000000.0))
+
+    # ---- Motion ----
+
+    def profile(self, name, t):
+
+        # Fraction of the move completed at normalised time t (0 to 1)
+
+        if name == "minjerk":
+            return t * t * t * (10 - 15 * t + 6 * t * t)
+        if name == "ease":
+            return (1 - math.cos(math.pi * t)) / 2
+        return t
+
+    def move(self, targets, duration=None, speed=90, profile="minjerk"):
+
+        # Moves several servos together to new angles.
+        # All servos in targets start and finish together.
+        # Arguments:
+        # targets = dictionary of channel: angle in degrees
+        # duration = seconds for the move; by default worked out from speed
+        # speed = degrees per second of the servo with the furthest to go
+        # profile = "minjerk", "ease" or "linear"
+
+        with self.lock:
+            now = time.monotonic()
+            starts = {}
+            for channel, angle in targets.items():
+                current = self.position(channel, now)
+                starts[channel] = angle if current is None else current
+            if duration is None:
+                travel = max([abs(targets[c] - starts[c]) for c in targets] + [0])
+                duration = travel / float(speed)
+            for channel, angle in targets.items():
+                if duration <= 0:
+                    self.moves.pop(channel, None)
+                    self.angles[channel] = angle
+                else:
+                    self.moves[channel] = (starts[channel], angle, now, now + duration, profile)
+            self.lock.notify_all()
+
+    def set(self, channel, angle):
+
+        # Moves one servo straight to an angle on the next tick
+
+        self.move({channel: angle}, duration=0)
+
+    def position(self, channel, now=None):
+
+        # Returns the commanded angle of a servo (None if never set)
+
+        move = self.moves.get(channel)
+        if move is None:
+            return self.angles[channel]
+        start, end, t0, t1, profile = move
+        now = time.monotonic() if now is None else now
+        t = min(1.0, max(0.0, (now - t0) / (t1 - t0)))
+        return start + (end - start) * self.profile(profile, t)
+
+    def release(self, channel):
+
+        # Stops driving a servo (output held fully off)
+
+        with self.lock:
+            self.moves.pop(channel, None)
+            self.angles[channel] = None
+            self.written[channel] = None
+            self.write(bytes([self.LED0_ON_L + 4 * channel, 0, 0, 0, 0x10]))
+            self.transactions += 1
+
+    def moving(self):
+        return bool(self.moves)
+
+    def wait(self):
+
+        # Blocks until every planned move has finished
+
+        with self.lock:
+            while self.moves:
+                self.lock.wait()
+
+    def tick(self, now):
+
+        # Advances every trajectory to time now and writes the changed
+        # channels in one block starting at the lowest changed channel
+
+        for channel, move in list(self.moves.items()):
+            self.angles[channel] = self.position(channel, now)
+            if now >= move[3]:
+                del self.moves[channel]
+        changed = []
+        for channel, angle in enumerate(self.angles):
+            if angle is None:
+                continue
+            counts = self.counts(channel, angle)
+            if counts != self.written[channel]:
+                self.written[channel] = counts
+                changed.append(channel)
+        if not changed:
+            return
+        first = changed[0]
+        last = changed[-1]
+        data = bytearray(1 + 4 * (last - first + 1))
+        data[0] = self.LED0_ON_L + 4 * first
+        for channel in range(first, last + 1):
+            counts = self.written[channel]
+            index = 1 + 4 * (channel - first)
+            if counts is None:
+                data[index + 3] = 0x10
+            else:
+                data[index + 2] = counts & 0xFF
+                data[index + 3] = counts >> 8
+        self.write(data)
+        self.transactions += 1
+
+    def run(self):
+        realtime.register()
+        period = 1.0 / self.rate
+        deadline = time.monotonic()
+        while self.running:
+            with self.lock:
+                if not self.moves and all(
+                        a is None or self.counts(c, a) == self.written[c]
+                        for c, a in enumerate(self.angles)):
+                    self.lock.notify_all()
+                    self.lock.wait()
+                    deadline = time.monotonic()
+                    continue
+                self.tick(time.monotonic())
+                self.ticks += 1
+                if not self.moves:
+                    self.lock.notify_all()
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+    def close(self):
+
+        # Stops the tick thread and releases every servo
+
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        self.thread.join()
+        self.write(bytes([0xFA, 0, 0, 0, 0x10]))            # ALL_LED full off
+
+
+class ServoMount:
+
+    # Points the ultrasonic sensor with a servo on the ServoBank
+    # Arguments:
+    # bank = ServoBank
+    # channel = servo channel
+    # centre = servo angle that faces straight ahead
+    # speed = degrees per second for moves between readings
+    # settle = seconds to wait after a move before pinging
+
+    def __init__(self, bank, channel=0, centre=90, speed=360, settle=0.03):
+        self.bank = bank
+        self.channel = channel
+        self.centre = centre
+        self.speed = speed
+        self.settle = settle
+
+    def point(self, bearing):
+
+        # Turns the sensor to a bearing (degrees, positive to the left) and
+        # returns the bearing actually reached
+
+        self.bank.move({self.channel: self.centre + bearing}, speed=self.speed)
+        self.bank.wait()
+        clock.sleep(self.settle)
+        return bearing
+
+
+class StepperMount:
+
+    # Points the ultrasonic sensor with the stepper motor.
+    # The sensor must face straight ahead when the mount is created.
+    # Arguments:
+    # stepper = Stepper
+    # cycles_per_rev = forward() steps per turn (each is four phases;
+    # 512 for a 28BYJ-48)
+    # delay = seconds between phases
+    # settle = seconds to wait after a move before pinging
+
+    def __init__(self, stepper, cycles_per_rev=512, delay=0.002, settle=0.03):
+        self.stepper = stepper
+        self.cycles_per_rev = cycles_per_rev
+        self.delay = delay
+        self.settle = settle
+        self.position = 0
+
+    def point(self, bearing):
+        target = int(round(bearing * self.cycles_per_rev / 360.0))
+        if target > self.position:
+            self.position += self.stepper.forward(self.delay, target - self.position)
+        elif target < self.position:
+            self.position -= self.stepper.backward(self.delay, self.position - target)
+        target = self.position
+        clock.sleep(self.settle)
+        return target * 360.0 / self.cycles_per_rev
+
+
+class SonarMap:
+
+    # Occupancy grid of the surroundings built from ultrasonic sweeps.
+    # sweep() turns the sensor through a range of bearings with a mount
+    # and pings at each one; update() fuses a set of readings into a
+    # log-odds grid in one vectorised pass.  Each reading is treated as a
+    # cone: cells inside the cone nearer than the echo are made more likely
+    # free, cells at the echo range more likely occupied.  Readings can come
+    # from recorded sweeps or a simulator as well as from the sensor.
+    # The grid is centred on the start position, x to the right and y up;
+    # poses are (x, y, heading) in cm and degrees, heading 0 along x.
+    # Arguments:
+    # sensor = Sensor("ULTRASONIC", ...), only needed for sweep()
+    # mount = ServoMount or StepperMount, only needed for sweep()
+    # size = width of the mapped square in cm
+    # resolution = cell size in cm
+    # beam = full width of the sensor cone in degrees
+    # max_range = readings at or beyond this (or None) mean no echo
+    # hit, miss = log-odds added to occupied and free cells per reading
+    # limit = log-odds are clamped to +/- limit so the map can change
+
+    def __init__(self, sensor=None, mount=None, size=800, resolution=2.0, beam=15.0,
+                 max_range=400.0, hit=0.85, miss=-0.4, limit=5.0):
+        if np is None:
+            raise ImportError("SonarMap needs numpy")
+        self.sensor = sensor
+        self.mount = mount
+        self.resolution = float(resolution)
+        self.cells = int(math.ceil(size / self.resolution))
+        self.grid = np.zeros((self.cells, self.cells), dtype=np.float32)
+        # cell centre coordinates along each axis
+        self.centres = ((np.arange(self.cells, dtype=np.float32) + 0.5) * self.resolution
+                        - self.cells * self.resolution / 2.0)
+        self.beam = beam
+        self.max_range = max_range
+        # range steps of the polar table; the last is beyond max_range
+        self.steps = int(max_range / self.resolution) + 2
+        self.thickness = max(self.resolution, 3.0)
+        self.hit = hit
+        self.miss = miss
+        self.limit = limit
+        self.pose = (0.0, 0.0, 90.0)
+        self.geometry = None
+        self.reverse = False
+
+    def window(self, x, y):
+
+        # Returns (rows, cols, range, angle, index) for the cells within
+        # reach of a sensor at (x, y).  The angle is in whole degree bins
+        # (0-359 from the x axis) and index points each cell at its entry
+        # in a flattened (angle, range step) polar table.  Kept while the
+        # sensor stays in the same place.
+
+        if self.geometry is not None and self.geometry[0] == (x, y):
+            return self.geometry[1]
+        reach = self.max_range + self.thickness
+        first = self.cells * self.resolution / 2.0
+        c0, c1 = [min(self.cells, max(0, int((v + first) / self.resolution))) for v in (x - reach, x + reach + self.resolution)]
+        r0, r1 = [min(self.cells, max(0, int((v + first) / self.resolution))) for v in (y - reach, y + reach + self.resolution)]
+        dx = self.centres[c0:c1][None, :] - np.float32(x)
+        dy = self.centres[r0:r1][:, None] - np.float32(y)
+        distance = np.hypot(dx, dy)
+        angle = np.floor(np.degrees(np.arctan2(dy, dx))).astype(np.int32) % 360
+        steps = np.minimum(distance / self.resolution, self.steps - 1).astype(np.int32)
+        geometry = (slice(r0, r1), slice(c0, c1), distance, angle, angle * self.steps + steps)
+        self.geometry = ((x, y), geometry)
+        return geometry
+
+    def update(self, bearings, ranges, pose=None):
+
+        # Fuses one set of readings taken from the same pose
+        # Arguments:
+        # bearings = sensor bearings in degrees relative to the heading
+        # (positive to the left)
+        # ranges = distances in cm (None, nan or >= max_range for no echo)
+        # pose = (x, y, heading) of the sensor, default self.pose
+
+        x, y, heading = self.pose if pose is None else pose
+        bearings = np.asarray(bearings, dtype=np.float32)
+        ranges = np.array([np.nan if r is None else r for r in ranges], dtype=np.float32)
+        ranges = np.where(np.isnan(ranges) | (ranges >= self.max_range), np.inf, ranges)
+        rows, cols, distance, angle, index = self.window(x, y)
+        # Work out the update along each whole degree of bearing and range
+        # step first: every (degree, reading) pair whose cone covers it
+        # adds a free run up to the echo and an occupied band at the echo,
+        # written as the ends of the runs and summed along the range.
+        bins = np.arange(360, dtype=np.float32) + 0.5
+        offset = (bins[:, None] - (heading + bearings)[None, :] + 180.0) % 360.0 - 180.0
+        degree, reading = np.nonzero(np.abs(offset) <= self.beam / 2.0)
+        echo = ranges[reading]
+        last = self.steps - 1
+        half = self.thickness / 2.0
+        near = np.clip(np.floor((np.minimum(echo, self.max_range + half) - half) / self.resolution), 0, last).astype(np.intp)
+        far = np.clip(np.floor((echo + half) / self.resolution) + 1, 0, last).astype(np.intp)
+        far = np.where(np.isinf(echo), near, far)
+        runs = np.zeros((360, self.steps + 1), dtype=np.float32)
+        np.add.at(runs, (degree, 0), self.miss)
+        np.add.at(runs, (degree, near), self.hit - self.miss)
+        np.add.at(runs, (degree, far), -self.hit)
+        polar = np.cumsum(runs[:, :self.steps], axis=1)
+        cells = self.grid[rows, cols]
+        cells += np.take(polar, index)
+        np.clip(cells, -self.limit, self.limit, out=cells)
+
+    def sweep(self, start=-90, stop=90, step=5, pose=None, interval=0.06):
+
+        # Turns the sensor from start to stop bearing, pinging every step
+        # degrees, fuses the readings and returns them as an array of
+        # (bearing, range) rows (range nan where there was no echo).
+        # Sweeps alternate direction so the mount does not have to return.
+        # Arguments:
+        # start, stop, step = bearings in degrees
+        # pose = (x, y, heading) of the sensor, default self.pose
+        # interval = minimum seconds between pings
+
+        bearings = np.arange(start, stop + step / 2.0, step)
+        if self.reverse:
+            bearings = bearings[::-1]
+        self.reverse = not self.reverse
+        readings = np.full((len(bearings), 2), np.nan, dtype=np.float32)
+        last = 0.0
+        for i, bearing in enumerate(bearings):
+            if self.mount is not None:
+                bearing = self.mount.point(bearing)
+            wait = last + interval - clock.monotonic()
+            if wait > 0:
+                clock.sleep(wait)
+            last = clock.monotonic()
+            distance = self.sensor.ping()
+            readings[i] = (bearing, np.nan if distance is None else distance)
+        self.update(readings[:, 0], readings[:, 1], pose)
+        return readings
+
+    def probability(self):
+
+        # Returns the grid as occupancy probabilities (0.5 = unknown)
+
+        return 1.0 / (1.0 + np.exp(-self.grid))
+
+    def polar(self, threshold=0.7, pose=None):
+
+        # Returns the distance to the nearest occupied cell in each whole
+        # degree of bearing (index 0 = straight ahead, 90 = left, 270 =
+        # right; inf where nothing is known to be occupied)
+        # Arguments:
+        # threshold = occupancy probability for a cell to count
+        # pose = (x, y, heading) to measure from, default self.pose
+
+        x, y, heading = self.pose if pose is None else pose
+        rows, cols, distance, angle, index = self.window(x, y)
+        occupied = self.grid[rows, cols] > math.log(threshold / (1.0 - threshold))
+        nearest = np.full(360, np.inf, dtype=np.float32)
+        bearing = (angle[occupied] - int(round(heading))) % 360
+        np.minimum.at(nearest, bearing, distance[occupied])
+        return nearest
+
+    def nearest(self, bearing, width=None, threshold=0.7, pose=None):
+
+        # Distance in cm to the nearest known obstacle within width degrees
+        # (default the beam width) around a bearing, or None
+        # Arguments:
+        # bearing = degrees relative to the heading, positive to the left
+
+        width = self.beam if width is None else width
+        nearest = self.polar(threshold, pose)
+        offsets = np.arange(int(math.floor(-width / 2.0)), int(math.ceil(width / 2.0)) + 1)
+        distance = float(nearest[(int(round(bearing)) + offsets) % 360].min())
+        return None if math.isinf(distance) else distance
+
+    def render(self, width=64):
+
+        # Returns the grid as text, "#" occupied, "." free, " " unknown
+
+        step = max(1, -(-self.cells // width))
+        cells = self.grid[::-1][::step, ::step]
+        chars = np.where(cells > 1.0, "#", np.where(cells < -1.0, ".", " "))
+        return "\n".join("".join(row) for row in chars)
+
+
+class Buttons(PinOwner):
+
+    owner = "BUTTONS"
+
+    buttonpins = {"BUTTONS": {"pb1": 26, "pb2": 19}}
+
+    def __init__(self, pins=None):
 
         # GPIO.setmode(GPIO.BCM)
-        self.pb1 = 26
-        self.pb2 = 19
+        pins = pins or self.buttonpins[self.owner]
+        self.pb1 = pins["pb1"]
+        self.pb2 = pins["pb2"]
 
         # Set pin 26 and 19 to be an input pin and
         # set initial value to be pulled down
-        GPIO.setup(self.pb1, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(self.pb2, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        self.claim([self.pb1, self.pb2], GPIO.IN, GPIO.PUD_DOWN)
 
     def setcallback(self, button1, button2):
 
@@ -643,7 +3959,618 @@ class Buttons:
         pass
 
 
+MotionStep = namedtuple("MotionStep", ["offset", "target", "action", "args"])
+StepTiming = namedtuple("StepTiming", ["offset", "target", "action", "error", "duration"])
+
+
+class MotionScript:
+
+    # A timed sequence of device calls for Motor, LinkedMotors, Stepper,
+    # LED, Buzzer or anything else with methods.
+    # Steps name a device and a method; the devices themselves are bound
+    # when the script is run, so one script can drive different robots.
+    # Built in Python:
+    #   script = (MotionScript().do("left", "reverse", 50).do("right", "reverse", 50)
+    #             .wait(1).do("left", "stop").do("right", "stop").until("obstacle"))
+    # or written as text, one step per line ("#" starts a comment):
+    #   left reverse 50
+    #   right reverse 50
+    #   wait 1
+    #   left stop
+    #   @2.5 right stop        step at 2.5 s from the start
+    #   until obstacle         end early when the predicate is true
+    # Times are offsets from the start of the run, so waits do not drift.
+    # Arguments:
+    # text = script text to parse
+
+    def __init__(self, text=None):
+        self.steps = []
+        self.interrupts = []
+        self.cursor = 0.0
+        if text is not None:
+            self.parse(text)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(f.read())
+
+    def do(self, target, action, *args):
+
+        # Adds a call of target.action(*args) at the current time
+        # Arguments:
+        # target = device name, or the device object itself
+
+        self.steps.append(MotionStep(self.cursor, target, action, args))
+        return self
+
+    def wait(self, seconds):
+
+        # Moves the current time on by seconds
+
+        self.cursor += seconds
+        return self
+
+    def at(self, seconds):
+
+        # Sets the current time to seconds from the start
+
+        self.cursor = float(seconds)
+        return self
+
+    def until(self, predicate):
+
+        # Ends the run early, stopping the devices, once predicate() is true
+        # Arguments:
+        # predicate = predicate name, or a function taking no arguments
+
+        self.interrupts.append(predicate)
+        return self
+
+    def parse(self, text):
+        for number, line in enumerate(text.splitlines(), 1):
+            words = shlex.split(line, comments=True)
+            if words and words[0].startswith("@"):
+                self.at(float(words.pop(0)[1:]))
+            if not words:
+                continue
+            if words[0] == "wait" and len(words) == 2:
+                self.wait(float(words[1]))
+            elif words[0] == "until" and len(words) == 2:
+                self.until(words[1])
+            elif len(words) >= 2:
+                self.do(words[0], words[1], *[self.value(word) for word in words[2:]])
+            else:
+                raise ValueError("motion script line %d: %r" % (number, line))
+        return self
+
+    @staticmethod
+    def value(word):
+        for kind in (int, float):
+            try:
+                return kind(word)
+            except ValueError:
+                pass
+        return word
+
+    def compile(self):
+
+        # Returns the steps in time order (steps at the same time keep the
+        # order they were added in)
+
+        return tuple(sorted(self.steps, key=lambda step: step.offset))
+
+    def duration(self):
+        return max([self.cursor] + [step.offset for step in self.steps])
+
+    def text(self):
+
+        # Returns the script in its text form (steps with device objects
+        # rather than names cannot be written out)
+
+        lines = ["until %s" % name for name in self.interrupts if isinstance(name, str)]
+        now = 0.0
+        for step in self.compile():
+            if step.offset > now:
+                lines.append("wait %g" % (step.offset - now))
+                now = step.offset
+            lines.append(" ".join([str(step.target), step.action] +
+                                  [shlex.quote(str(arg)) for arg in step.args]))
+        if self.duration() > now:
+            lines.append("wait %g" % (self.duration() - now))
+        return "\n".join(lines) + "\n"
+
+
+class MotionRun:
+
+    # One run of a MotionScript, as returned by MotionExecutor.run/start.
+    # timings holds a StepTiming per step executed: error is how late the
+    # call started and duration how long it took (seconds).
+    # interrupted names the predicate that ended the run early, "stop" if
+    # stop() was called, "error" if a step or predicate raised (the
+    # exception is kept in error), or None if the run finished.
+
+    def __init__(self, script, devices, predicates):
+        self.script = script
+        self.schedule = script.compile()
+        self.duration = script.duration()
+        self.devices = devices
+        self.predicates = predicates
+        self.timings = []
+        self.interrupted = None
+        self.error = None
+        self.stopping = False
+        self.checked = -float("inf")
+        self.done = threading.Event()
+
+    def stop(self):
+
+        # Ends the run at the next check and stops the devices
+
+        self.stopping = True
+        return self
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self
+
+    def report(self):
+
+        # Summary of the dispatch timing, in milliseconds
+
+        errors = sorted(abs(timing.error) * 1000 for timing in self.timings) or [0.0]
+        durations = [timing.duration * 1000 for timing in self.timings] or [0.0]
+        return {"steps": len(self.timings), "of": len(self.schedule),
+                "mean_error_ms": sum(errors) / len(errors),
+                "p99_error_ms": errors[int(0.99 * (len(errors) - 1))], "max_error_ms": errors[-1],
+                "max_step_ms": max(durations), "interrupted": self.interrupted,
+                "error": None if self.error is None else str(self.error)}
+
+
+class MotionExecutor:
+
+    # Runs MotionScripts against a set of devices with deadline based
+    # dispatch: every step is due at a fixed offset from the start of the
+    # run, so a late or slow step does not push the rest of the script
+    # back.  Between steps the interrupt predicates are checked every poll
+    # seconds.  When a run is interrupted or stopped, every device with a
+    # stop() method is stopped.
+    # Runs given to start() are queued for the executor's one thread; run()
+    # executes on the calling thread instead.
+    # Arguments:
+    # devices = dictionary of name: device used by the scripts
+    # predicates = dictionary of name: function for "until" lines
+    # poll = seconds between predicate checks
+    # spin = seconds before each step that are busy waited rather than
+    # slept, for sub-millisecond timing
+
+    def __init__(self, devices=None, predicates=None, poll=0.005, spin=0.002):
+        self.devices = dict(devices or {})
+        self.predicates = dict(predicates or {})
+        self.poll = poll
+        self.spin = spin
+        self.queue = deque()
+        self.lock = threading.Condition()
+        self.current = None
+        self.thread = None
+        self.running = False
+
+    def prepare(self, script, devices):
+        if isinstance(script, str):
+            script = MotionScript(script)
+        bound = dict(self.devices, **devices)
+        targets = {}
+        for step in script.steps:
+            if not isinstance(step.target, str):
+                targets[step.target] = step.target
+            elif step.target not in bound:
+                raise ValueError("motion script uses unknown device %r" % step.target)
+            else:
+                targets[step.target] = bound[step.target]
+            if not callable(getattr(targets[step.target], step.action, None)):
+                raise ValueError("%r has no method %r" % (step.target, step.action))
+        predicates = []
+        for predicate in script.interrupts:
+            if callable(predicate):
+                predicates.append((getattr(predicate, "__name__", "predicate"), predicate))
+            elif predicate in self.predicates:
+                predicates.append((predicate, self.predicates[predicate]))
+            else:
+                raise ValueError("motion script uses unknown predicate %r" % predicate)
+        return MotionRun(script, targets, predicates)
+
+    def run(self, script, **devices):
+
+        # Runs a script (MotionScript or text) on the calling thread and
+        # returns the finished MotionRun
+        # Arguments:
+        # devices = extra or replacement devices for this run
+
+        run = self.prepare(script, devices)
+        self.execute(run)
+        return run
+
+    def start(self, script, **devices):
+
+        # Queues a script for the executor thread and returns its MotionRun
+
+        run = self.prepare(script, devices)
+        with self.lock:
+            if self.thread is None:
+                self.running = True
+                self.thread = threading.Thread(target=self.worker, daemon=True)
+                self.thread.start()
+            self.queue.append(run)
+            self.lock.notify_all()
+        return run
+
+    def worker(self):
+        realtime.register()
+        while True:
+            with self.lock:
+                while self.running and not self.queue:
+                    self.lock.wait()
+                if not self.running:
+                    return
+                self.current = self.queue.popleft()
+            self.execute(self.current)
+            self.current = None
+
+    def execute(self, run):
+        start = clock.monotonic()
+        try:
+            for step in run.schedule:
+                deadline = start + step.offset
+                if not self.wait_until(run, deadline):
+                    break
+                device = run.devices[step.target]
+                began = clock.monotonic()
+                getattr(device, step.action)(*step.args)
+                ended = clock.monotonic()
+                run.timings.append(StepTiming(step.offset, str(step.target), step.action,
+                                              began - deadline, ended - began))
+            else:
+                self.wait_until(run, start + run.duration)
+        except Exception as error:
+            run.error = error
+            run.interrupted = "error"
+        try:
+            if run.interrupted is not None:
+                self.safe_stop(run)
+        finally:
+            run.done.set()
+
+    def wait_until(self, run, deadline):
+
+        # Sleeps until deadline, checking the predicates every poll seconds
+        # (steps falling due together are not held up by extra checks).
+        # Returns False if the run was interrupted.
+
+        while True:
+            if run.stopping:
+                run.interrupted = "stop"
+                return False
+            if clock.monotonic() - run.checked >= self.poll:
+                run.checked = clock.monotonic()
+                for name, predicate in run.predicates:
+                    if predicate():
+                        run.interrupted = name
+                        return False
+            remaining = deadline - clock.monotonic()
+            if remaining <= 0:
+                return True
+            if remaining > self.spin:
+                clock.sleep(min(remaining - self.spin, self.poll))
+                continue
+            # busy wait the last moment, as sleeps can overshoot by
+            # milliseconds; a clock that only moves when slept on (the
+            # simulator's) is slept on instead
+            last = clock.monotonic()
+            while last < deadline:
+                now = clock.monotonic()
+                if now == last:
+                    clock.sleep(deadline - now)
+                    break
+                last = now
+            return True
+
+    def safe_stop(self, run):
+        for device in run.devices.values():
+            stop = getattr(device, "stop", None)
+            if callable(stop):
+                try:
+                    stop()
+                except Exception as error:
+                    if run.error is None:
+                        run.error = error
+
+    def stop(self):
+
+        # Stops the current run and drops the queued ones
+
+        with self.lock:
+            self.queue.clear()
+            if self.current is not None:
+                self.current.stop()
+
+    def close(self):
+        self.stop()
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+
+DriveEvent = namedtuple("DriveEvent", ["time", "device", "action", "speed"])
+
+
+class DriveRecording:
+
+    # Timestamped drive commands, as made by DriveRecorder.
+    # File layout (little endian):
+    #   "MPDR", uint8 version, uint8 device count, float64 duration
+    #   per device: uint8 name length, UTF-8 name
+    #   uint32 event count
+    #   per event: uint32 microseconds from the start, uint8 device,
+    #   uint8 action (0 stop, 1 forward, 2 reverse), int16 speed * 100
+    # Arguments:
+    # names = device names, indexed by DriveEvent.device
+    # events = DriveEvents in time order
+    # duration = length of the recording in seconds
+
+    MAGIC = b"MPDR"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBBd")
+    COUNT = struct.Struct("<I")
+    EVENT = struct.Struct("<IBBh")
+    ACTIONS = ("stop", "forward", "reverse")
+
+    def __init__(self, names=(), events=(), duration=0.0):
+        self.names = list(names)
+        self.events = list(events)
+        self.duration = duration
+
+    def save(self, path):
+        data = bytearray(self.HEADER.pack(self.MAGIC, self.VERSION, len(self.names), self.duration))
+        for name in self.names:
+            encoded = name.encode("utf-8")
+            data += bytes([len(encoded)]) + encoded
+        data += self.COUNT.pack(len(self.events))
+        offset = len(data)
+        data += bytes(self.EVENT.size * len(self.events))
+        for event in self.events:
+            self.EVENT.pack_into(data, offset, int(round(event.time * 1000000)), event.device,
+                                 self.ACTIONS.index(event.action), int(round(event.speed * 100)))
+            offset += self.EVENT.size
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, count, duration = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("%s is not a version %d drive recording" % (path, cls.VERSION))
+        offset = cls.HEADER.size
+        names = []
+        for i in range(count):
+            length = data[offset]
+            names.append(data[offset + 1:offset + 1 + length].decode("utf-8"))
+            offset += 1 + length
+        events = []
+        for micros, device, action, speed in cls.EVENT.iter_unpack(data[offset + cls.COUNT.size:]):
+            events.append(DriveEvent(micros / 1000000.0, device, cls.ACTIONS[action], speed / 100.0))
+        return cls(names, events, duration)
+
+    def script(self, scale=1.0, start=0.0):
+
+        # Returns the recording as a MotionScript
+        # Arguments:
+        # scale = playback speed (2 plays twice as fast; motor speeds are
+        # unchanged)
+        # start = seconds into the recording to start from; each device is
+        # first put in the state it was in at that point
+
+        script = MotionScript()
+        state = {}
+        for event in self.events:
+            if event.time > start:
+                break
+            state[event.device] = event
+        for device, event in sorted(state.items()):
+            self.add(script.at(0.0), event)
+        for event in self.events:
+            if event.time > start:
+                self.add(script.at((event.time - start) / scale), event)
+        script.at(max(0.0, (self.duration - start) / scale))
+        return script
+
+    def add(self, script, event):
+        if event.action == "stop":
+            script.do(self.names[event.device], "stop")
+        else:
+            script.do(self.names[event.device], event.action, event.speed)
+
+
+class RecordedDrive:
+
+    # Stands in for a Motor or LinkedMotors while teaching: commands are
+    # passed on to the motors and noted by the DriveRecorder
+
+    def __init__(self, recorder, index, motors):
+        self.recorder = recorder
+        self.index = index
+        self.motors = motors
+
+    def forward(self, speed):
+        self.motors.forward(speed)
+        self.recorder.note(self.index, "forward", speed)
+
+    def reverse(self, speed):
+        self.motors.reverse(speed)
+        self.recorder.note(self.index, "reverse", speed)
+
+    def stop(self):
+        self.motors.stop()
+        self.recorder.note(self.index, "stop", 0)
+
+    def close(self):
+        self.motors.close()
+
+
+class DriveRecorder:
+
+    # Records the drive commands given to a robot so the route can be
+    # replayed with DrivePlayer.
+    # Wrap each Motor or LinkedMotors with track() and drive through the
+    # returned objects.  Repeats of the command a device is already
+    # carrying out (such as the IR remote's key repeats) are not stored.
+    #   recorder = DriveRecorder()
+    #   left = recorder.track("left", LinkedMotors(Motor("MOTOR1"), Motor("MOTOR2")))
+    #   recorder.start()
+    #   ... drive ...
+    #   recorder.stop().save("route.mpdr")
+
+    def __init__(self):
+        self.names = []
+        self.drives = []
+        self.events = []
+        self.state = {}
+        self.repeats = 0
+        self.started = None
+        self.duration = 0.0
+        self.lock = threading.Lock()
+
+    def track(self, name, motors):
+        drive = RecordedDrive(self, len(self.names), motors)
+        self.names.append(name)
+        self.drives.append(drive)
+        return drive
+
+    def start(self):
+
+        # Starts a new recording.  The commands the devices were last given
+        # are recorded at time 0.
+
+        with self.lock:
+            self.events = []
+            self.repeats = 0
+            self.started = clock.monotonic()
+            for index, (action, speed) in sorted(self.state.items()):
+                self.events.append(DriveEvent(0.0, index, action, speed))
+        return self
+
+    def note(self, index, action, speed):
+        with self.lock:
+            if self.state.get(index) == (action, speed):
+                self.repeats += 1
+                return
+            self.state[index] = (action, speed)
+            if self.started is not None:
+                self.events.append(DriveEvent(clock.monotonic() - self.started, index, action, speed))
+
+    def stop(self):
+
+        # Ends the recording and returns it as a DriveRecording
+
+        with self.lock:
+            if self.started is not None:
+                self.duration = clock.monotonic() - self.started
+                self.started = None
+            return self.recording()
+
+    def recording(self):
+        return DriveRecording(self.names, self.events, self.duration)
+
+
+class DrivePlayer:
+
+    # Replays a DriveRecording with deadline based timing on a
+    # MotionExecutor, so the commands keep to the recorded times however
+    # long the route.
+    # Arguments:
+    # recording = DriveRecording or the path of a saved one
+    # devices = dictionary of name: Motor/LinkedMotors for the names used
+    # when recording
+    # executor = MotionExecutor to play on (a new one by default)
+
+    def __init__(self, recording, devices, executor=None):
+        if isinstance(recording, str):
+            recording = DriveRecording.load(recording)
+        self.recording = recording
+        self.devices = devices
+        self.executor = executor or MotionExecutor(poll=0.05)
+
+    def play(self, scale=1.0, start=0.0):
+
+        # Replays on the calling thread and returns the finished MotionRun
+        # Arguments:
+        # scale = playback speed, e.g. 0.5 or 2
+        # start = seconds into the recording to start from
+
+        return self.executor.run(self.recording.script(scale, start), **self.devices)
+
+    def start(self, scale=1.0, start=0.0):
+
+        # Replays on the executor thread and returns the MotionRun; stop()
+        # it to end the replay early
+
+        return self.executor.start(self.recording.script(scale, start), **self.devices)
+
+
+def _load(workers):
+
+    # Starts CPU hogs and a garbage churning thread to load the system
+    # for the jitter report; returns a function that stops them
+
+    hogs = [subprocess.Popen([sys.executable, "-c", "while True: pass"]) for i in range(workers)]
+    running = [True]
+
+    def churn():
+        while running[0]:
+            junk = [[i] * 8 for i in range(10000)]
+            for i in range(len(junk) - 1):
+                junk[i].append(junk[i + 1])
+
+    thread = threading.Thread(target=churn, daemon=True)
+    thread.start()
+
+    def stop():
+        running[0] = False
+        for hog in hogs:
+            hog.kill()
+        thread.join()
+
+    return stop
+
+
 # ---------------Main------------
 
 if __name__ == "__main__":
-    print("Welcome to the microPi's library")
+    parser = argparse.ArgumentParser(description="MicroPi library")
+    parser.add_argument("--jitter", action="store_true",
+                        help="report timing thread wake-up latency, normal and real-time")
+    parser.add_argument("--load", type=int, default=os.cpu_count(),
+                        help="CPU hog processes to run during the jitter report")
+    parser.add_argument("--period", type=float, default=0.001, help="loop period in seconds")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--priority", type=int, default=50)
+    parser.add_argument("--cpu", type=int, default=None, help="core for real-time threads")
+    args = parser.parse_args()
+    if not args.jitter:
+        print("Welcome to the microPi's library")
+    else:
+        stop = _load(args.load)
+        try:
+            normal = realtime.jitter(args.period, args.seconds)
+            realtime.enable(args.priority, args.cpu)
+            fast = realtime.jitter(args.period, args.seconds)
+            realtime.disable()
+        finally:
+            stop()
+        print("wake-up latency with %d CPU hogs (us)      p50      p99      max" % args.load)
+        for name, result in (("normal", normal), ("real-time", fast)):
+            print("%-40s %8.1f %8.1f %8.1f" % (name, result["p50"], result["p99"], result["max"]))
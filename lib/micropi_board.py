@@ -0,0 +1,481 @@
+#!/usr/bin/python
+
+# Board profiles for MicroPi V2.1
+# Developed by: SB Components & Hypersmart Ltd
+# Project: MicroPi
+#
+# A board profile is one TOML or JSON file describing the board revision
+# and every device attached to it.  load() validates it, works out the pin
+# of every device up front, and brings the devices up together: each one
+# is built on its own thread as soon as the devices it is made from exist,
+# so the I2C displays and the servo controller initialise while the GPIO
+# pins are being set up.
+#
+#   board = "2.1"
+#
+#   [pins.MOTOR3]            # optional: rewired ports
+#   e = 13
+#
+#   [devices.left]
+#   type = "Motor"
+#   port = "MOTOR1"
+#
+#   [devices.right]
+#   type = "Motor"
+#   port = "MOTOR2"
+#
+#   [devices.drive]
+#   type = "LinkedMotors"
+#   motors = ["left", "right"]
+#
+#   [devices.display]
+#   type = "OLED"
+#   height = 32
+#
+# Then in a script:
+#   import micropi_board
+#   board = micropi_board.load("robot.toml")
+#   board.drive.forward(60)
+#   board.display.print(1, "Hello")
+#
+# Validation finds everything it can before any hardware is touched:
+# unknown device types, ports and options, option values of the wrong type
+# or out of range, references to missing devices, and two devices wired
+# to the same pin.  The validated, resolved profile
+# is cached by file contents in ~/.cache/micropi/profiles, so later
+# launches of the same profile skip parsing and validation.
+#
+#   python3 micropi_board.py robot.toml          # check it, print the pins
+#   python3 micropi_board.py robot.toml --up     # bring it up, print timing
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+
+# bump when the resolved profile layout changes, invalidating the cache
+SCHEMA = 1
+
+cache_dir = os.path.expanduser("~/.cache/micropi/profiles")
+
+# Board revisions, as pin changes from the MotorShield tables in micropi
+# ({port: {wire: pin}}).  Revision 2.1 is the tables as they are.
+REVISIONS = {"2.1": {}}
+
+# The LED strip is driven through SPI on a pin that cannot be changed
+FIXED_PINS = {"LED": {"pin": 10}}
+
+REQUIRED = object()
+
+
+
+def number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# option: (test of a value, what the value has to be), see micropi.make_pwm()
+# for the PWM backends and ServoBank for the PCA9685 limits
+CHECKS = {"pwm": (lambda v: v in (None, "gpio", "hardware", "pigpio", "soft", "auto"),
+                  "one of gpio, hardware, pigpio, soft, auto"),
+          "height": (lambda v: v in (None, 32, 64), "32 or 64"),
+          "boundary": (lambda v: number(v) and v >= 0, "a distance in cm, 0 or more"),
+          "motors": (lambda v: isinstance(v, list) and v and all(isinstance(n, str) for n in v),
+                     "a list of device names"),
+          "address": (lambda v: isinstance(v, int) and not isinstance(v, bool) and 0x03 <= v <= 0x77,
+                      "an I2C address from 0x03 to 0x77"),
+          "frequency": (lambda v: number(v) and 24 <= v <= 1526, "from 24 to 1526 Hz"),
+          "rate": (lambda v: number(v) and 0 < v <= 1000, "above 0 and at most 1000 per second")}
+
+# type: (micropi pin table, bus, options and their defaults)
+TYPES = {"Motor": ("motorpins", "gpio", {"pwm": None}),
+         "Stepper": ("stepperpins", "gpio", {}),
+         "Sensor": ("sensorpins", "gpio", {"boundary": 10}),
+         "Buzzer": ("buzzerpins", "gpio", {"pwm": None}),
+         "IRDetect": ("irpins", "gpio", {}),
+         "Buttons": ("buttonpins", "gpio", {}),
+         "LED": (None, "spi", {}),
+         "LinkedMotors": (None, None, {"motors": REQUIRED}),
+         "OLED": (None, "i2c", {"height": None}),
+         "GroveLCD": (None, "i2c", {}),
+         "ServoBank": (None, "i2c", {"address": 0x40, "frequency": 50, "rate": 50})}
+
+
+class ProfileError(ValueError):
+
+    # Raised for a profile that cannot be loaded, naming the offending entry
+
+    pass
+
+
+def read(path):
+
+    # Parses a profile file, TOML or JSON by extension
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ImportError("TOML profiles need Python 3.11 or tomli, or use a .json profile")
+        try:
+            return tomllib.loads(data.decode())
+        except tomllib.TOMLDecodeError as error:
+            raise ProfileError("%s: %s" % (path, error))
+    try:
+        return json.loads(data)
+    except ValueError as error:
+        raise ProfileError("%s: %s" % (path, error))
+
+
+def pin_tables(revision):
+
+    # Returns {type: {port: {wire: pin}}} for a board revision, from the
+    # tables in micropi with the revision's changes applied
+
+    import micropi
+    changes = REVISIONS[revision]
+    tables = {}
+    for kind, (attribute, bus, options) in TYPES.items():
+        if attribute is None:
+            continue
+        tables[kind] = {port: dict({wire: pin for wire, pin in wires.items() if isinstance(pin, int)},
+                                   **changes.get(port, {}))
+                        for port, wires in getattr(getattr(micropi, kind), attribute).items()}
+    return tables
+
+
+def resolve(profile, source="profile"):
+
+    # Validates a parsed profile and returns it resolved: every device with
+    # its exact pins, options with defaults filled in and the devices it is
+    # built from, plus the board's pin table
+    # Arguments:
+    # profile = dict as parsed from the file
+    # source = name used in error messages
+
+    if not isinstance(profile, dict):
+        raise ProfileError("%s: not a table of sections" % source)
+    for section in ("pins", "devices"):
+        if not isinstance(profile.get(section, {}), dict):
+            raise ProfileError("%s: %s must be a table" % (source, section))
+    unknown = set(profile) - {"board", "pins", "devices"}
+    if unknown:
+        raise ProfileError("%s: unknown section %s" % (source, ", ".join(sorted(unknown))))
+    revision = str(profile.get("board", "2.1"))
+    if revision not in REVISIONS:
+        raise ProfileError("%s: unknown board revision %r (known: %s)"
+                           % (source, revision, ", ".join(REVISIONS)))
+    tables = pin_tables(revision)
+    rewired = profile.get("pins", {})
+    for port, wires in rewired.items():
+        if not isinstance(wires, dict):
+            raise ProfileError("%s: pins.%s must be a table of wire = pin" % (source, port))
+        table = next((table for table in tables.values() if port in table), None)
+        if table is None:
+            raise ProfileError("%s: pins.%s: no such port" % (source, port))
+        for wire, pin in wires.items():
+            if wire not in table[port]:
+                raise ProfileError("%s: pins.%s: %s has no %r pin" % (source, port, port, wire))
+            if not isinstance(pin, int) or isinstance(pin, bool) or not 0 <= pin <= 27:
+                raise ProfileError("%s: pins.%s.%s: %r is not a BCM pin" % (source, port, wire, pin))
+            table[port][wire] = pin
+
+    devices = profile.get("devices", {})
+    if not devices:
+        raise ProfileError("%s: no devices" % source)
+    for name, entry in devices.items():
+        if not isinstance(entry, dict):
+            raise ProfileError("%s: devices.%s must be a table with a type" % (source, name))
+    resolved = []
+    owners = {}
+    for name, entry in devices.items():
+        where = "%s: devices.%s" % (source, name)
+        if not name.isidentifier() or name in ("profile", "devices", "timing") or hasattr(Board, name):
+            raise ProfileError("%s: %r cannot be used as a device name" % (where, name))
+        kind = entry.get("type")
+        if not isinstance(kind, str) or kind not in TYPES:
+            raise ProfileError("%s: unknown type %r (known: %s)" % (where, kind, ", ".join(TYPES)))
+        attribute, bus, defaults = TYPES[kind]
+        unknown = set(entry) - set(defaults) - {"type", "port"}
+        if unknown:
+            raise ProfileError("%s: unknown option %s for %s" % (where, ", ".join(sorted(unknown)), kind))
+        options = {}
+        for option, default in defaults.items():
+            if option not in entry and default is REQUIRED:
+                raise ProfileError("%s: %s needs %r" % (where, kind, option))
+            options[option] = entry.get(option, default)
+            test, wanted = CHECKS[option]
+            if not test(options[option]):
+                raise ProfileError("%s: %s = %r, must be %s" % (where, option, options[option], wanted))
+
+        port = entry.get("port")
+        if port is not None and not isinstance(port, str):
+            raise ProfileError("%s: port = %r, must be a port name" % (where, port))
+        wires = {}
+        if kind in tables:
+            ports = tables[kind]
+            if port is None and len(ports) == 1:
+                port = next(iter(ports))
+            if port not in ports:
+                raise ProfileError("%s: %s port must be one of %s" % (where, kind, ", ".join(sorted(ports))))
+            wires = dict(ports[port])
+        elif port is not None:
+            raise ProfileError("%s: %s has no port" % (where, kind))
+        elif kind in FIXED_PINS:
+            port = kind
+            wires = FIXED_PINS[kind]
+
+        # the pin registry lets the same port be opened twice (two Motor
+        # objects on MOTOR1), but not two ports sharing a pin
+        for wire, pin in wires.items():
+            other = owners.setdefault(pin, (port, name))
+            if other[0] != port:
+                raise ProfileError("%s: BCM %d (%s %s) is already used by %s (%s)"
+                                   % (where, pin, port, wire, other[1], other[0]))
+
+        after = list(options.get("motors") or ())
+        for reference in after:
+            if reference not in devices or reference == name:
+                raise ProfileError("%s: no device %r" % (where, reference))
+            if devices[reference].get("type") not in ("Motor", "LinkedMotors"):
+                raise ProfileError("%s: %r is not a motor" % (where, reference))
+        resolved.append({"name": name, "type": kind, "bus": bus, "port": port,
+                         "pins": wires if kind in tables else None, "options": options, "after": after})
+
+    # a device can only be built after the ones it is made from
+    names = [device["name"] for device in resolved]
+    for device in resolved:
+        seen = set()
+        pending = list(device["after"])
+        while pending:
+            reference = pending.pop()
+            if reference == device["name"]:
+                raise ProfileError("%s: devices.%s is made from itself" % (source, device["name"]))
+            if reference not in seen:
+                seen.add(reference)
+                pending.extend(resolved[names.index(reference)]["after"])
+    return {"schema": SCHEMA, "board": revision, "source": source, "devices": resolved,
+            "pins": {str(pin): "%s %s" % owner for pin, owner in sorted(owners.items())}}
+
+
+def cache_path(data):
+
+    # The cache file for a profile: keyed by its contents, by the micropi
+    # module the pin tables come from and by this module, whose types and
+    # validation rules decide what a resolved profile holds
+
+    key = hashlib.sha1(data)
+    key.update(str(SCHEMA).encode())
+    spec = importlib.util.find_spec("micropi")
+    for origin in (spec.origin if spec is not None else None, __file__):
+        if origin:
+            stat = os.stat(origin)
+            key.update(("%d %d" % (stat.st_mtime_ns, stat.st_size)).encode())
+    return os.path.join(cache_dir, key.hexdigest() + ".json")
+
+
+def prepare(path, cache=True):
+
+    # Returns the resolved profile of a file, from the cache when the file
+    # has not changed since it was last resolved
+
+    with open(path, "rb") as f:
+        data = f.read()
+    cached = cache_path(data)
+    if cache:
+        try:
+            with open(cached) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    resolved = resolve(read(path), os.path.basename(path))
+    if cache:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cached + ".tmp", "w") as f:
+                json.dump(resolved, f)
+            os.replace(cached + ".tmp", cached)
+        except OSError:
+            pass
+    return resolved
+
+
+def build(micropi, device, devices):
+
+    # Creates one device of a resolved profile
+
+    kind = device["type"]
+    options = device["options"]
+    pins = device["pins"]
+    if kind == "Motor":
+        return micropi.Motor(device["port"], options["pwm"], pins=pins)
+    if kind == "Stepper":
+        return micropi.Stepper(device["port"], pins=pins)
+    if kind == "Sensor":
+        return micropi.Sensor(device["port"], options["boundary"], pins=pins)
+    if kind == "Buzzer":
+        return micropi.Buzzer(options["pwm"], pins=pins)
+    if kind in ("IRDetect", "Buttons"):
+        return getattr(micropi, kind)(pins=pins)
+    if kind == "LinkedMotors":
+        return micropi.LinkedMotors(*[devices[name] for name in options["motors"]])
+    if kind == "OLED":
+        oled = micropi.OLED()
+        if options["height"]:
+            # bring the panel up now rather than on the first print
+            oled.display(options["height"])
+        return oled
+    if kind == "ServoBank":
+        return micropi.ServoBank(options["address"], options["frequency"], options["rate"])
+    return getattr(micropi, kind)()
+
+
+class Board:
+
+    # The devices of a profile, brought up and ready to use.
+    # Devices are attributes (board.left) and items (board["left"]).
+    # close() closes them in reverse order.
+    # Arguments:
+    # profile = resolved profile from prepare() or resolve()
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.devices = {}
+        self.timing = {}
+
+    def up(self):
+
+        # Builds every device, each on its own thread once the devices it
+        # is made from are ready.  If any fails, the ones already built are
+        # closed again and ProfileError is raised.
+
+        import micropi
+        specs = self.profile["devices"]
+        done = {device["name"]: threading.Event() for device in specs}
+        failures = {}
+        start = time.monotonic()
+
+        def bring_up(device):
+            name = device["name"]
+            try:
+                for reference in device["after"]:
+                    done[reference].wait()
+                if any(reference not in self.devices for reference in device["after"]):
+                    self.timing[name] = {"skipped": True}
+                    return
+                begun = time.monotonic() - start
+                self.devices[name] = build(micropi, device, self.devices)
+                self.timing[name] = {"start": begun, "end": time.monotonic() - start}
+            except Exception as error:
+                failures[name] = error
+                self.timing[name] = {"error": str(error)}
+            finally:
+                done[name].set()
+
+        threads = [threading.Thread(target=bring_up, args=(device,)) for device in specs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.timing["total"] = time.monotonic() - start
+        if failures:
+            self.close()
+            name, error = next(iter(failures.items()))
+            raise ProfileError("%s: devices.%s (%s) failed: %s"
+                               % (self.profile["source"], name, self.type(name), error)) from error
+        return self
+
+    def type(self, name):
+        return next(device["type"] for device in self.profile["devices"] if device["name"] == name)
+
+    def report(self):
+
+        # Returns the bring-up timing as a table for printing
+
+        lines = []
+        for device in self.profile["devices"]:
+            entry = self.timing.get(device["name"], {})
+            if "end" in entry:
+                state = "%6.1f - %6.1f ms" % (entry["start"] * 1000, entry["end"] * 1000)
+            else:
+                state = "skipped" if entry.get("skipped") else "failed: %s" % entry.get("error")
+            lines.append("%-12s %-12s %-4s %s" % (device["name"], device["type"], device["bus"] or "", state))
+        if "total" in self.timing:
+            lines.append("up after %.1f ms" % (self.timing["total"] * 1000))
+        return "\n".join(lines)
+
+    def close(self):
+        for device in reversed(self.profile["devices"]):
+            instance = self.devices.pop(device["name"], None)
+            if instance is None:
+                continue
+            try:
+                if hasattr(instance, "close"):
+                    instance.close()
+                elif hasattr(instance, "stop"):
+                    instance.stop()
+            except Exception as error:
+                print("closing %s failed: %s" % (device["name"], error), file=sys.stderr)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["devices"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, name):
+        return self.devices[name]
+
+    def __contains__(self, name):
+        return name in self.devices
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load(path, cache=True):
+
+    # Validates a profile file and brings its devices up
+    # Arguments:
+    # path = .toml or .json board profile
+    # cache = use (and fill) the resolved profile cache
+
+    return Board(prepare(path, cache)).up()
+
+
+# ---------------Main------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a MicroPi board profile and bring it up")
+    parser.add_argument("profile", help=".toml or .json board profile")
+    parser.add_argument("--up", action="store_true", help="bring the devices up and show the timing")
+    parser.add_argument("--no-cache", action="store_true", help="resolve the profile again")
+    parser.add_argument("--sim", action="store_true", help="use the simulated hardware backend")
+    args = parser.parse_args()
+    if args.sim:
+        import micropi_sim
+        micropi_sim.install()
+    start = time.perf_counter()
+    try:
+        resolved = prepare(args.profile, not args.no_cache)
+    except ProfileError as error:
+        sys.exit(str(error))
+    print("board %s, %d devices, resolved in %.2f ms"
+          % (resolved["board"], len(resolved["devices"]), (time.perf_counter() - start) * 1000))
+    for pin, owner in sorted(resolved["pins"].items(), key=lambda item: int(item[0])):
+        print("BCM %2s  %s" % (pin, owner))
+    if args.up:
+        with Board(resolved) as board:
+            board.up()
+            print(board.report())
@@ -0,0 +1,447 @@
+#!/usr/bin/python
+
+# Live web dashboard for MicroPi V2.1
+# Developed by: SB Components & Hypersmart Ltd
+# Project: MicroPi
+#
+# A small asyncio HTTP server, run on its own thread next to the robot's
+# control loop, serving one dashboard page and streaming the state of the
+# board to it with Server-Sent Events.
+#
+#   from micropi_dashboard import Dashboard
+#   dash = Dashboard().start()               # http://localhost:8080/
+#   dash.add("left", left_motors)
+#   dash.add("distance", sensor)
+#   timer = dash.loop("control")
+#   while True:
+#       timer.tick()
+#       ...
+#       dash.event("ir", key)
+#
+# Once per tick (10 a second by default) the values are sampled into one
+# shared snapshot.  Only the values that changed since the last tick are
+# encoded, once, and the same message is queued to every client.  A client
+# that falls behind is sent a full snapshot instead of the deltas it
+# missed.  The control loop itself only ever appends to deques.
+#
+# Endpoints:
+#   /            the dashboard page
+#   /events      the SSE stream: the first message carries every value
+#                ({"full": true, "v": {...}}), later ones only the changes
+#                and events ({"t": time, "v": {...}, "e": [[time, kind, value]]})
+#   /snapshot    the current values as JSON
+
+import argparse
+import asyncio
+import json
+import math
+import sys
+import threading
+import time
+from collections import deque
+
+PORT = 8080
+
+
+class LoopTimer:
+
+    # Measures a control loop from the loop itself.
+    # tick() at the top of every iteration counts the tick and appends the
+    # time since the previous one; the dashboard reads the count and drains
+    # the periods once per tick and reports the rate, mean, worst and
+    # overruns of the expected period.  The deque only keeps the latest
+    # periods, so the rate and mean come from the running count and total,
+    # which see every tick however fast the loop runs.
+    # Arguments:
+    # period = the loop's intended period in seconds (None if free running)
+
+    def __init__(self, period=None):
+        self.period = period
+        self.limit = period * 1.5 if period else None
+        self.periods = deque(maxlen=4096)
+        self.last = None
+        self.ticks = 0
+        self.total = 0.0
+        self.overruns = 0
+        self.seen = (0, 0.0)
+        self.summary = {}
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.last is not None:
+            period = now - self.last
+            self.periods.append(period)
+            self.ticks += 1
+            self.total += period
+            if self.limit is not None and period > self.limit:
+                self.overruns += 1
+        self.last = now
+
+    def sample(self, elapsed):
+
+        # Folds the ticks since the last sample into the summary
+
+        ticks, total = self.ticks, self.total
+        count = ticks - self.seen[0]
+        spent = total - self.seen[1]
+        self.seen = (ticks, total)
+        periods = []
+        try:
+            while True:
+                periods.append(self.periods.popleft())
+        except IndexError:
+            pass
+        if not count or not periods:
+            if self.summary:
+                self.summary["hz"] = 0.0
+            return self.summary
+        self.summary = {"hz": round(count / elapsed, 1),
+                        "mean_ms": round(1000.0 * spent / count, 3),
+                        "max_ms": round(1000.0 * max(periods), 3),
+                        "overruns": self.overruns}
+        return self.summary
+
+
+class Client:
+
+    # One SSE connection.  Messages are shared bytes objects; when the
+    # queue is full the client is resynchronised with a full snapshot.
+
+    def __init__(self, writer, depth):
+        self.writer = writer
+        self.queue = asyncio.Queue(depth)
+        self.resync = False
+
+    def offer(self, message):
+        if self.resync:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.resync = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class Dashboard:
+
+    # The dashboard server.
+    # Arguments:
+    # host = address to listen on: "127.0.0.1" for this Pi only, "0.0.0.0"
+    # for the local network
+    # port = TCP port
+    # rate = snapshots per second
+    # depth = messages queued per client before it is resynchronised
+
+    def __init__(self, host="127.0.0.1", port=PORT, rate=10, depth=32):
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.depth = depth
+        self.sources = {}
+        self.timers = {}
+        self.events = deque(maxlen=256)
+        self.values = {}
+        self.clients = set()
+        self.tasks = set()
+        self.sent = 0
+        self.ticks = 0
+        self.errors = 0
+        self.error = None
+        self.event_loop = None
+        self.server = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    # ---- What to show ----
+
+    def add(self, name, source):
+
+        # Shows a value on the dashboard, read once per tick on the server
+        # thread, so it must be quick to read.
+        # Arguments:
+        # name = label on the dashboard
+        # source = a function returning the value, or a device:
+        # Motor / LinkedMotors (duty, - for reverse), Sensor (last distance in
+        # cm for the ultrasonic sensor, the line seen for IR), Buttons (the
+        # button input levels)
+
+        if callable(source):
+            self.sources[name] = source
+        elif hasattr(source, "duty"):
+            self.sources[name] = lambda: source.duty
+        elif hasattr(source, "motor"):
+            self.sources[name] = lambda: source.motor[0].duty
+        elif hasattr(source, "lastRead") and "trigger" in source.config:
+            self.sources[name] = lambda: round(source.lastRead, 1)
+        elif hasattr(source, "lastRead"):
+            import micropi
+            self.sources[name] = lambda: micropi.GPIO.input(source.config["echo"]) == 1
+        elif hasattr(source, "isPB1Pressed"):
+            import micropi
+            self.sources[name] = lambda: [micropi.GPIO.input(source.pb1), micropi.GPIO.input(source.pb2)]
+        else:
+            raise TypeError("don't know how to show %r on the dashboard" % (source,))
+        return self
+
+    def loop(self, name, period=None):
+
+        # Returns a LoopTimer whose rate and timing are shown as name
+
+        timer = self.timers[name] = LoopTimer(period)
+        return timer
+
+    def event(self, kind, value=None):
+
+        # Records an event such as a button press or IR key.  Safe to call
+        # from any thread, including GPIO callbacks.
+
+        self.events.append([round(time.time(), 3), kind, value])
+
+    # ---- Server ----
+
+    def start(self):
+
+        # Starts the server on a background thread
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.event_loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with self.server:
+            await self.tick_loop()
+
+    def stop(self):
+
+        # Stops the server, ending every open connection first so their
+        # handlers finish cleanly instead of being torn down with the loop
+
+        if self.event_loop is not None and self.event_loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self.shutdown(), self.event_loop)
+            future.result(5)
+
+    async def shutdown(self):
+        self.server.close()
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def tick_loop(self):
+        period = 1.0 / self.rate
+        deadline = self.event_loop.time()
+        last = time.perf_counter()
+        keepalive = 0.0
+        while self.server.is_serving():
+            now = time.perf_counter()
+            try:
+                message = self.sample(now - last)
+            except Exception as error:
+                self.failed(error)
+                message = None
+            last = now
+            if message is None:
+                keepalive += period
+                if keepalive >= 15.0:
+                    message = b": keepalive\n\n"
+            if message is not None:
+                keepalive = 0.0
+                for client in list(self.clients):
+                    client.offer(message)
+                    self.sent += 1
+            deadline += period
+            await asyncio.sleep(max(0.0, deadline - self.event_loop.time()))
+
+    def failed(self, error):
+
+        # Counts a tick that could not be sampled, printing the error when
+        # it differs from the last one so a broken source doesn't flood
+        # the console
+
+        self.errors += 1
+        text = "%s: %s" % (type(error).__name__, error)
+        if text != self.error:
+            print("dashboard tick failed: %s" % text, file=sys.stderr)
+        self.error = text
+
+    def read(self):
+        values = {}
+        # sources and timers may be added from other threads while serving
+        for name, source in list(self.sources.items()):
+            try:
+                value = source()
+            except Exception as error:
+                value = "error: %s" % error
+            if isinstance(value, float) and not math.isfinite(value):
+                value = None
+            values[name] = value
+        return values
+
+    def sample(self, elapsed):
+
+        # Takes this tick's snapshot and returns the encoded delta message
+        # (None if nothing changed)
+
+        self.ticks += 1
+        current = self.read()
+        for name, timer in list(self.timers.items()):
+            current[name] = timer.sample(elapsed)
+        changed = {name: value for name, value in current.items() if self.values.get(name, self) != value}
+        self.values = current
+        events = []
+        try:
+            while True:
+                events.append(self.events.popleft())
+        except IndexError:
+            pass
+        if not changed and not events:
+            return None
+        payload = {"t": round(time.time(), 3), "v": changed}
+        if events:
+            payload["e"] = events
+        return self.encode(payload)
+
+    def encode(self, payload):
+
+        # Values JSON has no type for (bytes, numpy scalars) are sent as text
+
+        return b"data: " + json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8") + b"\n\n"
+
+    def full(self):
+        return self.encode({"full": True, "t": round(time.time(), 3), "v": self.values})
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            await self.serve_request(reader, writer)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.tasks.discard(task)
+            writer.close()
+
+    async def serve_request(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return
+        words = request.split(b" ", 2)
+        path = words[1].decode("latin-1") if len(words) > 1 else "/"
+        try:
+            if words[0] != b"GET":
+                await self.respond(writer, "405 Method Not Allowed", "text/plain", b"GET only\n")
+            elif path == "/":
+                await self.respond(writer, "200 OK", "text/html; charset=utf-8", PAGE)
+            elif path == "/snapshot":
+                body = json.dumps({"t": time.time(), "v": self.values}, default=str).encode("utf-8")
+                await self.respond(writer, "200 OK", "application/json", body)
+            elif path == "/events":
+                await self.stream(writer)
+            else:
+                await self.respond(writer, "404 Not Found", "text/plain", b"not found\n")
+        except ConnectionError:
+            pass
+
+    async def respond(self, writer, status, kind, body):
+        writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\n"
+                      "Connection: close\r\n\r\n" % (status, kind, len(body))).encode("latin-1") + body)
+        await writer.drain()
+
+    async def stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\nretry: 2000\n\n")
+        client = Client(writer, self.depth)
+        writer.write(self.full())
+        self.clients.add(client)
+        try:
+            while True:
+                message = await client.queue.get()
+                if message is None:
+                    client.resync = False
+                    message = self.full()
+                writer.write(message)
+                await writer.drain()
+        finally:
+            self.clients.discard(client)
+
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>MicroPi</title>
+<style>
+body { font-family: sans-serif; margin: 1em; background: #111; color: #eee; }
+table { border-collapse: collapse; }
+td { padding: 2px 12px; border-bottom: 1px solid #333; font-family: monospace; }
+td.changed { color: #6f6; }
+#events { font-family: monospace; white-space: pre; height: 14em; overflow-y: auto; }
+#status { color: #888; }
+</style></head>
+<body>
+<h2>MicroPi <span id="status">connecting</span></h2>
+<table id="values"></table>
+<h3>Events</h3>
+<div id="events"></div>
+<script>
+var values = {}, cells = {};
+function show(name, value) {
+  var cell = cells[name];
+  if (!cell) {
+    var row = document.getElementById("values").insertRow();
+    row.insertCell().textContent = name;
+    cell = cells[name] = row.insertCell();
+  }
+  cell.textContent = typeof value === "object" && value !== null ? JSON.stringify(value) : value;
+  cell.className = "changed";
+  setTimeout(function () { cell.className = ""; }, 300);
+}
+var source = new EventSource("/events");
+source.onopen = function () { document.getElementById("status").textContent = "live"; };
+source.onerror = function () { document.getElementById("status").textContent = "reconnecting"; };
+source.onmessage = function (message) {
+  var data = JSON.parse(message.data);
+  for (var name in data.v) { values[name] = data.v[name]; show(name, data.v[name]); }
+  var log = document.getElementById("events");
+  (data.e || []).forEach(function (e) {
+    log.textContent = new Date(e[0] * 1000).toLocaleTimeString() + "  " + e[1] + "  " +
+                      (e[2] === null ? "" : e[2]) + "\\n" + log.textContent.slice(0, 4000);
+  });
+};
+</script>
+</body></html>
+"""
+
+
+# ---------------Main------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MicroPi live dashboard of the sensors and motors")
+    parser.add_argument("--lan", action="store_true", help="listen on the local network, not just this Pi")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--rate", type=float, default=10, help="updates per second")
+    parser.add_argument("--sim", action="store_true", help="use the simulated hardware backend")
+    args = parser.parse_args()
+    if args.sim:
+        import micropi_sim
+        micropi_sim.install()
+    from micropi import Buttons, Sensor
+    dash = Dashboard("0.0.0.0" if args.lan else "127.0.0.1", args.port, args.rate)
+    sonar = Sensor("ULTRASONIC", 10)
+    dash.add("distance", sonar).add("IR1", Sensor("IR1", 0)).add("IR2", Sensor("IR2", 0))
+    dash.add("buttons", Buttons())
+    dash.start()
+    print("Dashboard on http://%s:%d/" % (dash.host, dash.port))
+    timer = dash.loop("sonar", 0.1)
+    while True:
+        timer.tick()
+        sonar.lastRead = sonar.ping() or sonar.lastRead
+        time.sleep(0.1)
@@ -0,0 +1,350 @@
+#!/usr/bin/python
+
+# libgpiod GPIO backend for MicroPi V2.1
+# Developed by: SB Components & Hypersmart Ltd
+# Project: MicroPi
+#
+# Drop-in replacement for the parts of RPi.GPIO used by micropi, built on
+# the Linux GPIO character device (/dev/gpiochipN) through the libgpiod v2
+# Python bindings.  Select it before importing micropi:
+#
+#   MICROPI_GPIO=gpiod python3 myrobot.py
+#
+# Differences from RPi.GPIO:
+# - Every setup() call requests its channels as one group, and output()
+#   with a list of channels sets all the lines of a group with a single
+#   ioctl, so a stepper phase or motor direction change is atomic.
+# - Edges are detected by the kernel and carry its timestamp (the hardware
+#   timestamp engine where the SoC has one), so pulse widths are measured
+#   exactly however late Python gets round to reading them.  edges() and
+#   clear_edges() expose them to micropi's Sensor and IRDetect.
+# - PWM() returns micropi's multiplexed SoftPWM.
+#
+# The chip defaults to /dev/gpiochip0 (BCM numbers are line offsets) and
+# can be changed with MICROPI_GPIOCHIP.  For testing, point it at a
+# gpio-sim chip or install the mock gpiod module from micropi_sim.
+
+import os
+import threading
+import time
+from collections import deque
+
+import gpiod
+from gpiod.line import Bias, Clock, Direction, Edge, Value
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+RPI_REVISION = 3
+VERSION = "gpiod"
+
+CHIP = os.environ.get("MICROPI_GPIOCHIP", "/dev/gpiochip0")
+CONSUMER = "micropi"
+
+_bias = {None: Bias.AS_IS, PUD_OFF: Bias.DISABLED, PUD_DOWN: Bias.PULL_DOWN, PUD_UP: Bias.PULL_UP}
+
+
+class LineGroup:
+
+    # One line request: the channels passed to a single setup() call.
+    # Keeps the settings of every line, since a reconfigure replaces the
+    # configuration of the whole request, and runs a thread reading the
+    # kernel's edge events once any line in the group has edge detection.
+
+    def __init__(self, chip, channels, settings):
+        self.settings = dict((channel, settings) for channel in channels)
+        self.request = gpiod.request_lines(chip, consumer=CONSUMER, config=dict(self.settings))
+        self.thread = None
+        self.active = True
+
+    def reconfigure(self, channel, **changes):
+        settings = self.settings[channel]
+        self.settings[channel] = gpiod.LineSettings(**dict(vars(settings), **changes))
+        try:
+            self.request.reconfigure_lines(dict(self.settings))
+        except OSError:
+            if changes.get("event_clock") != Clock.HTE:
+                raise
+            # no hardware timestamp engine on this SoC
+            changes["event_clock"] = Clock.MONOTONIC
+            self.settings[channel] = gpiod.LineSettings(**dict(vars(settings), **changes))
+            self.request.reconfigure_lines(dict(self.settings))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while self.active:
+            try:
+                if not self.request.wait_edge_events(0.2):
+                    continue
+                events = self.request.read_edge_events()
+            except (OSError, gpiod.RequestReleasedError):
+                return
+            for event in events:
+                _deliver(event.line_offset, event.timestamp_ns,
+                         HIGH if event.event_type == gpiod.EdgeEvent.Type.RISING_EDGE else LOW)
+
+    def release(self):
+        self.active = False
+        self.request.release()
+
+
+class Channel:
+
+    # Per channel edge state: queued kernel events and event_detect settings
+
+    def __init__(self):
+        self.edges = deque(maxlen=256)
+        self.edge = None
+        self.callbacks = []
+        self.detected = False
+        self.bounce = 0
+        self.last = 0
+
+
+_groups = {}
+_channels = {}
+_lock = threading.RLock()
+_edge_ready = threading.Condition(_lock)
+_mode = None
+
+
+def _list(channel):
+    if isinstance(channel, (list, tuple)):
+        return list(channel)
+    return [channel]
+
+
+def _state(channel):
+    state = _channels.get(channel)
+    if state is None:
+        state = _channels[channel] = Channel()
+    return state
+
+
+def _deliver(channel, stamp, level):
+    with _edge_ready:
+        state = _state(channel)
+        state.edges.append((stamp, level))
+        _edge_ready.notify_all()
+        edge = state.edge
+        if edge is None or (edge == RISING and level == LOW) or (edge == FALLING and level == HIGH):
+            return
+        if state.bounce and stamp - state.last < state.bounce:
+            return
+        state.last = stamp
+        state.detected = True
+        callbacks = list(state.callbacks)
+    for callback in callbacks:
+        callback(channel)
+
+
+def _watch(channel):
+
+    # Turns on kernel edge detection (both edges) for an input channel
+
+    group = _groups.get(channel)
+    if group is None:
+        raise RuntimeError("channel %d has not been set up" % channel)
+    if group.settings[channel].edge_detection != Edge.BOTH:
+        group.reconfigure(channel, edge_detection=Edge.BOTH, event_clock=Clock.HTE)
+    group.start()
+
+
+# ---- RPi.GPIO API ----
+
+def setmode(mode):
+    global _mode
+    _mode = mode
+
+
+def getmode():
+    return _mode
+
+
+def setwarnings(state):
+    pass
+
+
+def setup(channel, direction, pull_up_down=None, initial=None):
+
+    # Requests the channels as one group.  Channels that already belong to
+    # a group are reconfigured in place instead.
+
+    with _lock:
+        if direction == OUT:
+            settings = gpiod.LineSettings(direction=Direction.OUTPUT,
+                                          output_value=Value.ACTIVE if initial else Value.INACTIVE)
+        else:
+            settings = gpiod.LineSettings(direction=Direction.INPUT, bias=_bias[pull_up_down])
+        fresh = []
+        for pin in _list(channel):
+            group = _groups.get(pin)
+            if group is None:
+                fresh.append(pin)
+            elif group.settings[pin] != settings:
+                group.settings[pin] = settings
+                group.request.reconfigure_lines(dict(group.settings))
+        if fresh:
+            group = LineGroup(CHIP, fresh, settings)
+            for pin in fresh:
+                _groups[pin] = group
+
+
+def output(channel, value):
+
+    # Sets one or more outputs, with one ioctl per line group
+
+    pins = _list(channel)
+    if isinstance(value, (list, tuple)):
+        values = value
+    else:
+        values = [value] * len(pins)
+    batches = {}
+    for pin, level in zip(pins, values):
+        group = _groups[pin]
+        batches.setdefault(group, {})[pin] = Value.ACTIVE if level else Value.INACTIVE
+    for group, batch in batches.items():
+        group.request.set_values(batch)
+
+
+def input(channel):
+    return HIGH if _groups[channel].request.get_value(channel) == Value.ACTIVE else LOW
+
+
+def PWM(channel, frequency):
+    import micropi
+    return micropi.SoftPWM(channel, frequency)
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    with _lock:
+        _watch(channel)
+        state = _state(channel)
+        state.edge = edge
+        state.callbacks = [callback] if callback is not None else []
+        state.bounce = (bouncetime or 0) * 1000000
+        state.detected = False
+
+
+def add_event_callback(channel, callback):
+    with _lock:
+        _state(channel).callbacks.append(callback)
+
+
+def remove_event_detect(channel):
+    with _lock:
+        state = _state(channel)
+        state.edge = None
+        state.callbacks = []
+
+
+def event_detected(channel):
+    with _lock:
+        state = _state(channel)
+        detected, state.detected = state.detected, False
+        return detected
+
+
+def wait_for_edge(channel, edge, bouncetime=None, timeout=None):
+
+    # Blocks until the given edge and returns the channel, or None on timeout
+    # (timeout in milliseconds as for RPi.GPIO)
+
+    clear_edges(channel)
+    deadline = None if timeout is None else time.monotonic() + timeout / 1000.0
+    while True:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return None
+        found = edges(channel, 1, remaining)
+        if found and (edge == BOTH or found[0][1] == (HIGH if edge == RISING else LOW)):
+            return channel
+
+
+def cleanup(channel=None):
+
+    # Returns channels to the kernel; a group is released once all of its
+    # channels have been cleaned up
+
+    with _lock:
+        pins = list(_groups) if channel is None else _list(channel)
+        for pin in pins:
+            group = _groups.pop(pin, None)
+            _channels.pop(pin, None)
+            if group is not None and group not in _groups.values():
+                group.release()
+
+
+# ---- Kernel edge events ----
+
+def clear_edges(channel):
+
+    # Discards queued edges, e.g. just before triggering a measurement
+
+    with _lock:
+        _watch(channel)
+        _state(channel).edges.clear()
+
+
+def edges(channel, count, timeout, gap=None):
+
+    # Returns up to count queued edges as (timestamp_ns, level), oldest
+    # first, waiting up to timeout seconds for the first one and then up to
+    # gap seconds (default timeout) for each of the rest.
+    # Timestamps come from the kernel's event clock.
+
+    with _edge_ready:
+        _watch(channel)
+        queue = _state(channel).edges
+        found = []
+        wait = timeout
+        while len(found) < count:
+            if not queue:
+                if wait is not None and wait <= 0:
+                    break
+                if not _edge_ready.wait_for(lambda: queue, wait):
+                    break
+            found.append(queue.popleft())
+            wait = timeout if gap is None else gap
+        return found
+
+
+def event_clock(channel):
+
+    # Returns the gpiod Clock the kernel stamps the channel's edges with:
+    # Clock.HTE where the SoC has a hardware timestamp engine, otherwise
+    # Clock.MONOTONIC.  None before edge detection has been turned on.
+
+    with _lock:
+        group = _groups.get(channel)
+        if group is None or group.settings[channel].edge_detection == Edge.NONE:
+            return None
+        return group.settings[channel].event_clock
+
+
+def timestamp_ns():
+
+    # Current CLOCK_MONOTONIC time in ns.  This is the clock of the edge
+    # timestamps unless event_clock() reports Clock.HTE for the channel;
+    # hardware timestamps can only be compared with each other.
+
+    return time.monotonic_ns()
+
+
+# ---------------Main------------
+
+if __name__ == "__main__":
+    print("libgpiod backend for the microPi's library on", CHIP)
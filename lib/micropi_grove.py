@@ -0,0 +1,594 @@
+#!/usr/bin/python
+
+# Grove I2C sensors for MicroPi V2.1
+# Developed by: SB Components & Hypersmart Ltd
+# Project: MicroPi
+#
+# Drivers for common Grove I2C sensors, discovery of the ones plugged in,
+# and a poller reading them all in the background.
+#
+#   from micropi_grove import GrovePoller
+#   poller = GrovePoller()
+#   print(poller.discover())            # {0x77: "bmp280", 0x3e: None, ...}
+#   poller.start()
+#   while True:
+#       reading = poller.latest("bmp280")
+#       if reading:
+#           print(reading.time, reading.values["pressure"])
+#
+# Each driver lists the registers it needs; fields that are next to each
+# other are merged into block reads, so e.g. all fourteen MPU-6050 data
+# bytes arrive in one transaction instead of seven.  The poller runs on
+# one thread and keeps every sensor on its own schedule.  The reads of all
+# sensors due at the same moment are queued on i2cbus together, at sensor
+# priority, so they run back to back on the bus thread and still give way
+# to motor and servo traffic.  Each result goes into a shared table with
+# the time it was taken.
+#
+# New drivers subclass GroveSensor and register with @driver:
+#
+#   @driver
+#   class MySensor(GroveSensor):
+#       name = "mysensor"
+#       addresses = (0x23,)
+#       fields = {"light": (0x10, 2)}
+#       def decode(self, raw):
+#           return {"light": struct.unpack(">H", raw["light"])[0] / 1.2}
+#
+# Try it without sensors:  python3 micropi_grove.py --sim
+
+import argparse
+import heapq
+import struct
+import threading
+import time
+from collections import namedtuple
+
+# One published reading: time.time() it was taken and {field: value}
+Reading = namedtuple("Reading", ["time", "values"])
+
+# Registered drivers, {address: [driver classes to try]}
+drivers = {}
+
+
+def driver(cls):
+
+    # Class decorator registering a GroveSensor for its addresses
+
+    for address in cls.addresses:
+        drivers.setdefault(address, []).append(cls)
+    return cls
+
+
+def blocks(fields, limit=32, gap=2):
+
+    # Groups register fields into as few block reads as possible.
+    # Fields that overlap or are at most gap bytes apart are read together,
+    # up to limit bytes (the SMBus block size); command fields (bytes
+    # rather than a register number) are read on their own.
+    # Arguments:
+    # fields = {name: (register or command bytes, length)}
+    # Returns [(register or command, length, [(name, offset, length)])]
+
+    result = []
+    for register, length, name in sorted((register, length, name) for name, (register, length)
+                                         in fields.items() if isinstance(register, int)):
+        if result:
+            start, size, members = result[-1]
+            end = max(start + size, register + length)
+            if register <= start + size + gap and end - start <= limit:
+                result[-1] = (start, end - start, members + [(name, register - start, length)])
+                continue
+        result.append((register, length, [(name, 0, length)]))
+    for name, (command, length) in fields.items():
+        if not isinstance(command, int):
+            result.append((bytes(command), length, [(name, 0, length)]))
+    return result
+
+
+def read_register(device, register, count):
+
+    # Reads count bytes from register (or after a command) on an I2CHandle
+
+    buf = bytearray(count)
+    device.write_then_readinto(bytes([register]) if isinstance(register, int) else register, buf)
+    return bytes(buf)
+
+
+class GroveSensor:
+
+    # Base for Grove I2C sensor drivers.
+    # Subclasses set name, addresses, fields and rate, and implement
+    # decode(); identify() and setup() are optional.
+    # Arguments:
+    # address = I2C address, defaults to the first of addresses
+    # rate = readings per second when polled
+    # only = names of the fields to read, defaults to all
+    # bus = I2CBus, defaults to micropi.i2cbus
+
+    name = None
+    addresses = ()
+    # {name: (register or command bytes, length)}
+    fields = {}
+    rate = 10
+
+    def __init__(self, address=None, rate=None, only=None, bus=None):
+        import micropi
+        self.address = address if address is not None else self.addresses[0]
+        self.rate = rate or self.rate
+        self.bus = bus or micropi.i2cbus
+        self.device = self.bus.device(self.address, micropi.I2CBus.SENSOR, self.name)
+        wanted = self.fields if only is None else {name: self.fields[name] for name in only}
+        self.blocks = blocks(wanted)
+        self.setup()
+
+    @classmethod
+    def identify(cls, device):
+
+        # Returns True if the device at this address is this sensor.
+        # By default any device at one of the addresses is.
+
+        return True
+
+    def setup(self):
+        pass
+
+    def write(self, *data):
+        self.device.write(bytes(data))
+
+    def submit(self):
+
+        # Queues the block reads on the bus without waiting for them
+
+        return [self.bus.submit(self.address, self.device.priority, "wr",
+                                bytes([start]) if isinstance(start, int) else start,
+                                bytearray(length), wait=False)
+                for start, length, members in self.blocks]
+
+    def collect(self, transactions):
+
+        # Waits for the reads queued by submit() and decodes them
+
+        raw = {}
+        for transaction, (start, length, members) in zip(transactions, self.blocks):
+            transaction.done.wait()
+            if transaction.error is not None:
+                raise transaction.error
+            for name, offset, size in members:
+                raw[name] = bytes(transaction.readbuf[offset:offset + size])
+        return self.decode(raw)
+
+    def read(self):
+
+        # Takes one reading straight away, returning {field: value}
+
+        return self.collect(self.submit())
+
+    def decode(self, raw):
+
+        # Converts {field: bytes} into {field: value}
+
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+@driver
+class BMP280(GroveSensor):
+
+    # Bosch BMP280 barometer (Grove Barometer Sensor)
+    # temperature in degrees C, pressure in hPa
+
+    name = "bmp280"
+    addresses = (0x77, 0x76)
+    fields = {"pressure": (0xF7, 3), "temperature": (0xFA, 3)}
+    rate = 10
+
+    def __init__(self, address=None, rate=None, only=None, bus=None):
+        # pressure cannot be worked out without the temperature
+        if only is not None and "temperature" not in only:
+            only = list(only) + ["temperature"]
+        super().__init__(address, rate, only, bus)
+
+    @classmethod
+    def identify(cls, device):
+        return read_register(device, 0xD0, 1)[0] in (0x58, 0x60)   # BMP280, BME280
+
+    def setup(self):
+        self.calibration = struct.unpack("<HhhHhhhhhhhh", read_register(self.device, 0x88, 24))
+        self.write(0xF5, 0x00)          # 0.5 ms standby, no filter
+        self.write(0xF4, 0x27)          # x1 oversampling, normal mode
+
+    def decode(self, raw):
+
+        # The floating point compensation from the datasheet
+
+        t1, t2, t3, p1, p2, p3, p4, p5, p6, p7, p8, p9 = self.calibration
+        b = raw["temperature"]
+        adc_t = (b[0] << 12) | (b[1] << 4) | (b[2] >> 4)
+        fine = (adc_t / 16384.0 - t1 / 1024.0) * t2 + ((adc_t / 131072.0 - t1 / 8192.0) ** 2) * t3
+        values = {"temperature": fine / 5120.0}
+        if "pressure" in raw:
+            b = raw["pressure"]
+            adc_p = (b[0] << 12) | (b[1] << 4) | (b[2] >> 4)
+            var1 = fine / 2.0 - 64000.0
+            var2 = var1 * var1 * p6 / 32768.0 + var1 * p5 * 2.0
+            var2 = var2 / 4.0 + p4 * 65536.0
+            var1 = (1.0 + (p3 * var1 * var1 / 524288.0 + p2 * var1) / 524288.0 / 32768.0) * p1
+            if var1 == 0:
+                values["pressure"] = None
+            else:
+                pressure = (1048576.0 - adc_p - var2 / 4096.0) * 6250.0 / var1
+                pressure += (p9 * pressure * pressure / 2147483648.0 + pressure * p8 / 32768.0 + p7) / 16.0
+                values["pressure"] = pressure / 100.0
+        return values
+
+
+@driver
+class SHT31(GroveSensor):
+
+    # Sensirion SHT31 (Grove Temp&Humi Sensor SHT31), run in periodic mode
+    # at 10 measurements a second.  temperature in degrees C, humidity in
+    # percent; a reading failing its CRC raises IOError.
+
+    name = "sht31"
+    addresses = (0x44, 0x45)
+    fields = {"measurement": (b"\xe0\x00", 6)}
+    rate = 2
+
+    @staticmethod
+    def crc(data):
+        crc = 0xFF
+        for byte in data:
+            crc ^= byte
+            for _ in range(8):
+                crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        return crc
+
+    @classmethod
+    def identify(cls, device):
+        status = read_register(device, b"\xf3\x2d", 3)
+        return cls.crc(status[:2]) == status[2]
+
+    def setup(self):
+        self.write(0x27, 0x37)          # periodic, 10 per second, high repeatability
+        time.sleep(0.02)                # first measurement
+
+    def decode(self, raw):
+        data = raw["measurement"]
+        if self.crc(data[0:2]) != data[2] or self.crc(data[3:5]) != data[5]:
+            raise IOError("SHT31 at 0x%02x: CRC mismatch" % self.address)
+        temperature, humidity = struct.unpack(">HxHx", data)
+        return {"temperature": -45 + 175 * temperature / 65535.0, "humidity": 100 * humidity / 65535.0}
+
+    def close(self):
+        try:
+            self.write(0x30, 0x93)      # stop periodic measurement
+        except OSError:
+            pass
+
+
+@driver
+class ADXL345(GroveSensor):
+
+    # Analog Devices ADXL345 (Grove 3-Axis Digital Accelerometer +-16g)
+    # x, y and z in g
+
+    name = "adxl345"
+    addresses = (0x53, 0x1D)
+    fields = {"x": (0x32, 2), "y": (0x34, 2), "z": (0x36, 2)}
+    rate = 50
+
+    @classmethod
+    def identify(cls, device):
+        return read_register(device, 0x00, 1)[0] == 0xE5
+
+    def setup(self):
+        self.write(0x31, 0x0B)          # full resolution, +-16 g
+        self.write(0x2C, 0x0A)          # 100 Hz output rate
+        self.write(0x2D, 0x08)          # measure
+
+    def decode(self, raw):
+        return {axis: struct.unpack("<h", data)[0] * 0.0039 for axis, data in raw.items()}
+
+    def close(self):
+        try:
+            self.write(0x2D, 0x00)      # standby
+        except OSError:
+            pass
+
+
+@driver
+class MPU6050(GroveSensor):
+
+    # InvenSense MPU-6050 / MPU-9250 accelerometer and gyroscope
+    # accel (x, y, z) in g at +-2 g, gyro (x, y, z) in degrees per second at
+    # +-250, temperature in degrees C
+
+    name = "mpu6050"
+    addresses = (0x68, 0x69)
+    fields = {"accel": (0x3B, 6), "temperature": (0x41, 2), "gyro": (0x43, 6)}
+    rate = 50
+
+    @classmethod
+    def identify(cls, device):
+        return read_register(device, 0x75, 1)[0] in (0x68, 0x71, 0x73)
+
+    def setup(self):
+        self.write(0x6B, 0x01)          # wake, clock from the X gyro
+        self.write(0x1A, 0x03)          # 44 Hz low pass filter
+        self.write(0x19, 0x09)          # 100 Hz sample rate
+        self.write(0x1B, 0x00)          # +-250 degrees per second
+        self.write(0x1C, 0x00)          # +-2 g
+
+    def decode(self, raw):
+        values = {}
+        if "accel" in raw:
+            values["accel"] = tuple(v / 16384.0 for v in struct.unpack(">hhh", raw["accel"]))
+        if "temperature" in raw:
+            values["temperature"] = struct.unpack(">h", raw["temperature"])[0] / 340.0 + 36.53
+        if "gyro" in raw:
+            values["gyro"] = tuple(v / 131.0 for v in struct.unpack(">hhh", raw["gyro"]))
+        return values
+
+    def close(self):
+        try:
+            self.write(0x6B, 0x40)      # sleep
+        except OSError:
+            pass
+
+
+class GrovePoller:
+
+    # Reads Grove sensors in the background, each at its own rate, and
+    # keeps the latest reading of every sensor in a shared table.
+    # All sensors due within window seconds of each other are read in one
+    # go: their block reads are queued on the bus together and collected
+    # afterwards.  A sensor that falls a whole period behind skips the
+    # readings it missed rather than bursting to catch up.
+    # Arguments:
+    # bus = I2CBus, defaults to micropi.i2cbus
+    # window = seconds within which due sensors are read together
+
+    def __init__(self, bus=None, window=0.002):
+        import micropi
+        self.bus = bus or micropi.i2cbus
+        self.window = window
+        self.sensors = {}
+        self.schedule = []
+        self.readings = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.sequence = 0
+        self.running = False
+        self.thread = None
+
+    def add(self, sensor, name=None, rate=None):
+
+        # Polls a sensor from now on
+        # Arguments:
+        # sensor = GroveSensor
+        # name = key in the table, defaults to sensor.name
+        # rate = readings per second, defaults to sensor.rate
+
+        name = name or sensor.name
+        if rate:
+            sensor.rate = rate
+        with self.wake:
+            if name in self.sensors:
+                raise ValueError("a sensor called %s is already polled" % name)
+            self.sensors[name] = sensor
+            self.counters[name] = {"reads": 0, "errors": 0, "skipped": 0, "busy": 0.0,
+                                   "transactions": 0, "error": None}
+            self.sequence += 1
+            heapq.heappush(self.schedule, (time.monotonic(), self.sequence, name))
+            self.wake.notify()
+        return sensor
+
+    def remove(self, name):
+        with self.wake:
+            sensor = self.sensors.pop(name, None)
+            self.readings.pop(name, None)
+        if sensor is not None:
+            sensor.close()
+
+    def discover(self, rates=None):
+
+        # Scans the bus and starts polling every sensor a registered driver
+        # recognises.  Returns {address: name} for every address that
+        # answered, with None for devices no driver claimed (the OLED, the
+        # servo controller...).
+        # Arguments:
+        # rates = {driver name: readings per second} overriding the defaults
+
+        import micropi
+        rates = rates or {}
+        found = {}
+        for address in self.bus.scan():
+            found[address] = None
+            if any(getattr(sensor, "address", None) == address for sensor in self.sensors.values()):
+                continue
+            for cls in drivers.get(address, ()):
+                try:
+                    if not cls.identify(self.bus.device(address, micropi.I2CBus.SENSOR)):
+                        continue
+                    sensor = cls(address, rates.get(cls.name), bus=self.bus)
+                except OSError:
+                    continue
+                name = cls.name
+                count = 1
+                while name in self.sensors:
+                    count += 1
+                    name = "%s_%d" % (cls.name, count)
+                self.add(sensor, name)
+                found[address] = name
+                break
+        return found
+
+    def start(self):
+        with self.wake:
+            if self.thread is None:
+                self.running = True
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return self
+
+    def stop(self):
+
+        # Stops polling and closes the sensors
+
+        with self.wake:
+            self.running = False
+            self.wake.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for name in list(self.sensors):
+            self.remove(name)
+
+    def run(self):
+        import micropi
+        micropi.realtime.register()
+        while True:
+            with self.wake:
+                while self.running and (not self.schedule or
+                                        self.schedule[0][0] > time.monotonic() + self.window):
+                    self.wake.wait(self.schedule[0][0] - time.monotonic() if self.schedule else None)
+                if not self.running:
+                    return
+                limit = time.monotonic() + self.window
+                due = []
+                while self.schedule and self.schedule[0][0] <= limit:
+                    when, sequence, name = heapq.heappop(self.schedule)
+                    if name in self.sensors:
+                        due.append((when, name, self.sensors[name]))
+            self.poll(due)
+
+    def poll(self, due):
+
+        # Reads the due sensors, publishes the readings and reschedules them
+
+        started = time.perf_counter()
+        queued = []
+        for when, name, sensor in due:
+            try:
+                queued.append((when, name, sensor, sensor.submit()))
+            except Exception as error:
+                queued.append((when, name, sensor, error))
+        for when, name, sensor, transactions in queued:
+            counters = self.counters[name]
+            try:
+                if isinstance(transactions, Exception):
+                    raise transactions
+                values = sensor.collect(transactions)
+            except Exception as error:
+                # a failing driver must not stop the thread polling the rest
+                counters["errors"] += 1
+                counters["error"] = str(error)
+            else:
+                reading = Reading(time.time(), values)
+                with self.lock:
+                    self.readings[name] = reading
+                counters["reads"] += 1
+                counters["transactions"] += len(transactions)
+        busy = (time.perf_counter() - started) / max(len(due), 1)
+        now = time.monotonic()
+        with self.wake:
+            for when, name, sensor in due:
+                if name not in self.sensors:
+                    continue
+                counters = self.counters[name]
+                counters["busy"] += busy
+                period = 1.0 / sensor.rate
+                when += period
+                if when < now:
+                    missed = int((now - when) / period) + 1
+                    counters["skipped"] += missed
+                    when += missed * period
+                self.sequence += 1
+                heapq.heappush(self.schedule, (when, self.sequence, name))
+
+    def latest(self, name):
+
+        # Returns the last Reading of a sensor, or None before the first
+
+        with self.lock:
+            return self.readings.get(name)
+
+    def table(self):
+
+        # Returns {name: Reading} for every sensor read so far
+
+        with self.lock:
+            return dict(self.readings)
+
+    def value(self, name, field):
+
+        # Returns a function giving the latest value of one field, e.g.
+        # for Dashboard.add("pressure", poller.value("bmp280", "pressure"))
+
+        def latest():
+            reading = self.latest(name)
+            return None if reading is None else reading.values.get(field)
+        return latest
+
+    def stats(self):
+
+        # Returns per sensor: rate, reads, errors (and the last one),
+        # skipped readings, bus transactions per reading, fields per
+        # reading and mean milliseconds per reading
+
+        result = {}
+        with self.lock:
+            for name, sensor in self.sensors.items():
+                counters = self.counters[name]
+                reads = max(counters["reads"], 1)
+                result[name] = {"address": "0x%02x" % sensor.address, "rate": sensor.rate,
+                                "reads": counters["reads"], "errors": counters["errors"],
+                                "last_error": counters["error"], "skipped": counters["skipped"],
+                                "transactions_per_read": counters["transactions"] / reads,
+                                "fields_per_read": sum(len(b[2]) for b in sensor.blocks),
+                                "ms_per_read": 1000 * counters["busy"] / max(reads + counters["errors"], 1)}
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ---------------Main------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the Grove I2C sensors and show their readings")
+    parser.add_argument("--sim", action="store_true",
+                        help="use the simulated hardware backend with one of each sensor attached")
+    parser.add_argument("--period", type=float, default=1.0, help="seconds between printouts")
+    args = parser.parse_args()
+    if args.sim:
+        import micropi_sim
+        sim = micropi_sim.install()
+        import micropi
+        for address, model in ((0x77, micropi_sim.SimBMP280()), (0x44, micropi_sim.SimSHT31()),
+                               (0x53, micropi_sim.SimADXL345()), (0x68, micropi_sim.SimMPU6050())):
+            sim.bus().attach(address, model)
+    poller = GrovePoller()
+    for address, name in sorted(poller.discover().items()):
+        print("0x%02x  %s" % (address, name or "(no driver)"))
+    poller.start()
+    try:
+        while True:
+            time.sleep(args.period)
+            for name, reading in sorted(poller.table().items()):
+                print("%-10s %s" % (name, "  ".join(
+                    "%s %s" % (field, "(%s)" % ", ".join("%.2f" % v for v in value)
+                               if isinstance(value, tuple) else "%.2f" % value)
+                    for field, value in reading.values.items())))
+            print()
+    except KeyboardInterrupt:
+        for name, entry in poller.stats().items():
+            print(name, entry)
+        poller.stop()
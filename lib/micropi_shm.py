@@ -0,0 +1,252 @@
+#!/usr/bin/python
+
+# Shared memory sensor state for MicroPi V2.1
+# Developed by: SB Components & Hypersmart Ltd
+# Project: MicroPi
+#
+# One publisher process samples the Sensor, Buttons and IRDetect devices
+# and writes the latest values into a multiprocessing.shared_memory block.
+# Any number of reader processes attach to the block and take consistent
+# snapshots without system calls and without pinging the sensors again.
+#
+# Publisher (owns the hardware):
+#   python3 micropi_shm.py
+#
+# Reader:
+#   from micropi_shm import SensorReader
+#   state = SensorReader()
+#   snap = state.snapshot()
+#   print(snap.distance, snap.ir1, snap.button1, snap.ir_key)
+#
+# Block layout (little endian), protected by a seqlock: the writer makes
+# the sequence odd before updating the fields and even afterwards, readers
+# retry while the sequence is odd or changed during their read.
+#   uint32 sequence
+#   uint32 layout version
+#   float64 timestamp of the last update (time.time())
+#   float64 ultrasonic distance in cm
+#   float64 ultrasonic timestamp
+#   uint8 IR1, uint8 IR2, uint8 button1, uint8 button2
+#   uint32 number of IR keys received
+#   char[8] last IR key (UTF-8, zero padded)
+#   float64 IR key timestamp
+
+import argparse
+import os
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+NAME = "micropi_sensors"
+VERSION = 1
+
+SEQUENCE = struct.Struct("<I")
+FIELDS = struct.Struct("<Iddd4BI8sd")
+SIZE = SEQUENCE.size + FIELDS.size
+
+Snapshot = namedtuple("Snapshot", ["timestamp", "distance", "distance_time", "ir1", "ir2",
+                                   "button1", "button2", "ir_count", "ir_key", "ir_time"])
+
+
+class SensorPublisher:
+
+    # Writer side of the shared sensor block.
+    # Creates (or takes over) the block and samples the devices on
+    # background threads: one for the ultrasonic sensor at its own rate,
+    # one polling the IR line sensors and buttons, and one decoding the IR
+    # remote.  Only this process touches the sensor pins.
+    # Arguments:
+    # name = shared memory block name
+    # sonic_period = seconds between ultrasonic pings
+    # poll_period = seconds between IR line sensor / button polls
+
+    def __init__(self, name=NAME, sonic_period=0.1, poll_period=0.005):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.buf = self.shm.buf
+        self.lock = threading.Lock()
+        self.sonic_period = sonic_period
+        self.poll_period = poll_period
+        self.running = False
+        self.values = [0, 0.0, 0.0, 0.0, 0, 0, 0, 0, 0, b"", 0.0]
+        self.sequence = 0
+        SEQUENCE.pack_into(self.buf, 0, 0)
+        self.write(version=VERSION)
+
+    def write(self, **fields):
+
+        # Updates one or more fields under the seqlock.
+        # Field names are those of Snapshot plus "version".
+
+        index = {"version": 0, "timestamp": 1, "distance": 2, "distance_time": 3,
+                 "ir1": 4, "ir2": 5, "button1": 6, "button2": 7, "ir_count": 8,
+                 "ir_key": 9, "ir_time": 10}
+        with self.lock:
+            for key, value in fields.items():
+                self.values[index[key]] = value
+            self.values[1] = time.time()
+            self.sequence += 1
+            SEQUENCE.pack_into(self.buf, 0, self.sequence & 0xFFFFFFFF)
+            FIELDS.pack_into(self.buf, SEQUENCE.size, *self.values)
+            self.sequence += 1
+            SEQUENCE.pack_into(self.buf, 0, self.sequence & 0xFFFFFFFF)
+
+    def start(self, sensor=None, ir1=None, ir2=None, buttons=None, ir=None):
+
+        # Starts sampling the given devices.  Devices left as None are
+        # created from micropi with their default pins.
+        # Arguments:
+        # sensor = micropi.Sensor("ULTRASONIC", ...)
+        # ir1, ir2 = micropi.Sensor("IR1"/"IR2", ...)
+        # buttons = micropi.Buttons()
+        # ir = micropi.IRDetect()
+
+        import micropi
+        self.micropi = micropi
+        self.sensor = sensor or micropi.Sensor("ULTRASONIC", 0)
+        self.ir1 = ir1 or micropi.Sensor("IR1", 0)
+        self.ir2 = ir2 or micropi.Sensor("IR2", 0)
+        self.buttons = buttons or micropi.Buttons()
+        self.ir = ir or micropi.IRDetect()
+        self.running = True
+        self.threads = [threading.Thread(target=target, daemon=True)
+                        for target in (self.sample_sonic, self.sample_inputs, self.sample_remote)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+
+    def sample_sonic(self):
+
+        # Pings directly rather than through sonicCheck(), which waits a
+        # third of a second first.  A ping without an echo leaves the last
+        # distance and its time alone, so readers can tell it is old.
+
+        while self.running:
+            distance = self.sensor.ping()
+            if distance is not None:
+                self.sensor.lastRead = distance
+                self.write(distance=distance, distance_time=time.time())
+            time.sleep(self.sonic_period)
+
+    def sample_inputs(self):
+        GPIO = self.micropi.GPIO
+        last = None
+        while self.running:
+            current = (GPIO.input(self.ir1.config["echo"]), GPIO.input(self.ir2.config["echo"]),
+                       GPIO.input(self.buttons.pb1), GPIO.input(self.buttons.pb2))
+            if current != last:
+                self.write(ir1=current[0], ir2=current[1], button1=current[2], button2=current[3])
+                last = current
+            time.sleep(self.poll_period)
+
+    def sample_remote(self):
+        count = 0
+        while self.running:
+            key = self.ir.read()
+            if key is None:
+                time.sleep(0.0005)
+                continue
+            count += 1
+            self.write(ir_count=count, ir_key=key.encode("utf-8")[:8], ir_time=time.time())
+
+    def close(self):
+        if self.running:
+            self.stop()
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SensorReader:
+
+    # Reader side of the shared sensor block.
+    # snapshot() reads straight out of the mapped block, so after attach
+    # there are no system calls on the read path.
+    # Arguments:
+    # name = shared memory block name
+
+    def __init__(self, name=NAME):
+        self.shm = shared_memory.SharedMemory(name=name)
+        if sys.version_info < (3, 13):
+            # Attaching registers the block with this process's resource
+            # tracker, which would unlink it when the reader exits.
+            # The tracker knows POSIX blocks by their "/" prefixed name.
+            name = self.shm.name
+            if os.name == "posix" and not name.startswith("/"):
+                name = "/" + name
+            resource_tracker.unregister(name, "shared_memory")
+        self.buf = self.shm.buf
+        self.retries = 0
+
+    def snapshot(self, timeout=0.1):
+
+        # Returns a consistent Snapshot of the latest sensor values.
+        # Raises TimeoutError if the block stays mid-update for timeout
+        # seconds, as it does when the publisher died while writing.
+
+        buf = self.buf
+        spins = 0
+        deadline = None
+        while True:
+            before, = SEQUENCE.unpack_from(buf, 0)
+            if before & 1:
+                self.retries += 1
+                spins += 1
+                # only look at the clock once the writer is clearly slow
+                if spins % 1000 == 0:
+                    if deadline is None:
+                        deadline = time.monotonic() + timeout
+                    elif time.monotonic() > deadline:
+                        raise TimeoutError("shared sensor block stuck mid-update, is the publisher running?")
+                continue
+            values = FIELDS.unpack_from(buf, SEQUENCE.size)
+            after, = SEQUENCE.unpack_from(buf, 0)
+            if before == after:
+                break
+            self.retries += 1
+        if values[0] != VERSION:
+            raise ValueError("shared sensor block has layout version %d" % values[0])
+        return Snapshot(values[1], values[2], values[3], values[4], values[5], values[6],
+                        values[7], values[8], values[9].rstrip(b"\0").decode("utf-8"),
+                        values[10])
+
+    def sequence(self):
+
+        # Returns the current sequence number; it changes on every update,
+        # so callers can cheaply tell whether anything new has arrived.
+
+        return SEQUENCE.unpack_from(self.buf, 0)[0]
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+
+# ---------------Main------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MicroPi shared memory sensor publisher")
+    parser.add_argument("--name", default=NAME, help="shared memory block name")
+    parser.add_argument("--sonic-period", type=float, default=0.1)
+    parser.add_argument("--sim", action="store_true", help="use the simulated hardware backend")
+    args = parser.parse_args()
+    if args.sim:
+        import micropi_sim
+        micropi_sim.install()
+    publisher = SensorPublisher(args.name, args.sonic_period)
+    publisher.start()
+    print("Publishing sensor state to shared memory block", args.name)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        publisher.close()
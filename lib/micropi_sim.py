@@ -0,0 +1,1535 @@
+#!/usr/bin/python
+
+# Simulated hardware backend for the MicroPi library
+# Developed by: SB Components & Hypersmart Ltd
+# Project: MicroPi
+#
+# Provides stand-ins for the RPi.GPIO, rpi_ws281x, board, busio, smbus,
+# adafruit_bus_device and adafruit_ssd1306 modules so that micropi can be
+# imported and exercised on a plain Linux machine without a board attached.
+# Install the backend before micropi is imported:
+#
+#   import micropi_sim
+#   sim = micropi_sim.install()
+#   import micropi
+#
+# To exercise the libgpiod backend instead, also install the mock gpiod
+# module and select the backend:
+#
+#   sim = micropi_sim.install()
+#   micropi_sim.install_gpiod(sim)
+#   os.environ["MICROPI_GPIO"] = "gpiod"
+#   import micropi
+#
+# The returned Simulator gives access to the simulated GPIO pins, I2C buses
+# and LED strips so that inputs can be driven and outputs inspected.
+#
+# SimBMP280, SimSHT31, SimADXL345 and SimMPU6050 model common Grove I2C
+# sensors at register level, for trying micropi_grove without them:
+#
+#   import micropi
+#   sim.bus().attach(0x77, micropi_sim.SimBMP280(temperature=25.0))
+#
+# World adds a two wheeled robot in a mapped arena on a virtual clock, so
+# controllers run faster than real time; simulate() runs one controller
+# and batch() evaluates parameter sets across processes:
+#
+#   python3 micropi_sim.py --world arena.json --duration 120 tryAvoid.py
+
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import time
+import types
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+from enum import Enum
+
+
+_time_source = time.monotonic
+_real_sleep = time.sleep
+
+
+def now():
+
+    # Time base used by the simulated devices.
+    # All waveforms and timestamps are expressed against this clock, which
+    # is the World's virtual clock while a simulation is running.
+    return _time_source()
+
+
+def use_clock(source):
+
+    # Makes source (e.g. a VirtualClock) the time base of the simulated
+    # devices, or the real monotonic clock again for None
+
+    global _time_source
+    _time_source = time.monotonic if source is None else source.monotonic
+
+
+class SimPWM:
+
+    # Software stand-in for RPi.GPIO.PWM
+    # Arguments:
+    # gpio = owning SimGPIO
+    # pin = BCM pin number
+    # frequency = PWM frequency in Hz
+
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = 0
+        self.running = False
+        gpio.pwms.append(self)
+
+    def start(self, duty):
+        self.duty = duty
+        self.running = True
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.running = False
+        if self in self.gpio.pwms:
+            self.gpio.pwms.remove(self)
+
+
+class SimGPIO:
+
+    # Stand-in for the RPi.GPIO module.
+    # Output writes are optionally recorded with a timestamp, inputs can be
+    # set directly or driven from a waveform function and edge callbacks
+    # are delivered from a dispatcher thread in the same way RPi.GPIO
+    # delivers them from its event thread.
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+    RPI_REVISION = 3
+    VERSION = "sim"
+
+    def __init__(self):
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.sources = {}
+        self.output_hooks = {}
+        self.events = {}
+        self.pwms = []
+        self.recording = False
+        self.record = deque(maxlen=100000)
+        self.edge_queue = deque()
+        self.edge_ready = threading.Condition()
+        self.dispatcher = None
+        # per pin (time, level) edges for the mock gpiod module
+        self.log_edges = False
+        self.edge_log = {}
+        # called on every input/output call, used to charge virtual time
+        self.io_hook = None
+
+    # ---- RPi.GPIO API ----
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def getmode(self):
+        return self.mode
+
+    def setwarnings(self, state):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=None, initial=None):
+        for pin in self._channels(channel):
+            self.directions[pin] = direction
+            if direction == self.OUT:
+                self.levels[pin] = 1 if initial else 0
+            elif pull_up_down == self.PUD_UP:
+                self.levels.setdefault(pin, 1)
+            else:
+                self.levels.setdefault(pin, 0)
+
+    def output(self, channel, value):
+        if self.io_hook is not None:
+            self.io_hook()
+        pins = self._channels(channel)
+        if isinstance(value, (list, tuple)):
+            values = value
+        else:
+            values = [value] * len(pins)
+        for pin, level in zip(pins, values):
+            level = 1 if level else 0
+            self.levels[pin] = level
+            if self.recording:
+                self.record.append((now(), pin, level))
+            hook = self.output_hooks.get(pin)
+            if hook is not None:
+                hook(pin, level)
+
+    def input(self, channel):
+        if self.io_hook is not None:
+            self.io_hook()
+        source = self.sources.get(channel)
+        if source is not None:
+            return source(now())
+        return self.levels.get(channel, 0)
+
+    def PWM(self, pin, frequency):
+        return SimPWM(self, pin, frequency)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        self.events[channel] = {"edge": edge, "callbacks": [], "detected": False}
+        if callback is not None:
+            self.events[channel]["callbacks"].append(callback)
+        self._start_dispatcher()
+
+    def add_event_callback(self, channel, callback):
+        self.events[channel]["callbacks"].append(callback)
+
+    def remove_event_detect(self, channel):
+        self.events.pop(channel, None)
+
+    def event_detected(self, channel):
+        event = self.events.get(channel)
+        if event is None or not event["detected"]:
+            return False
+        event["detected"] = False
+        return True
+
+    def cleanup(self, channel=None):
+        if channel is None:
+            self.directions.clear()
+            self.events.clear()
+        else:
+            for pin in self._channels(channel):
+                self.directions.pop(pin, None)
+                self.events.pop(pin, None)
+
+    # ---- Simulation controls ----
+
+    def set_input(self, pin, level):
+
+        # Drives an input pin to the given level and queues any edge
+        # callback registered for the transition.
+        # Arguments:
+        # pin = BCM pin number
+        # level = 0 or 1
+
+        level = 1 if level else 0
+        previous = self.levels.get(pin, 0)
+        self.levels[pin] = level
+        if previous != level:
+            self.log_edge(pin, now(), level)
+        if previous == level or pin not in self.events:
+            return
+        with self.edge_ready:
+            self.edge_queue.append((now(), pin, level))
+            self.edge_ready.notify()
+
+    def set_source(self, pin, source):
+
+        # Drives an input pin from a waveform function.
+        # Arguments:
+        # pin = BCM pin number
+        # source = function taking the current time and returning 0 or 1,
+        # or None to go back to the static level
+
+        if source is None:
+            self.sources.pop(pin, None)
+        else:
+            self.sources[pin] = source
+
+    def on_output(self, pin, hook):
+
+        # Registers a function called as hook(pin, level) on every write
+        # to the given output pin.
+
+        if hook is None:
+            self.output_hooks.pop(pin, None)
+        else:
+            self.output_hooks[pin] = hook
+
+    def attach_ultrasonic(self, trigger, echo, distance):
+
+        # Models an HC-SR04 ranging module.
+        # The echo pin goes high shortly after the trigger pulse falls and
+        # stays high for the round trip time of sound over the distance.
+        # Arguments:
+        # trigger, echo = BCM pin numbers
+        # distance = distance to the obstacle in cm, or a function
+        # returning it
+
+        state = {"fired": None}
+
+        def fired(pin, level):
+            if level == 0:
+                state["fired"] = now()
+                if self.log_edges:
+                    d = distance() if callable(distance) else distance
+                    self.log_edge(echo, state["fired"] + 0.0002, 1)
+                    self.log_edge(echo, state["fired"] + 0.0002 + (2.0 * d) / 34300, 0)
+
+        def waveform(t):
+            if state["fired"] is None:
+                return 0
+            d = distance() if callable(distance) else distance
+            rise = state["fired"] + 0.0002
+            fall = rise + (2.0 * d) / 34300
+            if rise <= t < fall:
+                return 1
+            if t >= fall:
+                state["fired"] = None
+            return 0
+
+        self.on_output(trigger, fired)
+        self.set_source(echo, waveform)
+
+    def send_nec(self, pin, address, command, start=None):
+
+        # Plays an NEC infrared frame on an active low receiver pin.
+        # Arguments:
+        # pin = BCM pin number of the IR receiver
+        # address, command = 8 bit NEC address and command
+        # start = time the frame begins (defaults to now)
+
+        data = [address, address ^ 0xFF, command, command ^ 0xFF]
+        edges = [(0.0, 0), (0.009, 1), (0.0135, 0)]
+        t = 0.0135
+        for byte in data:
+            for bit in range(8):
+                t += 0.00056
+                edges.append((t, 1))
+                t += 0.00169 if (byte >> bit) & 1 else 0.00056
+                edges.append((t, 0))
+        t += 0.00056
+        edges.append((t, 1))
+        begin = now() if start is None else start
+        for when, value in edges:
+            self.log_edge(pin, begin + when, value)
+
+        def waveform(t):
+            offset = t - begin
+            if offset < 0:
+                return 1
+            level = 1
+            for when, value in edges:
+                if offset < when:
+                    break
+                level = value
+            return level
+
+        self.set_source(pin, waveform)
+        return begin + t
+
+    def log_edge(self, pin, when, level):
+        if self.log_edges:
+            self.edge_log.setdefault(pin, deque(maxlen=1024)).append((when, level))
+
+    def _channels(self, channel):
+        if isinstance(channel, (list, tuple)):
+            return list(channel)
+        return [channel]
+
+    def _start_dispatcher(self):
+        if self.dispatcher is not None:
+            return
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            with self.edge_ready:
+                while not self.edge_queue:
+                    self.edge_ready.wait()
+                stamp, pin, level = self.edge_queue.popleft()
+            event = self.events.get(pin)
+            if event is None:
+                continue
+            edge = event["edge"]
+            if (edge == self.RISING and level == 0) or \
+                    (edge == self.FALLING and level == 1):
+                continue
+            event["detected"] = True
+            for callback in list(event["callbacks"]):
+                callback(pin)
+
+
+class SimI2C:
+
+    # Stand-in for busio.I2C.
+    # Counts transactions and bytes per device address and, when
+    # simulate_timing is set, sleeps for the time the transfer would take
+    # on the wire (9 bit times per byte plus the address byte).
+    # Arguments:
+    # scl, sda = pins (ignored)
+    # frequency = bus clock in Hz
+
+    simulate_timing = False
+
+    def __init__(self, scl=None, sda=None, frequency=100000):
+        self.frequency = frequency
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.stats = {}
+        self.log = deque(maxlen=10000)
+        Simulator.buses.append(self)
+
+    def try_lock(self):
+        return self.lock.acquire(False)
+
+    def unlock(self):
+        self.lock.release()
+
+    def scan(self):
+        return sorted(address for address, device in self.devices.items()
+                      if getattr(device, "present", True))
+
+    def deinit(self):
+        pass
+
+    def writeto(self, address, buffer, start=0, end=None):
+        data = bytes(buffer[start:end])
+        self._account(address, len(data))
+        self.log.append((now(), address, "w", data))
+        device = self.devices.get(address)
+        if device is not None:
+            device.write(data)
+
+    def readfrom_into(self, address, buffer, start=0, end=None):
+        if end is None:
+            end = len(buffer)
+        self._account(address, end - start)
+        device = self.devices.get(address)
+        data = device.read(end - start) if device is not None else bytes(end - start)
+        buffer[start:end] = data
+
+    def writeto_then_readfrom(self, address, out_buffer, in_buffer, out_start=0,
+                              out_end=None, in_start=0, in_end=None):
+        self.writeto(address, out_buffer, out_start, out_end)
+        self.readfrom_into(address, in_buffer, in_start, in_end)
+
+    def attach(self, address, device):
+
+        # Places a device model on the bus.
+        # The model needs write(data) and read(count) methods.
+
+        self.devices[address] = device
+
+    def reset_stats(self):
+        self.stats = {}
+
+    def total_bytes(self):
+        return sum(s["bytes"] for s in self.stats.values())
+
+    def _account(self, address, count):
+        entry = self.stats.setdefault(address, {"transactions": 0, "bytes": 0})
+        entry["transactions"] += 1
+        entry["bytes"] += count
+        if self.simulate_timing:
+            time.sleep(9.0 * (count + 1) / self.frequency)
+
+
+class SimSMBus:
+
+    # Stand-in for smbus.SMBus.
+    # Every call counts as one bus transaction; the log and per address
+    # stats make transaction counts measurable in tests and benchmarks.
+    # Device models attached with attach() receive the raw bytes written
+    # (register first) and answer reads.
+    # Arguments:
+    # bus = bus number (ignored)
+
+    def __init__(self, bus=1):
+        self.bus = bus
+        self.devices = {}
+        self.stats = {}
+        self.log = deque(maxlen=10000)
+        self.transactions = 0
+
+    def attach(self, address, device):
+        self.devices[address] = device
+
+    def reset_stats(self):
+        self.stats = {}
+        self.transactions = 0
+        self.log.clear()
+
+    def _write(self, address, data):
+        self._account(address, len(data))
+        self.log.append((now(), address, "w", bytes(data)))
+        device = self.devices.get(address)
+        if device is not None:
+            device.write(bytes(data))
+
+    def _read(self, address, register, count):
+        if register is not None:
+            device = self.devices.get(address)
+            if device is not None:
+                device.write(bytes([register]))
+        self._account(address, count)
+        device = self.devices.get(address)
+        return list(device.read(count)) if device is not None else [0] * count
+
+    def _account(self, address, count):
+        self.transactions += 1
+        entry = self.stats.setdefault(address, {"transactions": 0, "bytes": 0})
+        entry["transactions"] += 1
+        entry["bytes"] += count
+
+    def write_quick(self, address):
+        self._write(address, b"")
+
+    def write_byte(self, address, value):
+        self._write(address, [value])
+
+    def read_byte(self, address):
+        return self._read(address, None, 1)[0]
+
+    def write_byte_data(self, address, register, value):
+        self._write(address, [register, value])
+
+    def read_byte_data(self, address, register):
+        return self._read(address, register, 1)[0]
+
+    def write_word_data(self, address, register, value):
+        self._write(address, [register, value & 0xFF, (value >> 8) & 0xFF])
+
+    def read_word_data(self, address, register):
+        low, high = self._read(address, register, 2)
+        return low | (high << 8)
+
+    def write_i2c_block_data(self, address, register, data):
+        if len(data) > 32:
+            raise OSError("block write longer than 32 bytes")
+        self._write(address, [register] + list(data))
+
+    def read_i2c_block_data(self, address, register, length=32):
+        return self._read(address, register, length)
+
+    def close(self):
+        pass
+
+
+class SimI2CDevice:
+
+    # Stand-in for adafruit_bus_device.i2c_device.I2CDevice
+
+    def __init__(self, i2c, device_address, probe=True):
+        self.i2c = i2c
+        self.device_address = device_address
+
+    def __enter__(self):
+        while not self.i2c.try_lock():
+            pass
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.i2c.unlock()
+        return False
+
+    def write(self, buf, start=0, end=None):
+        self.i2c.writeto(self.device_address, buf, start=start, end=end)
+
+    def readinto(self, buf, start=0, end=None):
+        self.i2c.readfrom_into(self.device_address, buf, start=start, end=end)
+
+    def write_then_readinto(self, out_buffer, in_buffer, out_start=0, out_end=None,
+                            in_start=0, in_end=None):
+        self.i2c.writeto_then_readfrom(self.device_address, out_buffer, in_buffer,
+                                       out_start, out_end, in_start, in_end)
+
+
+class SimRegisterDevice:
+
+    # Register file model of an I2C sensor, for SimI2C.attach() or
+    # SimSMBus.attach().
+    # A write sets the register pointer from its first byte and stores any
+    # further bytes from there on; a read returns the registers from the
+    # pointer on, auto-incrementing.  update() is called before every read
+    # so subclasses can refresh their data registers from the physical
+    # values, which tests set as attributes.  Setting present to False
+    # makes the device stop acknowledging, as if unplugged.
+
+    def __init__(self):
+        self.registers = bytearray(256)
+        self.pointer = 0
+        self.present = True
+        self.reads = 0
+
+    def check(self):
+        if not self.present:
+            raise OSError(121, "Remote I/O error")
+
+    def write(self, data):
+        self.check()
+        if data:
+            self.pointer = data[0]
+            for value in data[1:]:
+                self.store(self.pointer, value)
+                self.pointer = (self.pointer + 1) & 0xFF
+
+    def store(self, register, value):
+        self.registers[register] = value
+
+    def read(self, count):
+        self.check()
+        self.reads += 1
+        self.update()
+        data = bytes(self.registers[(self.pointer + i) & 0xFF] for i in range(count))
+        self.pointer = (self.pointer + count) & 0xFF
+        return data
+
+    def update(self):
+        pass
+
+
+class SimBMP280(SimRegisterDevice):
+
+    # Bosch BMP280 barometer (Grove Barometer Sensor, address 0x77).
+    # The raw readings are found by inverting the datasheet compensation
+    # for the example calibration from the datasheet.
+    # Arguments:
+    # temperature = degrees C
+    # pressure = hPa
+
+    CALIBRATION = (27504, 26435, -1000, 36477, -10685, 3024, 2855, 140, -7, 15500, -14600, 6000)
+
+    def __init__(self, temperature=21.0, pressure=1013.25):
+        super().__init__()
+        self.temperature = temperature
+        self.pressure = pressure
+        self.registers[0xD0] = 0x58
+        self.registers[0x88:0xA0] = struct.pack("<HhhHhhhhhhhh", *self.CALIBRATION)
+
+    def compensate(self, adc_t, adc_p):
+        t1, t2, t3, p1, p2, p3, p4, p5, p6, p7, p8, p9 = self.CALIBRATION
+        fine = (adc_t / 16384.0 - t1 / 1024.0) * t2 + ((adc_t / 131072.0 - t1 / 8192.0) ** 2) * t3
+        var1 = fine / 2.0 - 64000.0
+        var2 = var1 * var1 * p6 / 32768.0 + var1 * p5 * 2.0
+        var2 = var2 / 4.0 + p4 * 65536.0
+        var1 = (1.0 + (p3 * var1 * var1 / 524288.0 + p2 * var1) / 524288.0 / 32768.0) * p1
+        pressure = (1048576.0 - adc_p - var2 / 4096.0) * 6250.0 / var1
+        pressure += (p9 * pressure * pressure / 2147483648.0 + pressure * p8 / 32768.0 + p7) / 16.0
+        return fine / 5120.0, pressure / 100.0
+
+    def update(self):
+        if not self.registers[0xF4] & 0x03:
+            return                                  # sleep mode: no new data
+        # temperature rises and pressure falls with the raw values
+        low, high = 0, 1 << 20
+        while high - low > 1:
+            middle = (low + high) // 2
+            low, high = (middle, high) if self.compensate(middle, 0)[0] < self.temperature else (low, middle)
+        adc_t = low
+        low, high = 0, 1 << 20
+        while high - low > 1:
+            middle = (low + high) // 2
+            low, high = (middle, high) if self.compensate(adc_t, middle)[1] > self.pressure else (low, middle)
+        adc_p = low
+        self.registers[0xF7:0xFD] = bytes([adc_p >> 12, (adc_p >> 4) & 0xFF, (adc_p & 0x0F) << 4,
+                                           adc_t >> 12, (adc_t >> 4) & 0xFF, (adc_t & 0x0F) << 4])
+
+
+class SimADXL345(SimRegisterDevice):
+
+    # Analog Devices ADXL345 accelerometer (Grove 3-Axis Digital
+    # Accelerometer, address 0x53), reporting in full resolution mode.
+    # Arguments:
+    # acceleration = (x, y, z) in g
+
+    def __init__(self, acceleration=(0.0, 0.0, 1.0)):
+        super().__init__()
+        self.acceleration = acceleration
+        self.registers[0x00] = 0xE5
+
+    def update(self):
+        if not self.registers[0x2D] & 0x08:
+            return                                  # standby
+        # 3.9 mg per count in full resolution mode
+        self.registers[0x32:0x38] = struct.pack("<hhh", *[round(a / 0.0039) for a in self.acceleration])
+
+
+class SimMPU6050(SimRegisterDevice):
+
+    # InvenSense MPU-6050 accelerometer and gyroscope (address 0x68) at
+    # the power on ranges of +-2 g and +-250 degrees per second.
+    # Arguments:
+    # acceleration = (x, y, z) in g
+    # rotation = (x, y, z) in degrees per second
+    # temperature = degrees C
+
+    def __init__(self, acceleration=(0.0, 0.0, 1.0), rotation=(0.0, 0.0, 0.0), temperature=25.0):
+        super().__init__()
+        self.acceleration = acceleration
+        self.rotation = rotation
+        self.temperature = temperature
+        self.registers[0x75] = 0x68
+        self.registers[0x6B] = 0x40                 # sleeping after power on
+
+    def update(self):
+        if self.registers[0x6B] & 0x40:
+            return
+        clamp = lambda value: max(-32768, min(32767, round(value)))
+        self.registers[0x3B:0x49] = struct.pack(
+            ">hhhhhhh", *[clamp(a * 16384) for a in self.acceleration],
+            clamp((self.temperature - 36.53) * 340), *[clamp(r * 131) for r in self.rotation])
+
+
+class SimSHT31(SimRegisterDevice):
+
+    # Sensirion SHT31 temperature and humidity sensor (Grove Temp&Humi
+    # Sensor SHT31, address 0x44).  It takes 16 bit commands instead of
+    # register addresses; a fetch before periodic measurement has been
+    # started is not acknowledged, as on the real part.
+    # Arguments:
+    # temperature = degrees C
+    # humidity = percent relative humidity
+
+    def __init__(self, temperature=21.0, humidity=45.0):
+        super().__init__()
+        self.temperature = temperature
+        self.humidity = humidity
+        self.command = None
+        self.periodic = False
+
+    @staticmethod
+    def crc(data):
+        crc = 0xFF
+        for byte in data:
+            crc ^= byte
+            for _ in range(8):
+                crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        return crc
+
+    def word(self, value):
+        data = struct.pack(">H", value)
+        return data + bytes([self.crc(data)])
+
+    def write(self, data):
+        self.check()
+        self.command = bytes(data[:2])
+        if self.command[:1] in (b"\x20", b"\x21", b"\x22", b"\x23", b"\x27"):
+            self.periodic = True
+        elif self.command == b"\x30\x93":
+            self.periodic = False
+
+    def read(self, count):
+        self.check()
+        self.reads += 1
+        if self.command == b"\xf3\x2d":
+            return self.word(0x8010 if self.periodic else 0x8000)[:count]
+        if self.command != b"\xe0\x00" or not self.periodic:
+            raise OSError(121, "Remote I/O error")
+        raw_t = max(0, min(65535, round((self.temperature + 45) * 65535 / 175)))
+        raw_h = max(0, min(65535, round(self.humidity * 65535 / 100)))
+        return (self.word(raw_t) + self.word(raw_h))[:count]
+
+
+class SimSSD1306:
+
+    # Stand-in for adafruit_ssd1306.SSD1306_I2C
+    # Keeps the same page organised buffer as the real driver (with the
+    # 0x40 data control byte at index 0) and pushes it over the simulated
+    # bus on show().
+
+    def __init__(self, width, height, i2c, addr=0x3C, external_vcc=False, reset=None):
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.addr = addr
+        self.i2c_device = SimI2CDevice(i2c, addr)
+        self.buffer = bytearray(self.pages * width + 1)
+        self.buffer[0] = 0x40
+        self.cmd = bytearray(2)
+        self.power = True
+        for cmd in (0xAE, 0x20, 0x00, 0x40, 0xA1, 0xA8, height - 1, 0xC8, 0xD3, 0x00,
+                    0xDA, 0x02 if height == 32 else 0x12, 0xD5, 0x80, 0xD9, 0xF1,
+                    0xDB, 0x30, 0x81, 0xFF, 0xA4, 0xA6, 0x8D, 0x14, 0xAF):
+            self.write_cmd(cmd)
+
+    def write_cmd(self, cmd):
+        self.cmd[0] = 0x80
+        self.cmd[1] = cmd
+        with self.i2c_device:
+            self.i2c_device.write(self.cmd)
+
+    def write_framebuf(self):
+        with self.i2c_device:
+            self.i2c_device.write(self.buffer)
+
+    def fill(self, color):
+        value = 0xFF if color else 0x00
+        for i in range(1, len(self.buffer)):
+            self.buffer[i] = value
+
+    def pixel(self, x, y, color=None):
+        index = 1 + (y // 8) * self.width + x
+        mask = 1 << (y & 7)
+        if color is None:
+            return 1 if self.buffer[index] & mask else 0
+        if color:
+            self.buffer[index] |= mask
+        else:
+            self.buffer[index] &= ~mask & 0xFF
+        return None
+
+    def image(self, img):
+        if img.mode != "1":
+            raise ValueError("Image must be in mode 1.")
+        if img.size != (self.width, self.height):
+            raise ValueError("Image must be same dimensions as display ({0}x{1})."
+                             .format(self.width, self.height))
+        pixels = img.load()
+        for i in range(1, len(self.buffer)):
+            self.buffer[i] = 0
+        for y in range(self.height):
+            for x in range(self.width):
+                if pixels[x, y]:
+                    self.buffer[1 + (y // 8) * self.width + x] |= 1 << (y & 7)
+
+    def show(self):
+        for cmd in (0x21, 0, self.width - 1, 0x22, 0, self.pages - 1):
+            self.write_cmd(cmd)
+        self.write_framebuf()
+
+    def poweroff(self):
+        self.write_cmd(0xAE)
+        self.power = False
+
+    def poweron(self):
+        self.write_cmd(0xAF)
+        self.power = True
+
+    def contrast(self, contrast):
+        self.write_cmd(0x81)
+        self.write_cmd(contrast)
+
+    def invert(self, invert):
+        self.write_cmd(0xA6 | (invert & 1))
+
+
+class SimPanel:
+
+    # Model of the SSD1306 controller RAM in horizontal addressing mode.
+    # Attach to a SimI2C at the display address to check what actually
+    # reaches the glass:  bus.attach(0x3C, SimPanel())
+
+    def __init__(self, width=128, height=64):
+        self.width = width
+        self.pages = height // 8
+        self.ram = bytearray(self.width * self.pages)
+        self.window = [0, width - 1, 0, self.pages - 1]
+        self.column = 0
+        self.page = 0
+        self.pending = []
+
+    def write(self, data):
+        if not data:
+            return
+        if data[0] == 0x40:
+            for value in data[1:]:
+                self.ram[self.page * self.width + self.column] = value
+                self.column += 1
+                if self.column > self.window[1]:
+                    self.column = self.window[0]
+                    self.page += 1
+                    if self.page > self.window[3]:
+                        self.page = self.window[2]
+            return
+        if data[0] == 0x00:
+            for cmd in data[1:]:
+                self.command(cmd)
+            return
+        for i in range(1, len(data), 2):
+            self.command(data[i])
+
+    def command(self, cmd):
+        self.pending.append(cmd)
+        op = self.pending[0]
+        if op in (0x21, 0x22):
+            if len(self.pending) < 3:
+                return
+            if op == 0x21:
+                self.window[0:2] = self.pending[1:3]
+                self.column = self.pending[1]
+            else:
+                self.window[2:4] = self.pending[1:3]
+                self.page = self.pending[1]
+        elif op in (0x20, 0x81, 0xA8, 0xD3, 0xDA, 0xD5, 0xD9, 0xDB, 0x8D) and len(self.pending) < 2:
+            return
+        self.pending = []
+
+    def read(self, count):
+        return bytes(count)
+
+
+class SimPixelStrip:
+
+    # Stand-in for rpi_ws281x.PixelStrip
+    # show() accounts for the time the real strip spends clocking out
+    # 24 bits per pixel at the configured frequency plus the latch time.
+
+    def __init__(self, num, pin, freq_hz=800000, dma=10, invert=False,
+                 brightness=255, channel=0, strip_type=None, gamma=None):
+        self.num = num
+        self.pin = pin
+        self.freq_hz = freq_hz
+        self.brightness = brightness
+        self.pixels = [0] * num
+        self.frames = 0
+        Simulator.strips.append(self)
+
+    def begin(self):
+        pass
+
+    def show(self):
+        self.frames += 1
+        if SimI2C.simulate_timing:
+            time.sleep(24.0 * self.num / self.freq_hz + 0.00005)
+
+    def setPixelColor(self, n, color):
+        self.pixels[n] = color
+
+    def setPixelColorRGB(self, n, red, green, blue, white=0):
+        self.pixels[n] = Color(red, green, blue, white)
+
+    def getPixelColor(self, n):
+        return self.pixels[n]
+
+    def setBrightness(self, brightness):
+        self.brightness = brightness
+
+    def getBrightness(self):
+        return self.brightness
+
+    def numPixels(self):
+        return self.num
+
+
+def make_pwm_sysfs(root, chips=1, channels=2):
+
+    # Builds a fake /sys/class/pwm tree under root for micropi.SysfsPWM.
+    # The channels are created already exported, since plain files cannot
+    # make new directories appear when "export" is written.  Returns root;
+    # pass it as SysfsPWM.root (or the root argument) and read the period,
+    # duty_cycle and enable files to check what was programmed.
+    # Arguments:
+    # root = directory to create the tree in
+    # chips = number of pwmchipN entries
+    # channels = channels per chip
+
+    for chip in range(chips):
+        chipdir = os.path.join(root, "pwmchip%d" % chip)
+        os.makedirs(chipdir, exist_ok=True)
+        for name, value in (("npwm", channels), ("export", ""), ("unexport", "")):
+            with open(os.path.join(chipdir, name), "w") as f:
+                f.write(str(value))
+        for channel in range(channels):
+            path = os.path.join(chipdir, "pwm%d" % channel)
+            os.makedirs(path, exist_ok=True)
+            for name, value in (("period", 0), ("duty_cycle", 0), ("enable", 0),
+                                ("polarity", "normal")):
+                with open(os.path.join(path, name), "w") as f:
+                    f.write(str(value))
+    return root
+
+
+class SimulationOver(BaseException):
+
+    # Raised out of the controller's sleep or device call when the
+    # simulated run time is used up.  It derives from BaseException so a
+    # controller's "except Exception" does not swallow it.
+
+    pass
+
+
+class VirtualClock:
+
+    # Simulated time for the controlling thread.
+    # sleep() moves time forward and returns at once, stepping the world in
+    # fixed increments on the way.  Other threads see the virtual time but
+    # sleep in real time, so background workers cannot run the clock.
+    # Arguments:
+    # step = world integration step in seconds
+    # limit = virtual seconds after which SimulationOver is raised
+
+    def __init__(self, step=0.002, limit=None):
+        self.t = 0.0
+        self.epoch = time.time()
+        self.step = step
+        self.limit = limit
+        self.pending = 0.0
+        self.listeners = []
+        self.owner = threading.get_ident()
+        self.lock = threading.RLock()
+
+    def advance(self, dt):
+        if threading.get_ident() != self.owner:
+            return
+        with self.lock:
+            self.t += dt
+            self.pending += dt
+            while self.pending >= self.step:
+                self.pending -= self.step
+                for listener in self.listeners:
+                    listener(self.step)
+            if self.limit is not None and self.t >= self.limit:
+                raise SimulationOver()
+
+    def sleep(self, seconds):
+        if threading.get_ident() != self.owner:
+            _real_sleep(seconds)
+        elif seconds > 0:
+            # a real sleep always takes a little while; this also keeps
+            # sleeps too short to change the float time from stalling
+            self.advance(max(seconds, 0.000001))
+
+    def time(self):
+        return self.epoch + self.t
+
+    def monotonic(self):
+        return self.t
+
+    def perf_counter(self):
+        return self.t
+
+
+class World:
+
+    # 2D model of a two wheeled MicroPi robot in an arena.
+    # The wheel speeds follow the Motor pins and PWM duty cycles, the pose
+    # is integrated as a differential drive, and the ultrasonic sensor, the
+    # IR line sensors and the buttons are answered from the arena map.
+    # Map (a dict or a JSON file; lengths in cm, angles in degrees):
+    #   {"walls": [[x1, y1, x2, y2], ...],      obstacle segments
+    #    "lines": [[[x, y], [x, y], ...], ...],   dark tape polylines
+    #    "line_width": 2.0,
+    #    "start": [x, y, heading]}
+    # Arguments:
+    # arena = map dict or JSON file
+    # left, right = motors driving each wheel (MOTOR1 left, MOTOR2 right
+    #               as in the Sensor_Board examples)
+    # max_speed = wheel speed in cm/s at 100% duty
+    # wheelbase = distance between the wheels in cm
+    # radius = robot radius in cm, used for collisions and the sonar origin
+    # io_cost = virtual seconds charged for each GPIO call, standing in for
+    #           the time the call would take on the Pi
+    # step = integration step in seconds
+    # limit = virtual run time in seconds (None runs until stopped)
+
+    # MotorShield pins, as in micropi.Motor.motorpins
+    motorpins = {"MOTOR4": {"e": 12, "f": 8, "r": 7},
+                 "MOTOR3": {"e": 21, "f": 9, "r": 11},
+                 "MOTOR2": {"e": 25, "f": 24, "r": 23},
+                 "MOTOR1": {"e": 17, "f": 27, "r": 22}}
+    trigger = 5
+    echo = 6
+    ir_pins = (4, 18)
+    button_pins = (26, 19)
+    # IR sensor positions (forward, left) in cm from the robot centre
+    ir_offsets = ((6.0, 3.0), (6.0, -3.0))
+    sonar_range = 400.0
+
+    def __init__(self, arena, left=("MOTOR1",), right=("MOTOR2",), max_speed=30.0, wheelbase=12.0,
+                 radius=8.0, io_cost=0.00005, step=0.002, limit=None):
+        if isinstance(arena, str):
+            with open(arena) as f:
+                arena = json.load(f)
+        self.walls = [tuple(wall) for wall in arena.get("walls", [])]
+        self.lines = [[tuple(point) for point in line] for line in arena.get("lines", [])]
+        self.line_width = arena.get("line_width", 2.0)
+        self.tape = self.rasterise(0.5)
+        x, y, heading = arena.get("start", (0.0, 0.0, 0.0))
+        self.x, self.y, self.heading = float(x), float(y), math.radians(heading)
+        self.left = [self.motorpins[name] for name in left]
+        self.right = [self.motorpins[name] for name in right]
+        self.max_speed = max_speed
+        self.wheelbase = wheelbase
+        self.radius = radius
+        self.io_cost = io_cost
+        self.clock = VirtualClock(step, limit)
+        self.clock.listeners.append(self.step)
+        self.gpio = None
+        self.presses = []
+        self.distance = 0.0
+        self.collisions = 0
+        self.touching = False
+        self.line_time = 0.0
+
+    def attach(self, sim):
+
+        # Connects the world to the simulated pins and makes the virtual
+        # clock the time base of the simulated devices
+
+        self.gpio = sim.gpio
+        use_clock(self.clock)
+        self.gpio.io_hook = self.charge
+        self.gpio.attach_ultrasonic(self.trigger, self.echo, self.sonar)
+        for pin, offset in zip(self.ir_pins, self.ir_offsets):
+            self.gpio.set_source(pin, lambda t, offset=offset: self.on_line(*self.point(*offset)))
+        return self
+
+    def charge(self):
+        self.clock.advance(self.io_cost)
+
+    def press(self, button, at, duration=0.2):
+
+        # Schedules a button press
+        # Arguments:
+        # button = 1 or 2
+        # at = virtual time in seconds
+        # duration = how long the button is held
+
+        pin = self.button_pins[button - 1]
+        self.presses += [(at, pin, 1), (at + duration, pin, 0)]
+        self.presses.sort()
+
+    # ---- motion ----
+
+    def duty(self, motor):
+        pwm = None
+        for candidate in self.gpio.pwms:
+            if candidate.pin == motor["e"] and candidate.running:
+                pwm = candidate
+        duty = pwm.duty if pwm is not None else 100.0 * self.gpio.levels.get(motor["e"], 0)
+        direction = self.gpio.levels.get(motor["f"], 0) - self.gpio.levels.get(motor["r"], 0)
+        return direction * duty / 100.0
+
+    def wheel(self, motors):
+        return self.max_speed * sum(self.duty(motor) for motor in motors) / len(motors)
+
+    def step(self, dt):
+        while self.presses and self.presses[0][0] <= self.clock.t:
+            at, pin, level = self.presses.pop(0)
+            self.gpio.set_input(pin, level)
+        left = self.wheel(self.left)
+        right = self.wheel(self.right)
+        if left or right:
+            self.move(left, right, dt)
+        if self.on_line(self.x, self.y):
+            self.line_time += dt
+
+    def move(self, left, right, dt):
+        speed = (left + right) / 2.0
+        self.heading += (right - left) / self.wheelbase * dt
+        x = self.x + speed * math.cos(self.heading) * dt
+        y = self.y + speed * math.sin(self.heading) * dt
+        if self.clear(x, y):
+            self.distance += math.hypot(x - self.x, y - self.y)
+            self.x, self.y = x, y
+            self.touching = False
+        elif speed:
+            if not self.touching:
+                self.collisions += 1
+            self.touching = True
+
+    def clear(self, x, y):
+        r = self.radius
+        for x1, y1, x2, y2 in self.walls:
+            if (min(x1, x2) - r < x < max(x1, x2) + r and min(y1, y2) - r < y < max(y1, y2) + r
+                    and segment_distance(x, y, x1, y1, x2, y2) < r):
+                return False
+        return True
+
+    # ---- sensors ----
+
+    def point(self, forward, left):
+        c, s = math.cos(self.heading), math.sin(self.heading)
+        return self.x + forward * c - left * s, self.y + forward * s + left * c
+
+    def sonar(self):
+
+        # Distance in cm from the front of the robot to the nearest wall
+        # straight ahead
+
+        return max(2.0, self.ray(self.heading) - self.radius)
+
+    def scan(self, bearings, noise=0.0):
+
+        # Distances in cm from the robot centre to the nearest wall at each
+        # bearing (degrees relative to the heading, positive to the left),
+        # for feeding a micropi.SonarMap; None where nothing is in range
+        # Arguments:
+        # noise = standard deviation of the added range noise in cm
+
+        import random
+        ranges = []
+        for bearing in bearings:
+            distance = self.ray(self.heading + math.radians(bearing))
+            if distance >= self.sonar_range:
+                ranges.append(None)
+            else:
+                ranges.append(distance + random.gauss(0.0, noise) if noise else distance)
+        return ranges
+
+    def ray(self, angle):
+        dx, dy = math.cos(angle), math.sin(angle)
+        nearest = self.sonar_range
+        for x1, y1, x2, y2 in self.walls:
+            ex, ey = x2 - x1, y2 - y1
+            denominator = dx * ey - dy * ex
+            if abs(denominator) < 1e-12:
+                continue
+            t = ((x1 - self.x) * ey - (y1 - self.y) * ex) / denominator
+            u = ((x1 - self.x) * dy - (y1 - self.y) * dx) / denominator
+            if t > 0 and 0 <= u <= 1:
+                nearest = min(nearest, t)
+        return nearest
+
+    def rasterise(self, cell):
+
+        # Marks the grid cells covered by tape once, so the IR sensors,
+        # which are read in tight loops, only need a set lookup
+
+        self.cell = cell
+        half = self.line_width / 2.0
+        tape = set()
+        for line in self.lines:
+            for (x1, y1), (x2, y2) in zip(line, line[1:]):
+                for i in range(int(math.floor((min(x1, x2) - half) / cell)), int(math.ceil((max(x1, x2) + half) / cell)) + 1):
+                    for j in range(int(math.floor((min(y1, y2) - half) / cell)), int(math.ceil((max(y1, y2) + half) / cell)) + 1):
+                        if segment_distance((i + 0.5) * cell, (j + 0.5) * cell, x1, y1, x2, y2) <= half:
+                            tape.add((i, j))
+        return tape
+
+    def on_line(self, x, y):
+        return 1 if (int(math.floor(x / self.cell)), int(math.floor(y / self.cell))) in self.tape else 0
+
+    def result(self):
+        t = self.clock.t
+        return {"time": t, "x": self.x, "y": self.y, "heading": math.degrees(self.heading) % 360,
+                "distance": self.distance, "collisions": self.collisions,
+                "line_fraction": self.line_time / t if t else 0.0}
+
+
+def segment_distance(px, py, x1, y1, x2, y2):
+    ex, ey = x2 - x1, y2 - y1
+    length = ex * ex + ey * ey
+    t = 0.0 if length == 0 else max(0.0, min(1.0, ((px - x1) * ex + (py - y1) * ey) / length))
+    return math.hypot(px - x1 - t * ex, py - y1 - t * ey)
+
+
+def simulate(target, arena, duration=60.0, params=None, quiet=True, presses=(), **robot):
+
+    # Runs a controller against a World on the virtual clock and returns
+    # World.result().  Must run in a fresh process: it installs the
+    # simulated hardware and imports micropi.  time.sleep/time/monotonic/
+    # perf_counter are switched to the virtual clock for the run, so
+    # unmodified controller scripts run faster than real time.
+    # Arguments:
+    # target = controller function taking params, or a script path (the
+    #          script sees the parameters as the global PARAMS)
+    # arena = map dict or JSON file
+    # duration = virtual seconds to run for
+    # params = dict of controller parameters
+    # quiet = discard the controller's printing
+    # presses = (button, at, duration) button presses to schedule
+    # robot = further World arguments
+
+    import contextlib
+    import io
+    import runpy
+    sim = install()
+    world = World(arena, limit=duration, **robot).attach(sim)
+    for press in presses:
+        world.press(*press)
+    import micropi
+    micropi.clock.use(world.clock)
+    saved = (time.sleep, time.time, time.monotonic, time.perf_counter)
+    time.sleep, time.time = world.clock.sleep, world.clock.time
+    time.monotonic, time.perf_counter = world.clock.monotonic, world.clock.perf_counter
+    started = saved[3]()
+    output = io.StringIO() if quiet else sys.stdout
+    try:
+        with contextlib.redirect_stdout(output):
+            if callable(target):
+                target(params or {})
+            else:
+                runpy.run_path(target, init_globals={"PARAMS": params or {}}, run_name="__main__")
+    except SimulationOver:
+        pass
+    finally:
+        time.sleep, time.time, time.monotonic, time.perf_counter = saved
+        micropi.clock.use(None)
+    result = world.result()
+    result["speedup"] = result["time"] / max(1e-9, time.perf_counter() - started)
+    return result
+
+
+def batch(target, arena, param_sets, duration=60.0, processes=None, **options):
+
+    # Evaluates a controller for each parameter set in parallel, one fresh
+    # process per run, and returns [(params, result), ...]
+    # Arguments:
+    # target = module level controller function or script path
+    # arena = map dict or JSON file
+    # param_sets = list of parameter dicts
+    # duration = virtual seconds per run
+    # processes = worker processes (defaults to the CPU count)
+
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes, maxtasksperchild=1) as pool:
+        runs = [pool.apply_async(simulate, (target, arena, duration, params), options)
+                for params in param_sets]
+        return [(params, run.get()) for params, run in zip(param_sets, runs)]
+
+
+class GpiodValue(Enum):
+    INACTIVE = 0
+    ACTIVE = 1
+
+    def __bool__(self):
+        return self == GpiodValue.ACTIVE
+
+
+GpiodDirection = Enum("Direction", "AS_IS INPUT OUTPUT")
+GpiodBias = Enum("Bias", "AS_IS UNKNOWN DISABLED PULL_UP PULL_DOWN")
+GpiodDrive = Enum("Drive", "PUSH_PULL OPEN_DRAIN OPEN_SOURCE")
+GpiodEdge = Enum("Edge", "NONE RISING FALLING BOTH")
+GpiodClock = Enum("Clock", "MONOTONIC REALTIME HTE")
+
+
+@dataclass
+class GpiodLineSettings:
+
+    # Stand-in for gpiod.LineSettings (libgpiod v2)
+
+    direction: GpiodDirection = GpiodDirection.AS_IS
+    edge_detection: GpiodEdge = GpiodEdge.NONE
+    bias: GpiodBias = GpiodBias.AS_IS
+    drive: GpiodDrive = GpiodDrive.PUSH_PULL
+    active_low: bool = False
+    debounce_period: timedelta = field(default_factory=timedelta)
+    event_clock: GpiodClock = GpiodClock.MONOTONIC
+    output_value: GpiodValue = GpiodValue.INACTIVE
+
+
+class GpiodEdgeEvent:
+
+    # Stand-in for gpiod.EdgeEvent
+
+    Type = Enum("Type", "RISING_EDGE FALLING_EDGE")
+
+    def __init__(self, event_type, timestamp_ns, line_offset, global_seqno, line_seqno):
+        self.event_type = event_type
+        self.timestamp_ns = timestamp_ns
+        self.line_offset = line_offset
+        self.global_seqno = global_seqno
+        self.line_seqno = line_seqno
+
+
+class GpiodRequestReleasedError(Exception):
+    pass
+
+
+class SimLineRequest:
+
+    # Stand-in for gpiod.LineRequest on a mock chip backed by SimGPIO.
+    # Counts set_values calls so tests can check lines change together,
+    # and delivers the edges SimGPIO logs on lines with edge detection.
+    # The hardware timestamp clock is refused, as on a Pi.
+
+    def __init__(self, gpio, config):
+        self.gpio = gpio
+        self.settings = {}
+        self.released = False
+        self.set_calls = 0
+        self.sequence = 0
+        self.apply(config)
+
+    def apply(self, config):
+        for lines, settings in config.items():
+            for line in (lines if isinstance(lines, (list, tuple)) else [lines]):
+                settings = settings or GpiodLineSettings()
+                if settings.event_clock == GpiodClock.HTE:
+                    raise OSError(95, "hardware timestamps are not supported")
+                self.settings[line] = settings
+                if settings.direction == GpiodDirection.OUTPUT:
+                    self.gpio.setup(line, self.gpio.OUT, initial=bool(settings.output_value))
+                elif settings.direction == GpiodDirection.INPUT:
+                    pull = {GpiodBias.PULL_UP: self.gpio.PUD_UP,
+                            GpiodBias.PULL_DOWN: self.gpio.PUD_DOWN}.get(settings.bias)
+                    self.gpio.setup(line, self.gpio.IN, pull_up_down=pull)
+
+    def check(self):
+        if self.released:
+            raise GpiodRequestReleasedError("request has been released")
+
+    @property
+    def offsets(self):
+        return list(self.settings)
+
+    def reconfigure_lines(self, config):
+        self.check()
+        self.apply(config)
+
+    def set_values(self, values):
+        self.check()
+        self.set_calls += 1
+        pins = list(values)
+        self.gpio.output(pins, [1 if values[pin] else 0 for pin in pins])
+
+    def set_value(self, line, value):
+        self.set_values({line: value})
+
+    def get_value(self, line):
+        self.check()
+        return GpiodValue.ACTIVE if self.gpio.input(line) else GpiodValue.INACTIVE
+
+    def get_values(self, lines=None):
+        return [self.get_value(line) for line in (lines or self.offsets)]
+
+    def watched(self):
+        return [line for line, settings in self.settings.items()
+                if settings.edge_detection != GpiodEdge.NONE]
+
+    def due(self):
+        t = now()
+        return [line for line in self.watched()
+                if self.gpio.edge_log.get(line) and self.gpio.edge_log[line][0][0] <= t]
+
+    def wait_edge_events(self, timeout=None):
+        self.check()
+        deadline = None if timeout is None else now() + timeout
+        while not self.due():
+            if deadline is not None and now() >= deadline:
+                return False
+            time.sleep(0.0002)
+        return True
+
+    def read_edge_events(self, max_events=None):
+        self.check()
+        t = now()
+        events = []
+        for line in self.watched():
+            log = self.gpio.edge_log.get(line)
+            while log and log[0][0] <= t:
+                when, level = log.popleft()
+                edge = self.settings[line].edge_detection
+                if (edge == GpiodEdge.RISING and not level) or (edge == GpiodEdge.FALLING and level):
+                    continue
+                self.sequence += 1
+                kind = GpiodEdgeEvent.Type.RISING_EDGE if level else GpiodEdgeEvent.Type.FALLING_EDGE
+                events.append(GpiodEdgeEvent(kind, int(when * 1e9), line, self.sequence, self.sequence))
+        events.sort(key=lambda event: event.timestamp_ns)
+        return events[:max_events] if max_events else events
+
+    def release(self):
+        self.released = True
+
+
+def Color(red, green, blue, white=0):
+    return (white << 24) | (red << 16) | (green << 8) | blue
+
+
+class Simulator:
+
+    # Handle on the installed simulated hardware.
+    # gpio = the SimGPIO instance standing in for RPi.GPIO
+    # buses = every SimI2C created since install
+    # strips = every SimPixelStrip created since install
+
+    buses = []
+    strips = []
+    requests = []
+
+    def __init__(self):
+        self.gpio = SimGPIO()
+
+    def bus(self):
+        # Returns the first I2C bus created (the one micropi opens on import)
+        return self.buses[0] if self.buses else None
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+
+    # Registers the simulated modules in sys.modules.
+    # Must be called before micropi (or anything else using the hardware
+    # libraries) is imported.  Returns the Simulator handle.
+
+    sim = Simulator()
+    gpio = sim.gpio
+    gpio_module = _module("RPi.GPIO")
+    for name in dir(gpio):
+        if not name.startswith("_"):
+            setattr(gpio_module, name, getattr(gpio, name))
+    gpio_module.sim = gpio
+    _module("RPi", GPIO=gpio_module)
+    _module("rpi_ws281x", PixelStrip=SimPixelStrip, Adafruit_NeoPixel=SimPixelStrip,
+            Color=Color)
+    _module("board", SCL=3, SDA=2)
+    _module("busio", I2C=SimI2C)
+    _module("smbus", SMBus=SimSMBus)
+    i2c_device = _module("adafruit_bus_device.i2c_device", I2CDevice=SimI2CDevice)
+    _module("adafruit_bus_device", i2c_device=i2c_device)
+    _module("adafruit_ssd1306", SSD1306_I2C=SimSSD1306)
+    return sim
+
+
+def install_gpiod(sim):
+
+    # Registers a mock libgpiod v2 "gpiod" module whose line requests drive
+    # the simulator's pins.  Every request made is kept in sim.requests.
+    # Arguments:
+    # sim = Simulator returned by install()
+
+    def request_lines(path, consumer=None, config=None):
+        request = SimLineRequest(sim.gpio, config or {})
+        sim.requests.append(request)
+        return request
+
+    sim.gpio.log_edges = True
+    line = _module("gpiod.line", Value=GpiodValue, Direction=GpiodDirection, Bias=GpiodBias,
+                   Drive=GpiodDrive, Edge=GpiodEdge, Clock=GpiodClock)
+    _module("gpiod", line=line, LineSettings=GpiodLineSettings, EdgeEvent=GpiodEdgeEvent,
+            LineRequest=SimLineRequest, RequestReleasedError=GpiodRequestReleasedError,
+            request_lines=request_lines)
+    return sim
+
+
+# ---------------Main------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a MicroPi controller script in a simulated arena")
+    parser.add_argument("script", nargs="?", help="controller script")
+    parser.add_argument("--world", help="arena map (JSON)")
+    parser.add_argument("--duration", type=float, default=60.0, help="virtual seconds to run")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="controller parameter, available to the script as PARAMS[NAME]")
+    parser.add_argument("--verbose", action="store_true", help="show the controller's output")
+    args = parser.parse_args()
+    if args.script is None or args.world is None:
+        print("Simulated hardware backend for the microPi's library")
+    else:
+        params = {}
+        for item in args.param:
+            name, value = item.split("=", 1)
+            params[name] = json.loads(value)
+        print(json.dumps(simulate(os.path.abspath(args.script), args.world, args.duration, params,
+                                  quiet=not args.verbose), indent=1))
@@ -0,0 +1,642 @@
+#!/usr/bin/python
+
+# Device daemon and client for MicroPi V2.1
+# Developed by: SB Components & Hypersmart Ltd
+# Project: MicroPi
+#
+# micropid owns the board peripherals on behalf of every script running on
+# the Pi.  GPIO setup and the I2C bus are initialised once, in the daemon,
+# and other processes talk to it over a Unix domain socket using a compact
+# binary protocol.
+#
+# Start the daemon (once, usually at boot, as root):
+#   python3 micropid.py --group gpio
+#
+# The socket is created in /run/micropid, readable and writable only by
+# the daemon's user and the given group, so only members of that group
+# can drive the motors.  Use --socket (or $MICROPID_SOCKET in the
+# clients) to put it elsewhere, e.g. when running unprivileged.
+#
+# Then use the client classes in place of the ones from micropi:
+#   from micropid import Motor, LinkedMotors, OLED, LED, Sensor
+#
+# Wire format: every message is a 5 byte header followed by the payload
+#   uint16 payload length, uint8 opcode, uint16 request id (little endian)
+# Replies carry the request id of the request they answer.  EVENT messages
+# pushed by sensor subscriptions carry request id 0.
+
+import argparse
+import grp
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+SOCKET_PATH = os.environ.get("MICROPID_SOCKET", "/run/micropid/micropid.sock")
+
+HEADER = struct.Struct("<HBH")
+
+# Requests
+OP_OPEN = 1
+OP_MOTOR_FORWARD = 2
+OP_MOTOR_REVERSE = 3
+OP_MOTOR_STOP = 4
+OP_OLED_PRINT = 5
+OP_OLED_STATS = 6
+OP_OLED_IMG = 7
+OP_LED_SET = 8
+OP_SENSOR_READ = 9
+OP_SUBSCRIBE = 10
+OP_UNSUBSCRIBE = 11
+OP_PING = 12
+
+# Replies
+OP_OK = 128
+OP_ERROR = 129
+OP_EVENT = 130
+
+# Device kinds for OP_OPEN
+KIND_MOTOR = 1
+KIND_OLED = 2
+KIND_LED = 3
+KIND_SENSOR = 4
+
+OPEN = struct.Struct("<B")
+HANDLE = struct.Struct("<B")
+MOTOR = struct.Struct("<Bf")
+OLED_LINE = struct.Struct("<BB")
+LED_COLOR = struct.Struct("<BBBBB")
+READING = struct.Struct("<Bf")
+SUBSCRIBE = struct.Struct("<BH")
+EVENT = struct.Struct("<BBfd")
+
+# READING / EVENT state of an ultrasonic sensor whose ping got no echo
+NO_ECHO = 255
+
+# Shortest subscription period, in seconds
+MIN_PERIOD = 0.01
+
+# Seconds to leave between ultrasonic pings so old echoes have died away
+PING_GAP = 0.06
+
+
+class DaemonError(Exception):
+
+    # Raised on the client when micropid rejects a request
+
+    pass
+
+
+def recv_exact(sock, view):
+
+    # Fills the memoryview from the socket.
+    # Returns False if the peer closed the connection.
+
+    while len(view):
+        count = sock.recv_into(view)
+        if count == 0:
+            return False
+        view = view[count:]
+    return True
+
+
+def send_message(sock, lock, op, request, payload=b""):
+    message = HEADER.pack(len(payload), op, request) + payload
+    with lock:
+        sock.sendall(message)
+
+
+# ---------------Daemon------------
+
+class Connection:
+
+    # One connected client process
+
+    def __init__(self, daemon, sock):
+        self.daemon = daemon
+        self.sock = sock
+        self.send_lock = threading.Lock()
+        self.alive = True
+
+    def send(self, op, request, payload=b""):
+        try:
+            send_message(self.sock, self.send_lock, op, request, payload)
+        except OSError:
+            self.alive = False
+
+    def serve(self):
+        header = bytearray(HEADER.size)
+        payload = bytearray(65535)
+        try:
+            while self.alive:
+                if not recv_exact(self.sock, memoryview(header)):
+                    break
+                length, op, request = HEADER.unpack(header)
+                view = memoryview(payload)[:length]
+                if not recv_exact(self.sock, view):
+                    break
+                try:
+                    reply = self.daemon.handle(self, op, bytes(view))
+                except Exception as error:
+                    self.send(OP_ERROR, request, str(error).encode("utf-8"))
+                else:
+                    self.send(OP_OK, request, reply or b"")
+        except OSError:
+            pass
+        finally:
+            self.alive = False
+            self.daemon.disconnect(self)
+            self.sock.close()
+
+
+class Subscription:
+
+    # Samples one sensor on its own thread and streams the readings to
+    # every subscribed connection at the fastest requested period
+    # Arguments:
+    # daemon = owning Daemon
+    # handle = sensor handle
+
+    def __init__(self, daemon, handle):
+        self.daemon = daemon
+        self.handle = handle
+        self.periods = {}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while True:
+            with self.daemon.subscribe_lock:
+                if not self.periods:
+                    self.daemon.subscriptions.pop(self.handle, None)
+                    return
+                period = min(self.periods.values())
+                connections = list(self.periods)
+            start = time.monotonic()
+            state, reading = self.daemon.read_sensor(self.handle)
+            # only fresh readings are streamed
+            if state != NO_ECHO:
+                payload = EVENT.pack(self.handle, state, reading, time.time())
+                for connection in connections:
+                    connection.send(OP_EVENT, 0, payload)
+                    if not connection.alive:
+                        with self.daemon.subscribe_lock:
+                            self.periods.pop(connection, None)
+            delay = period - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+
+class Daemon:
+
+    # Owns every peripheral and executes client requests.
+    # Devices are created on first use and shared by all clients.  Each
+    # device has its own lock and all I2C traffic goes through a single
+    # bus lock so requests from different processes never interleave.
+
+    # Arguments:
+    # path = socket path
+    # group = name of the group allowed to connect, defaults to the
+    # daemon's own group
+
+    def __init__(self, path=SOCKET_PATH, group=None):
+        import micropi
+        self.micropi = micropi
+        self.path = path
+        self.group = group
+        self.devices = []
+        self.names = {}
+        self.locks = []
+        self.i2c_lock = threading.Lock()
+        self.open_lock = threading.Lock()
+        self.pinged = {}
+        self.subscriptions = {}
+        self.subscribe_lock = threading.Lock()
+        self.connections = []
+
+    def claim_socket(self):
+
+        # Removes a socket left behind by a daemon that is gone.  Refuses
+        # to start if a daemon still answers on it.
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except FileNotFoundError:
+            return
+        except ConnectionRefusedError:
+            os.unlink(self.path)
+            return
+        finally:
+            probe.close()
+        raise RuntimeError("micropid is already running on %s" % self.path)
+
+    def serve_forever(self):
+        directory = os.path.dirname(self.path)
+        gid = grp.getgrnam(self.group).gr_gid if self.group else -1
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o750)
+            os.chown(directory, -1, gid)
+        self.claim_socket()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # never let the socket exist with wider permissions, even briefly
+        umask = os.umask(0o117)
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(umask)
+        os.chown(self.path, -1, gid)
+        os.chmod(self.path, 0o660)
+        server.listen(16)
+        print("micropid listening on", self.path)
+        try:
+            while True:
+                sock, _ = server.accept()
+                connection = Connection(self, sock)
+                self.connections.append(connection)
+                threading.Thread(target=connection.serve, daemon=True).start()
+        finally:
+            server.close()
+            os.unlink(self.path)
+
+    def disconnect(self, connection):
+        if connection in self.connections:
+            self.connections.remove(connection)
+        with self.subscribe_lock:
+            for subscription in self.subscriptions.values():
+                subscription.periods.pop(connection, None)
+
+    def open(self, kind, name):
+        key = (kind, name)
+        with self.open_lock:
+            if key in self.names:
+                return self.names[key]
+            if len(self.devices) > 255:
+                raise ValueError("too many devices")
+            if kind == KIND_MOTOR:
+                device = self.micropi.Motor(name)
+            elif kind == KIND_OLED:
+                device = self.micropi.OLED()
+            elif kind == KIND_LED:
+                device = self.micropi.LED()
+            elif kind == KIND_SENSOR:
+                device = self.micropi.Sensor(name, 0)
+            else:
+                raise ValueError("unknown device kind %d" % kind)
+            self.devices.append(device)
+            self.locks.append(self.i2c_lock if kind == KIND_OLED else threading.Lock())
+            handle = len(self.devices) - 1
+            self.names[key] = handle
+            return handle
+
+    def read_sensor(self, handle):
+
+        # Returns (state, reading).  An ultrasonic sensor is pinged once,
+        # no sooner than PING_GAP after its last ping, and gives
+        # (NO_ECHO, nan) when no echo comes back.
+
+        sensor = self.devices[handle]
+        with self.locks[handle]:
+            if "trigger" in sensor.config:
+                wait = self.pinged.get(handle, 0.0) + PING_GAP - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                distance = sensor.ping()
+                self.pinged[handle] = time.monotonic()
+                if distance is None:
+                    return NO_ECHO, float("nan")
+                sensor.lastRead = distance
+                return 0, distance
+            state = self.micropi.GPIO.input(sensor.config["echo"])
+            return state, float(state)
+
+    def handle(self, connection, op, payload):
+        if op == OP_PING:
+            return b""
+        if op == OP_OPEN:
+            kind, = OPEN.unpack_from(payload)
+            name = payload[OPEN.size:].decode("utf-8")
+            return HANDLE.pack(self.open(kind, name))
+        if op in (OP_MOTOR_FORWARD, OP_MOTOR_REVERSE, OP_MOTOR_STOP):
+            handle, speed = MOTOR.unpack(payload)
+            motor = self.devices[handle]
+            with self.locks[handle]:
+                if op == OP_MOTOR_FORWARD:
+                    motor.forward(speed)
+                elif op == OP_MOTOR_REVERSE:
+                    motor.reverse(speed)
+                else:
+                    motor.stop()
+            return None
+        if op == OP_LED_SET:
+            handle, led, red, green, blue = LED_COLOR.unpack(payload)
+            with self.locks[handle]:
+                self.devices[handle].set_color(led, red, green, blue)
+            return None
+        if op == OP_OLED_PRINT:
+            handle, line = OLED_LINE.unpack_from(payload)
+            text = payload[OLED_LINE.size:].decode("utf-8")
+            with self.locks[handle]:
+                self.devices[handle].print(line, text)
+            return None
+        if op in (OP_OLED_STATS, OP_OLED_IMG):
+            handle, = HANDLE.unpack(payload)
+            with self.locks[handle]:
+                if op == OP_OLED_STATS:
+                    self.devices[handle].stats()
+                else:
+                    self.devices[handle].img()
+            return None
+        if op == OP_SENSOR_READ:
+            handle, = HANDLE.unpack(payload)
+            return READING.pack(*self.read_sensor(handle))
+        if op == OP_SUBSCRIBE:
+            handle, period = SUBSCRIBE.unpack(payload)
+            with self.subscribe_lock:
+                subscription = self.subscriptions.get(handle)
+                if subscription is None:
+                    subscription = Subscription(self, handle)
+                    self.subscriptions[handle] = subscription
+                    subscription.thread.start()
+                subscription.periods[connection] = max(period / 1000.0, MIN_PERIOD)
+            return None
+        if op == OP_UNSUBSCRIBE:
+            handle, = HANDLE.unpack(payload)
+            with self.subscribe_lock:
+                subscription = self.subscriptions.get(handle)
+                if subscription is not None:
+                    subscription.periods.pop(connection, None)
+            return None
+        raise ValueError("unknown opcode %d" % op)
+
+
+# ---------------Client------------
+
+class Client:
+
+    # Connection from this process to micropid.
+    # A reader thread matches replies to waiting requests and queues
+    # subscription events; a separate dispatcher thread runs their
+    # callbacks, so a callback can make requests of its own (stop a motor,
+    # read another sensor) without waiting on the thread that has to read
+    # the reply.
+    # Arguments:
+    # path = daemon socket path
+
+    def __init__(self, path=SOCKET_PATH):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.listeners = {}
+        self.next_request = 0
+        self.events = queue.Queue()
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def request(self, op, payload=b""):
+
+        # Sends a request and blocks until its reply arrives.
+        # Returns the reply payload or raises DaemonError.
+
+        waiter = [threading.Event(), None, None]
+        with self.pending_lock:
+            self.next_request = self.next_request % 65535 + 1
+            request = self.next_request
+            self.pending[request] = waiter
+        send_message(self.sock, self.send_lock, op, request, payload)
+        waiter[0].wait()
+        if waiter[1] == OP_ERROR:
+            raise DaemonError(waiter[2].decode("utf-8"))
+        if waiter[1] is None:
+            raise DaemonError("connection to micropid lost")
+        return waiter[2]
+
+    def read_loop(self):
+        header = bytearray(HEADER.size)
+        try:
+            while True:
+                if not recv_exact(self.sock, memoryview(header)):
+                    break
+                length, op, request = HEADER.unpack(header)
+                payload = bytearray(length)
+                if not recv_exact(self.sock, memoryview(payload)):
+                    break
+                if op == OP_EVENT:
+                    self.events.put(EVENT.unpack(payload))
+                    continue
+                with self.pending_lock:
+                    waiter = self.pending.pop(request, None)
+                if waiter is not None:
+                    waiter[1] = op
+                    waiter[2] = bytes(payload)
+                    waiter[0].set()
+        except OSError:
+            pass
+        with self.pending_lock:
+            for waiter in self.pending.values():
+                waiter[0].set()
+            self.pending.clear()
+        self.events.put(None)
+
+    def dispatch(self):
+
+        # Runs the subscription callbacks, in the order the events came
+
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            handle, state, reading, stamp = event
+            callback = self.listeners.get(handle)
+            if callback is not None:
+                try:
+                    callback(state, reading, stamp)
+                except Exception as error:
+                    print("micropid subscription callback failed: %s" % error)
+
+    def open(self, kind, name=""):
+        reply = self.request(OP_OPEN, OPEN.pack(kind) + name.encode("utf-8"))
+        return HANDLE.unpack(reply)[0]
+
+    def close(self):
+        self.sock.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def client():
+
+    # Returns the process wide connection to micropid, connecting on
+    # first use
+
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+        return _client
+
+
+class Motor:
+
+    # micropid backed version of micropi.Motor
+    # Arguments:
+    # motor = string motor pin label ("MOTOR1" to "MOTOR4")
+
+    def __init__(self, motor):
+        self.name = motor
+        self.client = client()
+        self.handle = self.client.open(KIND_MOTOR, motor)
+
+    def forward(self, speed):
+        self.client.request(OP_MOTOR_FORWARD, MOTOR.pack(self.handle, speed))
+
+    def reverse(self, speed):
+        self.client.request(OP_MOTOR_REVERSE, MOTOR.pack(self.handle, speed))
+
+    def stop(self):
+        self.client.request(OP_MOTOR_STOP, MOTOR.pack(self.handle, 0))
+
+
+class LinkedMotors:
+
+    # Links 2 or more micropid motors together as a set
+    # Arguments:
+    # *motors = a list of Motor objects
+
+    def __init__(self, *motors):
+        self.motor = list(motors)
+
+    def forward(self, speed):
+        for motor in self.motor:
+            motor.forward(speed)
+
+    def reverse(self, speed):
+        for motor in self.motor:
+            motor.reverse(speed)
+
+    def stop(self):
+        for motor in self.motor:
+            motor.stop()
+
+
+class LED:
+
+    # micropid backed version of micropi.LED
+
+    def __init__(self):
+        self.client = client()
+        self.handle = self.client.open(KIND_LED)
+
+    def set_color(self, led, red, green, blue):
+        self.client.request(OP_LED_SET, LED_COLOR.pack(self.handle, led % 4, red % 256,
+                                                       green % 256, blue % 256))
+
+
+class OLED:
+
+    # micropid backed version of micropi.OLED
+
+    def __init__(self):
+        self.client = client()
+        self.handle = self.client.open(KIND_OLED)
+
+    def print(self, line, str):
+        self.client.request(OP_OLED_PRINT, OLED_LINE.pack(self.handle, line) + str.encode("utf-8"))
+
+    def stats(self):
+        self.client.request(OP_OLED_STATS, HANDLE.pack(self.handle))
+
+    def img(self):
+        self.client.request(OP_OLED_IMG, HANDLE.pack(self.handle))
+
+
+class Sensor:
+
+    # micropid backed version of micropi.Sensor
+    # Arguments:
+    # sensortype = "IR1", "IR2" or "ULTRASONIC"
+    # boundary = minimum distance giving a Triggered response of True
+
+    Triggered = False
+
+    def __init__(self, sensortype, boundary):
+        self.sensortype = sensortype
+        self.boundary = boundary
+        self.lastRead = 0
+        self.client = client()
+        self.handle = self.client.open(KIND_SENSOR, sensortype)
+
+    def update(self, state, reading):
+        if state == NO_ECHO:
+            # no echo: keep the last distance
+            return
+        if self.sensortype == "ULTRASONIC":
+            self.lastRead = reading
+            self.Triggered = self.boundary > reading
+        else:
+            self.Triggered = state == 1
+
+    def read(self):
+        state, reading = READING.unpack(self.client.request(OP_SENSOR_READ,
+                                                            HANDLE.pack(self.handle)))
+        self.update(state, reading)
+
+    def iRCheck(self):
+        self.read()
+
+    def sonicCheck(self):
+        self.read()
+
+    def trigger(self):
+        self.read()
+
+    def subscribe(self, callback, period=0.1):
+
+        # Streams readings from the daemon.
+        # Triggered and lastRead are kept up to date and callback(sensor)
+        # is called from the client's dispatcher thread for every reading;
+        # it may make requests, e.g. stop a motor.
+        # Arguments:
+        # callback = function taking this Sensor, or None
+        # period = seconds between readings, from MIN_PERIOD to 65 s
+
+        if not MIN_PERIOD <= period <= 65.535:
+            raise ValueError("subscription period must be between %g and 65.535 s" % MIN_PERIOD)
+
+        def deliver(state, reading, stamp):
+            self.update(state, reading)
+            self.stamp = stamp
+            if callback is not None:
+                callback(self)
+
+        self.client.listeners[self.handle] = deliver
+        self.client.request(OP_SUBSCRIBE, SUBSCRIBE.pack(self.handle, int(period * 1000)))
+
+    def unsubscribe(self):
+        self.client.request(OP_UNSUBSCRIBE, HANDLE.pack(self.handle))
+        self.client.listeners.pop(self.handle, None)
+
+
+# ---------------Main------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MicroPi device daemon")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Unix socket path")
+    parser.add_argument("--group", help="group allowed to use the daemon (default: the daemon's own)")
+    parser.add_argument("--sim", action="store_true", help="use the simulated hardware backend")
+    args = parser.parse_args()
+    if args.sim:
+        import micropi_sim
+        micropi_sim.install()
+    try:
+        Daemon(args.socket, args.group).serve_forever()
+    except RuntimeError as error:
+        sys.exit(str(error))
@@ -0,0 +1,121 @@
+# Tests for micropi_grove against the simulated Grove sensors in
+# micropi_sim (SimBMP280, SimSHT31, SimADXL345, SimMPU6050).
+#
+#   python3 -m pytest tests        or        python3 -m unittest discover tests
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
+
+import micropi_sim
+
+sim = micropi_sim.install()
+
+import micropi
+import micropi_grove
+
+
+class GroveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = sim.bus()
+        self.saved = dict(self.bus.devices)
+        self.bmp280 = micropi_sim.SimBMP280(temperature=23.5, pressure=998.0)
+        self.sht31 = micropi_sim.SimSHT31(temperature=19.0, humidity=61.0)
+        self.adxl345 = micropi_sim.SimADXL345(acceleration=(0.25, -0.5, 1.0))
+        self.mpu6050 = micropi_sim.SimMPU6050(acceleration=(0.0, 0.5, -1.0), rotation=(10.0, -20.0, 30.0),
+                                              temperature=27.0)
+        for address, model in ((0x77, self.bmp280), (0x44, self.sht31),
+                               (0x53, self.adxl345), (0x68, self.mpu6050)):
+            self.bus.attach(address, model)
+        self.poller = micropi_grove.GrovePoller()
+
+    def tearDown(self):
+        self.poller.stop()
+        self.bus.devices.clear()
+        self.bus.devices.update(self.saved)
+
+    def test_blocks_merge_adjacent_fields(self):
+        (start, length, members), = micropi_grove.blocks(micropi_grove.MPU6050.fields)
+        self.assertEqual((start, length), (0x3B, 14))
+        self.assertEqual([name for name, offset, size in members], ["accel", "temperature", "gyro"])
+        command, = micropi_grove.blocks(micropi_grove.SHT31.fields)
+        self.assertEqual(command[:2], (b"\xe0\x00", 6))
+
+    def test_discover_finds_every_sensor(self):
+        found = self.poller.discover()
+        self.assertEqual(found[0x77], "bmp280")
+        self.assertEqual(found[0x44], "sht31")
+        self.assertEqual(found[0x53], "adxl345")
+        self.assertEqual(found[0x68], "mpu6050")
+        # a second scan does not add the same sensors again
+        self.poller.discover()
+        self.assertEqual(sorted(self.poller.sensors), ["adxl345", "bmp280", "mpu6050", "sht31"])
+
+    def test_mpu6050_reads_in_one_transaction(self):
+        self.poller.discover()
+        sensor = self.poller.sensors["mpu6050"]
+        before = self.mpu6050.reads
+        values = sensor.read()
+        self.assertEqual(self.mpu6050.reads - before, 1)
+        for got, wanted in zip(values["accel"], (0.0, 0.5, -1.0)):
+            self.assertAlmostEqual(got, wanted, places=3)
+        for got, wanted in zip(values["gyro"], (10.0, -20.0, 30.0)):
+            self.assertAlmostEqual(got, wanted, places=1)
+        self.assertAlmostEqual(values["temperature"], 27.0, places=1)
+
+    def test_decoded_values(self):
+        self.poller.discover()
+        sensors = self.poller.sensors
+        bmp280 = sensors["bmp280"].read()
+        self.assertAlmostEqual(bmp280["temperature"], 23.5, places=1)
+        self.assertAlmostEqual(bmp280["pressure"], 998.0, places=0)
+        sht31 = sensors["sht31"].read()
+        self.assertAlmostEqual(sht31["temperature"], 19.0, places=1)
+        self.assertAlmostEqual(sht31["humidity"], 61.0, places=1)
+        adxl345 = sensors["adxl345"].read()
+        self.assertAlmostEqual(adxl345["x"], 0.25, places=2)
+        self.assertAlmostEqual(adxl345["y"], -0.5, places=2)
+        self.assertAlmostEqual(adxl345["z"], 1.0, places=2)
+
+    def test_poller_publishes_readings(self):
+        self.poller.discover({"bmp280": 50, "sht31": 50})
+        self.poller.start()
+        deadline = time.monotonic() + 2.0
+        while len(self.poller.table()) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        table = self.poller.table()
+        self.assertEqual(sorted(table), ["adxl345", "bmp280", "mpu6050", "sht31"])
+        self.assertAlmostEqual(table["adxl345"].values["z"], 1.0, places=2)
+        stats = self.poller.stats()
+        self.assertEqual(stats["mpu6050"]["transactions_per_read"], 1)
+        self.assertEqual(stats["mpu6050"]["fields_per_read"], 3)
+
+    def test_failing_driver_does_not_stop_the_poller(self):
+
+        class Broken(micropi_grove.ADXL345):
+            name = "broken"
+
+            def decode(self, raw):
+                return {"x": 1 / 0}
+
+        self.poller.add(Broken(0x53, rate=50))
+        self.poller.add(micropi_grove.MPU6050(0x68, rate=50))
+        self.poller.start()
+        deadline = time.monotonic() + 2.0
+        while self.poller.latest("mpu6050") is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertTrue(self.poller.thread.is_alive())
+        self.assertIsNotNone(self.poller.latest("mpu6050"))
+        self.assertIsNone(self.poller.latest("broken"))
+        stats = self.poller.stats()
+        self.assertGreater(stats["broken"]["errors"], 0)
+        self.assertIn("division", stats["broken"]["last_error"])
+
+
+if __name__ == "__main__":
+    unittest.main()